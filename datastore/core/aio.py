@@ -0,0 +1,586 @@
+"""asyncio datastores.
+
+AsyncDatastore mirrors the Datastore interface with coroutines. Adapters go
+both ways: AsyncAdapter runs a (blocking) Datastore in a bounded executor,
+and SyncAdapter exposes an AsyncDatastore through the Datastore interface.
+The async shims and collections overlap I/O across tiers and shards.
+
+e.g.::
+
+    >>> import asyncio
+    >>> from datastore.core.aio import AsyncAdapter, AsyncShardedDatastore
+    >>> shards = [AsyncAdapter(FileSystemDatastore(p)) for p in paths]
+    >>> ds = AsyncShardedDatastore(shards)
+    >>> values = asyncio.run(ds.get_many(keys))  # all shards at once
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .query import Cursor
+from .serialize import (default_serializer,
+                        deserialized_gen, loads_many, dumps_many)
+from .sharding import ShardRouter
+from .stores import Datastore
+
+
+class AsyncDatastore(object):
+    """asyncio counterpart of Datastore. All operations are coroutines.
+
+    AsyncDatastore implementations MUST implement: get, put, delete, query
+    AsyncDatastore implementations may optionally implement: contains, and
+    the batch operations get_many, put_many, delete_many, contains_many
+
+    query returns a Cursor over results that have already been retrieved.
+    """
+    async def get(self, key):
+        """Return the object named by key or None if it does not exist.
+
+        :param key: Key object naming the object to retrieve
+        """
+        raise NotImplementedError
+
+    async def put(self, key, value):
+        """Stores the object value named by key.
+
+        :param key: Key object naming value to serialize & store
+        :param value: the value to serialize & store.
+        """
+        raise NotImplementedError
+
+    async def delete(self, key):
+        """Removes the object named by key.
+
+        :param key: Key naming the object to remove.
+        """
+        raise NotImplementedError
+
+    async def query(self, query):
+        """Returns a Cursor of objects matching criteria expressed in query.
+
+        :param query: Query object describing the objects to return.
+        """
+        raise NotImplementedError
+
+    async def contains(self, key):
+        """Returns whether the object named by key exists. The default
+        implementation pays the cost of a get.
+
+        :param key: Key object naming the object to check.
+        """
+        return (await self.get(key)) is not None
+
+    # batch operations. The defaults run the single key operations concurrently.
+    async def get_many(self, keys):
+        """Returns a list of the objects named by keys (None if missing)."""
+        return list(await asyncio.gather(*[self.get(key) for key in keys]))
+
+    async def put_many(self, items):
+        """Stores each object value named by key in items of (key, value)."""
+        await asyncio.gather(*[self.put(key, value) for key, value in items])
+
+    async def delete_many(self, keys):
+        """Removes the objects named by keys."""
+        await asyncio.gather(*[self.delete(key) for key in keys])
+
+    async def contains_many(self, keys):
+        """Returns a list of whether each object named by keys exists."""
+        return list(await asyncio.gather(*[self.contains(key) for key in keys]))
+
+
+def _check_async(store):
+    if not isinstance(store, AsyncDatastore):
+        raise TypeError("datastore must be of type {}. Got {}.".format(
+            AsyncDatastore, store))
+    return store
+
+
+def _materialized(query, cursor):
+    """Returns a Cursor over the (fully iterated) results of cursor."""
+    result = Cursor(query, list(cursor))
+    result.skipped = cursor.skipped
+    return result
+
+
+class AsyncAdapter(AsyncDatastore):
+    """Exposes a (blocking) Datastore as an AsyncDatastore, running its
+    operations in a bounded thread pool.
+
+    :param datastore: the Datastore to wrap.
+    :param executor: a concurrent.futures executor. Defaults to a new
+                     ThreadPoolExecutor with max_workers threads.
+    :param max_workers: bounds concurrent operations on datastore.
+    """
+    def __init__(self, datastore, executor=None, max_workers=8):
+        if not isinstance(datastore, Datastore):
+            raise TypeError("datastore must be of type {}. Got {}.".format(
+                Datastore, datastore))
+
+        self.datastore = datastore
+        self.executor = executor or ThreadPoolExecutor(max_workers)
+
+    async def _call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor,
+                                          functools.partial(fn, *args))
+
+    async def get(self, key):
+        return await self._call(self.datastore.get, key)
+
+    async def put(self, key, value):
+        await self._call(self.datastore.put, key, value)
+
+    async def delete(self, key):
+        await self._call(self.datastore.delete, key)
+
+    async def contains(self, key):
+        return await self._call(self.datastore.contains, key)
+
+    async def query(self, query):
+        def run():
+            return _materialized(query, self.datastore.query(query))
+        return await self._call(run)
+
+    async def get_many(self, keys):
+        return await self._call(self.datastore.get_many, list(keys))
+
+    async def put_many(self, items):
+        await self._call(self.datastore.put_many, list(items))
+
+    async def delete_many(self, keys):
+        await self._call(self.datastore.delete_many, list(keys))
+
+    async def contains_many(self, keys):
+        return await self._call(self.datastore.contains_many, list(keys))
+
+    def close(self):
+        """Shuts down the executor."""
+        self.executor.shutdown(wait=True)
+
+
+class SyncAdapter(Datastore):
+    """Exposes an AsyncDatastore as a (blocking) Datastore.
+
+    Coroutines run on `loop`, by default a private event loop in a daemon
+    thread. Do not call a SyncAdapter from a coroutine running on its own
+    loop: it would wait on itself forever.
+
+    :param datastore: the AsyncDatastore to wrap.
+    :param loop: an event loop running in another thread.
+    """
+    def __init__(self, datastore, loop=None):
+        self.datastore = _check_async(datastore)
+        self._thread = None
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=loop.run_forever)
+            self._thread.daemon = True
+            self._thread.start()
+        self.loop = loop
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def get(self, key):
+        return self._run(self.datastore.get(key))
+
+    def put(self, key, value):
+        self._run(self.datastore.put(key, value))
+
+    def delete(self, key):
+        self._run(self.datastore.delete(key))
+
+    def contains(self, key):
+        return self._run(self.datastore.contains(key))
+
+    def query(self, query):
+        return self._run(self.datastore.query(query))
+
+    def get_many(self, keys):
+        return self._run(self.datastore.get_many(list(keys)))
+
+    def put_many(self, items):
+        self._run(self.datastore.put_many(list(items)))
+
+    def delete_many(self, keys):
+        self._run(self.datastore.delete_many(list(keys)))
+
+    def contains_many(self, keys):
+        return self._run(self.datastore.contains_many(list(keys)))
+
+    def close(self):
+        """Stops the private event loop, if any."""
+        if self._thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self.loop.close()
+            self._thread = None
+
+
+class AsyncShimDatastore(AsyncDatastore):
+    """asyncio counterpart of ShimDatastore. Passes all calls to the child."""
+    def __init__(self, datastore):
+        self.child_datastore = _check_async(datastore)
+
+    async def get(self, key):
+        return await self.child_datastore.get(key)
+
+    async def put(self, key, value):
+        await self.child_datastore.put(key, value)
+
+    async def delete(self, key):
+        await self.child_datastore.delete(key)
+
+    async def contains(self, key):
+        return await self.child_datastore.contains(key)
+
+    async def query(self, query):
+        return await self.child_datastore.query(query)
+
+    async def get_many(self, keys):
+        return await self.child_datastore.get_many(keys)
+
+    async def put_many(self, items):
+        await self.child_datastore.put_many(items)
+
+    async def delete_many(self, keys):
+        await self.child_datastore.delete_many(keys)
+
+    async def contains_many(self, keys):
+        return await self.child_datastore.contains_many(keys)
+
+
+class AsyncCacheShimDatastore(AsyncShimDatastore):
+    """asyncio counterpart of CacheShimDatastore (without negative caching).
+    Reads fill the cache; writes go to the cache and the child concurrently.
+    """
+    def __init__(self, datastore, cache=None):
+        self.cache_datastore = _check_async(cache)
+        super(AsyncCacheShimDatastore, self).__init__(datastore)
+
+    async def get(self, key):
+        value = await self.cache_datastore.get(key)
+        if value is not None:
+            return value
+        value = await self.child_datastore.get(key)
+        if value is not None:
+            await self.cache_datastore.put(key, value)
+        return value
+
+    async def put(self, key, value):
+        await asyncio.gather(self.cache_datastore.put(key, value),
+                             self.child_datastore.put(key, value))
+
+    async def delete(self, key):
+        await asyncio.gather(self.cache_datastore.delete(key),
+                             self.child_datastore.delete(key))
+
+    async def contains(self, key):
+        return await self.cache_datastore.contains(key) \
+            or await self.child_datastore.contains(key)
+
+    async def get_many(self, keys):
+        keys = list(keys)
+        values = await self.cache_datastore.get_many(keys)
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing:
+            found = await self.child_datastore.get_many([keys[i] for i in missing])
+            for i, value in zip(missing, found):
+                values[i] = value
+            fill = [(keys[i], v) for i, v in zip(missing, found) if v is not None]
+            if fill:
+                await self.cache_datastore.put_many(fill)
+        return values
+
+    async def put_many(self, items):
+        items = list(items)
+        await asyncio.gather(self.cache_datastore.put_many(items),
+                             self.child_datastore.put_many(items))
+
+    async def delete_many(self, keys):
+        keys = list(keys)
+        await asyncio.gather(self.cache_datastore.delete_many(keys),
+                             self.child_datastore.delete_many(keys))
+
+    async def contains_many(self, keys):
+        keys = list(keys)
+        contains = await self.cache_datastore.contains_many(keys)
+        missing = [i for i, found in enumerate(contains) if not found]
+        if missing:
+            found = await self.child_datastore.contains_many(
+                [keys[i] for i in missing])
+            for i, exists in zip(missing, found):
+                contains[i] = exists
+        return contains
+
+
+class AsyncSerializerShimDatastore(AsyncShimDatastore):
+    """asyncio counterpart of SerializerShimDatastore.
+
+    :param datastore: a child AsyncDatastore.
+    :param serializer: a serializer object (responds to loads and dumps).
+    :param executor: an optional executor to (de)serialize in, keeping CPU
+                     bound work off the event loop.
+    """
+    serializer = default_serializer
+
+    def __init__(self, datastore, serializer=None, executor=None):
+        super(AsyncSerializerShimDatastore, self).__init__(datastore)
+        if serializer:
+            self.serializer = serializer
+        self.executor = executor
+
+    async def _call(self, fn, *args):
+        if self.executor is None:
+            return fn(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor,
+                                          functools.partial(fn, *args))
+
+    async def get(self, key):
+        value = await self.child_datastore.get(key)
+        if value is None:
+            return None
+        return await self._call(self.serializer.loads, value)
+
+    async def put(self, key, value):
+        if value is not None:
+            value = await self._call(self.serializer.dumps, value)
+        await self.child_datastore.put(key, value)
+
+    async def query(self, query):
+        """Returns a Cursor of deserialized objects matching query. As in
+        SerializerShimDatastore, filters and orders are applied here, over an
+        unconstrained query on the child datastore.
+        """
+        if not query.filters and not query.orders:
+            cursor = await self.child_datastore.query(query)
+            values = await self._call(lambda: list(deserialized_gen(
+                self.serializer, cursor._iterable)))
+            result = Cursor(query, values)
+            result.skipped = cursor.skipped
+            return result
+
+        child_query = query.__class__(query.key, query.object_getattr)
+        cursor = await self.child_datastore.query(child_query)
+        return await self._call(lambda: _materialized(
+            query, query(deserialized_gen(self.serializer, cursor))))
+
+    async def get_many(self, keys):
+        values = await self.child_datastore.get_many(keys)
+        present = [i for i, value in enumerate(values) if value is not None]
+        loaded = await self._call(loads_many, self.serializer,
+                                  [values[i] for i in present])
+        for i, value in zip(present, loaded):
+            values[i] = value
+        return values
+
+    async def put_many(self, items):
+        items = list(items)
+        present = [i for i, (key, value) in enumerate(items) if value is not None]
+        dumped = await self._call(dumps_many, self.serializer,
+                                  [items[i][1] for i in present])
+        values = [None] * len(items)
+        for i, value in zip(present, dumped):
+            values[i] = value
+        await self.child_datastore.put_many(
+            [(key, value) for (key, _), value in zip(items, values)])
+
+
+class AsyncDatastoreCollection(AsyncDatastore):
+    """asyncio counterpart of DatastoreCollection."""
+    def __init__(self, stores=[]):
+        self._stores = [_check_async(store) for store in stores]
+
+    def datastore(self, index):
+        """Returns the datastore at `index`."""
+        return self._stores[index]
+
+    def appendDatastore(self, store):
+        """Appends datastore `store` to this collection."""
+        self._stores.append(_check_async(store))
+
+    def removeDatastore(self, store):
+        """Removes datastore `store` from this collection."""
+        self._stores.remove(store)
+
+    def insertDatastore(self, index, store):
+        """Inserts datastore `store` into this collection at `index`."""
+        self._stores.insert(index, _check_async(store))
+
+
+class AsyncTieredDatastore(AsyncDatastoreCollection):
+    """asyncio counterpart of TieredDatastore. Tiers are read in order, but
+    writes, deletes and promotions to higher tiers run concurrently.
+    """
+    async def get(self, key):
+        for tier, store in enumerate(self._stores):
+            value = await store.get(key)
+            if value is not None:
+                await asyncio.gather(*[upper.put(key, value)
+                                       for upper in self._stores[:tier]])
+                return value
+        return None
+
+    async def put(self, key, value):
+        await asyncio.gather(*[store.put(key, value) for store in self._stores])
+
+    async def delete(self, key):
+        await asyncio.gather(*[store.delete(key) for store in self._stores])
+
+    async def contains(self, key):
+        for store in self._stores:
+            if await store.contains(key):
+                return True
+        return False
+
+    async def query(self, query):
+        return await self._stores[-1].query(query)
+
+    async def get_many(self, keys):
+        keys = list(keys)
+        values = [None] * len(keys)
+        missing = list(range(len(keys)))
+        for tier, store in enumerate(self._stores):
+            if not missing:
+                break
+            found = await store.get_many([keys[i] for i in missing])
+            promote = [(keys[i], v) for i, v in zip(missing, found) if v is not None]
+            for i, value in zip(missing, found):
+                values[i] = value
+            missing = [i for i, value in zip(missing, found) if value is None]
+            if promote:
+                await asyncio.gather(*[upper.put_many(promote)
+                                       for upper in self._stores[:tier]])
+        return values
+
+    async def put_many(self, items):
+        items = list(items)
+        await asyncio.gather(*[store.put_many(items) for store in self._stores])
+
+    async def delete_many(self, keys):
+        keys = list(keys)
+        await asyncio.gather(*[store.delete_many(keys) for store in self._stores])
+
+    async def contains_many(self, keys):
+        keys = list(keys)
+        contains = [False] * len(keys)
+        missing = list(range(len(keys)))
+        for store in self._stores:
+            if not missing:
+                break
+            found = await store.contains_many([keys[i] for i in missing])
+            for i, exists in zip(missing, found):
+                contains[i] = exists
+            missing = [i for i, exists in zip(missing, found) if not exists]
+        return contains
+
+
+class AsyncShardedDatastore(AsyncDatastoreCollection):
+    """asyncio counterpart of ShardedDatastore. Batches and queries run on
+    all involved shards concurrently.
+    """
+    def __init__(self, stores=[], shardingfn=hash, placement=None,
+                 names=None, weights=None, cache_size=100000):
+        super(AsyncShardedDatastore, self).__init__(stores)
+        self._router = ShardRouter(shardingfn, placement, cache_size)
+        names = names or [None] * len(self._stores)
+        weights = weights or [1] * len(self._stores)
+        if not len(names) == len(weights) == len(self._stores):
+            raise ValueError('names and weights must match stores.')
+        for index, (name, weight) in enumerate(zip(names, weights)):
+            self._router.insert(index, name, weight)
+
+    def appendDatastore(self, store, name=None, weight=1):
+        """Appends datastore `store` as a new shard."""
+        super(AsyncShardedDatastore, self).appendDatastore(store)
+        self._router.insert(len(self._stores) - 1, name, weight)
+
+    def removeDatastore(self, store):
+        """Removes shard `store`."""
+        index = self._stores.index(store)
+        super(AsyncShardedDatastore, self).removeDatastore(store)
+        self._router.remove(index)
+
+    def insertDatastore(self, index, store, name=None, weight=1):
+        """Inserts datastore `store` as a new shard at `index`."""
+        super(AsyncShardedDatastore, self).insertDatastore(index, store)
+        self._router.insert(index, name, weight)
+
+    def shard(self, key):
+        """Returns the shard index to handle `key`."""
+        return self._router.shard(key)
+
+    def shardDatastore(self, key):
+        """Returns the shard to handle `key`."""
+        return self.datastore(self.shard(key))
+
+    async def get(self, key):
+        return await self.shardDatastore(key).get(key)
+
+    async def put(self, key, value):
+        await self.shardDatastore(key).put(key, value)
+
+    async def delete(self, key):
+        await self.shardDatastore(key).delete(key)
+
+    async def contains(self, key):
+        return await self.shardDatastore(key).contains(key)
+
+    def _group_by_shard(self, keys):
+        groups = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(self.shard(key), []).append(i)
+        return groups
+
+    async def _scatter(self, method, keys, args):
+        """Calls method on each shard with its part of args (one batch per
+        shard, concurrently). Returns results in the order of keys.
+        """
+        groups = self._group_by_shard(keys)
+        calls = [getattr(self.datastore(shard), method)(
+                     [args[i] for i in positions])
+                 for shard, positions in groups.items()]
+        results = [None] * len(keys)
+        for positions, found in zip(groups.values(), await asyncio.gather(*calls)):
+            if found is not None:
+                for i, value in zip(positions, found):
+                    results[i] = value
+        return results
+
+    async def get_many(self, keys):
+        keys = list(keys)
+        return await self._scatter('get_many', keys, keys)
+
+    async def put_many(self, items):
+        items = list(items)
+        await self._scatter('put_many', [key for key, _ in items], items)
+
+    async def delete_many(self, keys):
+        keys = list(keys)
+        await self._scatter('delete_many', keys, keys)
+
+    async def contains_many(self, keys):
+        keys = list(keys)
+        return [bool(c) for c in await self._scatter('contains_many', keys, keys)]
+
+    async def query(self, query):
+        """Queries all shards concurrently. Each shard returns up to
+        offset + limit matches, and offset/limit/order are applied over the
+        combined results.
+        """
+        shard_query = query.copy()
+        shard_query.offset = 0
+        if query.limit is not None:
+            shard_query.limit = query.offset + query.limit
+
+        cursors = await asyncio.gather(*[store.query(shard_query)
+                                         for store in self._stores])
+        items = [item for cursor in cursors for item in cursor]
+
+        cursor = Cursor(query, items)
+        cursor.apply_order()
+        cursor.apply_offset()
+        cursor.apply_limit()
+        return cursor
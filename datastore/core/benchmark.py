@@ -0,0 +1,317 @@
+"""Micro-benchmarks for picking datastore components from measured numbers.
+
+Run as a script to print a report (optionally giving the number of
+serialized records, and of objects put in a DictDatastore)::
+
+    python -m datastore.core.benchmark 10000 10000000
+"""
+import json
+import random
+import sys
+import threading
+import time
+
+from . import serialize
+
+
+def representative_records(count=1000, seed=0):
+    """Returns `count` plain-data records resembling typical stored objects."""
+    rand = random.Random(seed)
+    words = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf']
+    records = []
+    for i in range(count):
+        records.append({
+            'key': '/records/record:{}'.format(i),
+            'name': ' '.join(rand.choice(words) for _ in range(3)),
+            'count': rand.randint(0, 1 << 20),
+            'score': rand.random() * 100,
+            'active': rand.random() > 0.5,
+            'tags': rand.sample(words, 3),
+            'attributes': {'version': rand.randint(1, 9), 'owner': None},
+        })
+    return records
+
+
+def metric_records(count=1000, seed=0):
+    """Returns `count` homogeneous metric records, with their struct schema."""
+    rand = random.Random(seed)
+    schema = [('host', 'str'), ('metric', 'str'), ('time', 'q'),
+              ('value', 'd'), ('count', 'I')]
+    records = []
+    for i in range(count):
+        records.append({
+            'host': 'web-{}'.format(rand.randint(1, 64)),
+            'metric': rand.choice(['cpu', 'mem', 'disk', 'net']),
+            'time': 1500000000000 + i * 1000,
+            'value': rand.random() * 100,
+            'count': rand.randint(0, 1000),
+        })
+    return records, schema
+
+
+def default_serializers():
+    """Returns the (name, serializer) pairs benchmarked by default."""
+    return [
+        ('json', json),
+        ('prettyjson', serialize.prettyjson),
+        ('pickle', serialize.PickleSerializer),
+        ('marshal', serialize.MarshalSerializer),
+        ('tagged', serialize.TaggedSerializer),
+        ('json+zlib', serialize.Stack([json, serialize.ZlibSerializer()])),
+        ('json+lzma', serialize.Stack([json, serialize.LzmaSerializer()])),
+    ]
+
+
+def _best_time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return max(best, 1e-9)
+
+
+def benchmark_serializer(serializer, records, repeat=3):
+    """Returns a dict of throughput and size measurements for `serializer`.
+
+    :param serializer: a serializer object (responds to loads and dumps).
+    :param records: the values to serialize.
+    :param repeat: number of timing runs; the best run is reported.
+    """
+    dumps, loads = serializer.dumps, serializer.loads
+    serialized = [dumps(record) for record in records]
+    size = sum(len(value) for value in serialized)
+
+    dumps_time = _best_time(lambda: [dumps(r) for r in records], repeat)
+    loads_time = _best_time(lambda: [loads(v) for v in serialized], repeat)
+
+    return {
+        'dumps_per_sec': len(records) / dumps_time,
+        'loads_per_sec': len(records) / loads_time,
+        'dumps_mb_per_sec': size / dumps_time / 1e6,
+        'loads_mb_per_sec': size / loads_time / 1e6,
+        'bytes_per_record': float(size) / max(len(records), 1),
+    }
+
+
+def benchmark_serializers(serializers=None, records=None, repeat=3):
+    """Returns a list of (name, results) for each of `serializers`.
+
+    :param serializers: (name, serializer) pairs. Defaults to all the stdlib
+                        based serializers shipped with datastore.
+    :param records: the values to serialize. Defaults to
+                    representative_records().
+    """
+    if serializers is None:
+        serializers = default_serializers()
+    if records is None:
+        records = representative_records()
+    return [(name, benchmark_serializer(serializer, records, repeat))
+            for name, serializer in serializers]
+
+
+def benchmark_filtered_query(serializer, records, selectivity=0.01, repeat=3):
+    """Returns query throughput over a SerializerShimDatastore with a filter
+    matching `selectivity` of records, eager and lazy (LazyValue proxies).
+    """
+    from .key import Key
+    from .query import Query
+    from .stores import DictDatastore
+
+    key = Key('/records')
+    cutoff = sorted(r['count'] for r in records)[
+        min(int(len(records) * selectivity), len(records) - 1)]
+
+    results = {}
+    for lazy in (False, True):
+        shim = serialize.SerializerShimDatastore(DictDatastore(), serializer,
+                                                 lazy=lazy)
+        for i, record in enumerate(records):
+            shim.put(key.child(i), record)
+
+        def run():
+            query = Query(key).add_filter('count', '<', cutoff)
+            return [r['name'] for r in shim.query(query)]
+
+        elapsed = _best_time(run, repeat)
+        results['lazy' if lazy else 'eager'] = len(records) / elapsed
+    return results
+
+
+def benchmark_datastore(datastore, count=10000000, chunk=100000):
+    """Returns put, get (hits and misses) and contains throughput of
+    `datastore` as it fills up to `count` objects, and its memory use per
+    object (if it has memory_usage(), like DictDatastore).
+
+    Keys are built `chunk` at a time, outside the timed sections, so
+    benchmarking 10M objects does not hold 10M Key objects.
+    """
+    from .key import Key
+
+    times = {'put': 0.0, 'get': 0.0, 'get_miss': 0.0, 'contains': 0.0}
+    put, get, contains = datastore.put, datastore.get, datastore.contains
+    for begin in range(0, count, chunk):
+        keys = [Key('/records/record:{}'.format(i))
+                for i in range(begin, min(begin + chunk, count))]
+        missing = [Key('/missing/record:{}'.format(i))
+                   for i in range(begin, begin + len(keys))]
+
+        start = time.perf_counter()
+        for key in keys:
+            put(key, 1)
+        times['put'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for key in keys:
+            get(key)
+        times['get'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for key in missing:
+            get(key)
+        times['get_miss'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for key in keys:
+            contains(key)
+        times['contains'] += time.perf_counter() - start
+
+    results = dict((name + '_per_sec', count / max(elapsed, 1e-9))
+                   for name, elapsed in times.items())
+    if hasattr(datastore, 'memory_usage'):
+        results['bytes_per_entry'] = datastore.memory_usage() / float(max(count, 1))
+    return results
+
+
+def benchmark_threads(datastore, threads=1, operations=100000,
+                      read_ratio=0.9, count=10000, seed=0):
+    """Returns the throughput (operations per second, all threads combined)
+    of `threads` threads each running `operations` gets and puts (a
+    `read_ratio` fraction of gets) on `count` keys of `datastore`.
+    """
+    from .key import Key
+
+    keys = [Key('/records/record:{}'.format(i)) for i in range(count)]
+    for key in keys:
+        datastore.put(key, 0)
+
+    rand = random.Random(seed)
+    plans = [[(rand.random() < read_ratio, rand.choice(keys))
+              for _ in range(operations)] for _ in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def run(plan):
+        get, put = datastore.get, datastore.put
+        barrier.wait()
+        for read, key in plan:
+            if read:
+                get(key)
+            else:
+                put(key, 1)
+
+    workers = [threading.Thread(target=run, args=(plan,)) for plan in plans]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return threads * operations / max(time.perf_counter() - start, 1e-9)
+
+
+def benchmark_concurrency(threads=(1, 2, 4, 8), operations=100000):
+    """Returns [(threads, striped, global_lock)] throughputs of a
+    ConcurrentDictDatastore, and of a DictDatastore behind one lock taken
+    by every operation.
+    """
+    from .memory import ConcurrentDictDatastore
+
+    results = []
+    for n in threads:
+        striped = benchmark_threads(ConcurrentDictDatastore(), n, operations)
+        locked = benchmark_threads(_GlobalLockDatastore(), n, operations)
+        results.append((n, striped, locked))
+    return results
+
+
+class _GlobalLockDatastore(object):
+    """A DictDatastore behind a single lock, as a benchmark baseline."""
+    def __init__(self):
+        from .stores import DictDatastore
+        self._datastore = DictDatastore()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._datastore.get(key)
+
+    def put(self, key, value):
+        with self._lock:
+            self._datastore.put(key, value)
+
+
+def fastest(results, metric='loads_per_sec'):
+    """Returns the name of the best entry of `results` under `metric`.
+    Rates are maximized; `bytes_per_record` is minimized.
+    """
+    sign = -1 if metric == 'bytes_per_record' else 1
+    return max(results, key=lambda item: sign * item[1][metric])[0]
+
+
+def format_results(results):
+    """Returns a text table for benchmark `results`."""
+    columns = ['dumps_per_sec', 'loads_per_sec', 'dumps_mb_per_sec',
+               'loads_mb_per_sec', 'bytes_per_record']
+    lines = ['{:<12}'.format('name') + ''.join('{:>18}'.format(c) for c in columns)]
+    for name, result in results:
+        lines.append('{:<12}'.format(name) +
+                     ''.join('{:>18.1f}'.format(result[c]) for c in columns))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if argv else 10000
+    datastore_count = int(argv[1]) if len(argv) > 1 else 10000000
+    results = benchmark_serializers(records=representative_records(count))
+    print(format_results(results))
+    print('fastest loads: {}'.format(fastest(results, 'loads_per_sec')))
+    print('fastest dumps: {}'.format(fastest(results, 'dumps_per_sec')))
+    print('smallest:      {}'.format(fastest(results, 'bytes_per_record')))
+
+    records, schema = metric_records(count)
+    struct_serializer = serialize.StructSerializer(schema)
+    results = benchmark_serializers([
+        ('json', json),
+        ('marshal', serialize.MarshalSerializer),
+        ('struct', struct_serializer),
+        ('struct+zlib', serialize.Stack([struct_serializer,
+                                         serialize.ZlibSerializer()])),
+    ], records)
+    print('')
+    print('homogeneous metric records:')
+    print(format_results(results))
+
+    records = representative_records(min(count, 10000))
+    for name, serializer in [('json', json), ('tagged', serialize.TaggedSerializer)]:
+        scan = benchmark_filtered_query(serializer, records)
+        print('1% filtered scan, {}: {:.0f} records/sec eager, {:.0f} lazy'.format(
+            name, scan['eager'], scan['lazy']))
+
+    from .stores import DictDatastore
+    results = benchmark_datastore(DictDatastore(), datastore_count)
+    print('')
+    print('DictDatastore, {} objects:'.format(datastore_count))
+    for name in ['put', 'get', 'get_miss', 'contains']:
+        print('{:<12}{:>18.0f} ops/sec'.format(name, results[name + '_per_sec']))
+    print('{:<12}{:>18.1f} bytes/object'.format('memory', results['bytes_per_entry']))
+
+    print('')
+    print('threads, 90% reads:    striped ops/sec  global lock ops/sec')
+    for threads, striped, locked in benchmark_concurrency():
+        print('{:<12}{:>18.0f}{:>18.0f}'.format(threads, striped, locked))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,436 @@
+"""Bounded in-memory caches with pluggable eviction policies.
+
+e.g.::
+
+    >>> from datastore.core.cache import CacheDatastore, ARCPolicy
+    >>> cache = CacheDatastore(1000, policy=ARCPolicy())
+    >>> ds = TieredDatastore([cache, mongo, fs])
+
+A policy tracks cached keys (strings) and picks eviction victims. Policies
+implement:
+
+* hit(key): key was read (or overwritten) in the cache.
+* miss(key): key was looked up but is not cached.
+* insert(key): key was added to the cache.
+* remove(key): key was removed from the cache (not evicted).
+* victim(): returns the key evict() would remove, or None.
+* evict(): removes and returns the next victim.
+* admit(key): returns whether key may displace victim() when full.
+
+All operations are O(1) (LFUPolicy amortized).
+"""
+import collections
+import sys
+
+from .key import Key
+from .stores import Datastore
+
+
+class LRUPolicy(object):
+    """Evicts the least recently used key."""
+    def __init__(self):
+        self._order = collections.OrderedDict()
+
+    def hit(self, key):
+        self._order.move_to_end(key)
+
+    def miss(self, key):
+        pass
+
+    def insert(self, key):
+        self._order[key] = None
+
+    def remove(self, key):
+        self._order.pop(key, None)
+
+    def victim(self):
+        return next(iter(self._order), None)
+
+    def evict(self):
+        return self._order.popitem(last=False)[0]
+
+    def admit(self, key):
+        return True
+
+    def __len__(self):
+        return len(self._order)
+
+
+class LFUPolicy(object):
+    """Evicts the least frequently used key, least recently used first among
+    keys of equal frequency. Keys are kept in per-frequency buckets.
+    """
+    def __init__(self):
+        self._freq = {}
+        self._buckets = {}
+        self._min = 0
+
+    def _bucket(self, freq):
+        bucket = self._buckets.get(freq)
+        if bucket is None:
+            bucket = self._buckets[freq] = collections.OrderedDict()
+        return bucket
+
+    def _unlink(self, key, freq):
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
+
+    def _min_bucket(self):
+        if self._min not in self._buckets:
+            self._min = min(self._buckets) if self._buckets else 0
+        return self._buckets.get(self._min)
+
+    def hit(self, key):
+        freq = self._freq[key]
+        self._unlink(key, freq)
+        self._freq[key] = freq + 1
+        self._bucket(freq + 1)[key] = None
+        if self._min == freq and freq not in self._buckets:
+            self._min = freq + 1
+
+    def miss(self, key):
+        pass
+
+    def insert(self, key):
+        self._freq[key] = 1
+        self._bucket(1)[key] = None
+        self._min = 1
+
+    def remove(self, key):
+        freq = self._freq.pop(key, None)
+        if freq is not None:
+            self._unlink(key, freq)
+
+    def victim(self):
+        bucket = self._min_bucket()
+        return next(iter(bucket)) if bucket else None
+
+    def evict(self):
+        bucket = self._min_bucket()
+        key = bucket.popitem(last=False)[0]
+        if not bucket:
+            del self._buckets[self._min]
+        del self._freq[key]
+        return key
+
+    def admit(self, key):
+        return True
+
+    def __len__(self):
+        return len(self._freq)
+
+
+class ARCPolicy(object):
+    """Adaptive Replacement Cache (Megiddo & Modha). Balances recency (T1) and
+    frequency (T2), adapting the target size of T1 with hits on the ghost
+    lists of recently evicted keys (B1, B2).
+    """
+    def __init__(self):
+        self._t1 = collections.OrderedDict()
+        self._t2 = collections.OrderedDict()
+        self._b1 = collections.OrderedDict()
+        self._b2 = collections.OrderedDict()
+        self.p = 0.0
+
+    def hit(self, key):
+        if key in self._t1:
+            del self._t1[key]
+            self._t2[key] = None
+        else:
+            self._t2.move_to_end(key)
+
+    def miss(self, key):
+        pass
+
+    def insert(self, key):
+        size = len(self._t1) + len(self._t2) + 1
+        if key in self._b1:
+            delta = max(len(self._b2) / float(len(self._b1)), 1.0)
+            self.p = min(self.p + delta, float(size))
+            del self._b1[key]
+            self._t2[key] = None
+        elif key in self._b2:
+            delta = max(len(self._b1) / float(len(self._b2)), 1.0)
+            self.p = max(self.p - delta, 0.0)
+            del self._b2[key]
+            self._t2[key] = None
+        else:
+            self._t1[key] = None
+
+    def remove(self, key):
+        self._t1.pop(key, None)
+        self._t2.pop(key, None)
+
+    def _from_t1(self):
+        return bool(self._t1) and (len(self._t1) > self.p or not self._t2)
+
+    def victim(self):
+        if self._from_t1():
+            return next(iter(self._t1))
+        return next(iter(self._t2), None)
+
+    def evict(self):
+        size = len(self._t1) + len(self._t2)
+        if self._from_t1():
+            key = self._t1.popitem(last=False)[0]
+            self._b1[key] = None
+        else:
+            key = self._t2.popitem(last=False)[0]
+            self._b2[key] = None
+
+        # ghost lists remember at most as many keys as are cached.
+        while len(self._b1) + len(self._b2) > size:
+            ghosts = self._b1 if len(self._b1) >= len(self._b2) else self._b2
+            ghosts.popitem(last=False)
+        return key
+
+    def admit(self, key):
+        return True
+
+    def __len__(self):
+        return len(self._t1) + len(self._t2)
+
+
+class FrequencySketch(object):
+    """Count-min sketch of access frequencies with small saturating counters.
+    Counters are halved every `sample` increments, so old popularity fades.
+
+    :param width: counters per row.
+    :param depth: number of rows (hash functions).
+    :param sample: increments between agings. Defaults to 10 * width.
+    """
+    _seeds = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F,
+              0x165667B19E3779F9, 0xD6E8FEB86659FD93,
+              0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53)
+    maximum = 15
+
+    def __init__(self, width=4096, depth=4, sample=None):
+        if not 0 < depth <= len(self._seeds):
+            raise ValueError('depth must be in 1..{}'.format(len(self._seeds)))
+        self.width = width
+        self.depth = depth
+        self.sample = sample or 10 * width
+        self._rows = [[0] * width for _ in range(depth)]
+        self._additions = 0
+
+    def _indexes(self, item):
+        h = hash(item) & 0xFFFFFFFFFFFFFFFF
+        width = self.width
+        return [((h ^ seed) * 0x2545F4914F6CDD1D >> 29) % width
+                for seed in self._seeds[:self.depth]]
+
+    def increment(self, item):
+        """Counts one access to item."""
+        for row, i in zip(self._rows, self._indexes(item)):
+            if row[i] < self.maximum:
+                row[i] += 1
+        self._additions += 1
+        if self._additions >= self.sample:
+            self.age()
+
+    def estimate(self, item):
+        """Returns the (over-)estimated access count of item."""
+        return min(row[i] for row, i in zip(self._rows, self._indexes(item)))
+
+    def age(self):
+        """Halves all counters."""
+        for row in self._rows:
+            row[:] = [count >> 1 for count in row]
+        self._additions >>= 1
+
+
+class TinyLFUPolicy(object):
+    """TinyLFU admission in front of an eviction policy: when the cache is
+    full, a new key is only admitted if it was accessed more often (per a
+    FrequencySketch) than the key it would evict. Keeps one-hit wonders from
+    flushing a popular working set.
+
+    :param policy: the eviction policy. Defaults to LRUPolicy.
+    :param width: FrequencySketch width; about the number of cached entries.
+    """
+    def __init__(self, policy=None, width=4096, depth=4, sample=None):
+        self.policy = LRUPolicy() if policy is None else policy
+        self.sketch = FrequencySketch(width, depth, sample)
+
+    def hit(self, key):
+        self.sketch.increment(key)
+        self.policy.hit(key)
+
+    def miss(self, key):
+        self.sketch.increment(key)
+        self.policy.miss(key)
+
+    def insert(self, key):
+        self.policy.insert(key)
+
+    def remove(self, key):
+        self.policy.remove(key)
+
+    def victim(self):
+        return self.policy.victim()
+
+    def evict(self):
+        return self.policy.evict()
+
+    def admit(self, key):
+        victim = self.policy.victim()
+        if victim is None:
+            return True
+        return self.sketch.estimate(key) > self.sketch.estimate(victim)
+
+    def __len__(self):
+        return len(self.policy)
+
+
+def estimate_size(value):
+    """Returns a rough estimate of the memory held by `value`, in bytes,
+    following containers (list, tuple, set, dict) one object at a time.
+    """
+    size = 0
+    stack = [value]
+    seen = set()
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return size
+
+
+class CacheDatastore(Datastore):
+    """Bounded in-memory datastore, evicting objects per `policy` when full.
+
+    Capacity is a number of entries, or with `sizefn`, a number of bytes as
+    estimated by sizefn(value) (e.g. estimate_size, or len for strings).
+    Objects larger than the capacity are not cached.
+
+    Queries scan all cached objects: the cache is meant to be the top tier of
+    a TieredDatastore or the cache of a CacheShimDatastore, which query the
+    backing store instead.
+
+    :param capacity: the maximum number of entries (or bytes, with sizefn).
+    :param policy: an eviction policy object. Defaults to LRUPolicy().
+    :param sizefn: a function returning the size of a value.
+    """
+    def __init__(self, capacity=1000, policy=None, sizefn=None):
+        if capacity <= 0:
+            raise ValueError('capacity must be positive. Got {}.'.format(capacity))
+
+        self.capacity = capacity
+        self.policy = LRUPolicy() if policy is None else policy
+        self.sizefn = sizefn
+        self.size = 0
+        self.stats = collections.Counter()
+        self._items = {}
+        self._sizes = {} if sizefn else None
+
+    @property
+    def hit_rate(self):
+        """Fraction of gets served from the cache."""
+        lookups = self.stats['hits'] + self.stats['misses']
+        return float(self.stats['hits']) / lookups if lookups else 0.0
+
+    def get(self, key):
+        """Return the object named by `key` or None if it is not cached.
+
+        :param key: Key naming the object to retrieve.
+        """
+        k = str(key)
+        try:
+            value = self._items[k]
+        except KeyError:
+            self.stats['misses'] += 1
+            self.policy.miss(k)
+            return None
+        self.stats['hits'] += 1
+        self.policy.hit(k)
+        return value
+
+    def put(self, key, value):
+        """Stores the object `value` named by `key`, evicting other objects as
+        needed (and as the policy's admission allows).
+
+        :param key: Key naming `value`
+        :param value: the object to store.
+        """
+        if value is None:
+            return self.delete(key)
+
+        k = str(key)
+        size = self.sizefn(value) if self.sizefn else 1
+        if size > self.capacity:
+            self.stats['rejections'] += 1
+            return self.delete(key)
+
+        cached = k in self._items
+        if cached:
+            # an overwrite is an access: keep (and bump) the key's policy state.
+            self._remove(k)
+            self.policy.hit(k)
+        elif self.size + size > self.capacity and not self.policy.admit(k):
+            self.stats['rejections'] += 1
+            return
+
+        while self.size + size > self.capacity:
+            victim = self.policy.evict()
+            if victim == k:
+                cached = False  # the grown value displaced itself; re-insert.
+            else:
+                self._remove(victim)
+            self.stats['evictions'] += 1
+
+        self._items[k] = value
+        if self._sizes is not None:
+            self._sizes[k] = size
+        self.size += size
+        if not cached:
+            self.policy.insert(k)
+
+    def _remove(self, k):
+        del self._items[k]
+        self.size -= self._sizes.pop(k) if self._sizes is not None else 1
+
+    def delete(self, key):
+        """Removes the object named by `key`, if cached.
+
+        :param key: Key naming the object to remove.
+        """
+        k = str(key)
+        if k in self._items:
+            self._remove(k)
+            self.policy.remove(k)
+
+    def contains(self, key):
+        """Returns whether the object named by `key` is cached. Does not
+        count as an access.
+
+        :param key: Key naming the object to check.
+        """
+        return str(key) in self._items
+
+    def query(self, query):
+        """Returns an iterable of cached objects matching criteria in `query`,
+        among the objects whose key path is query.key.
+
+        :param query: Query object describing the objects to return.
+        """
+        path = str(query.key)
+        values = [value for k, value in list(self._items.items())
+                  if str(Key(k).path) == path]
+        return query(values)
+
+    def clear(self):
+        """Removes all cached objects (keeps statistics)."""
+        for k in list(self._items):
+            self.delete(k)
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,289 @@
+"""Time-to-live for datastore objects.
+
+e.g.::
+
+    >>> from datastore.core.expiring import ExpiringDatastore
+    >>> sessions = ExpiringDatastore(serialize.shim(fs), ttl=3600)
+    >>> sessions.put(Key('/session:abc'), {'user': 'bruce'})
+    >>> sessions.put(Key('/limit:bruce'), 10, ttl=60)
+    >>> sessions.start()  # reclaim expired objects in the background
+"""
+import collections
+import heapq
+import threading
+import time
+
+from .key import Key
+from .stores import ShimDatastore
+
+
+EXPIRES = '@expires'
+VALUE = '@value'
+
+
+class ExpiringDatastore(ShimDatastore):
+    """Shim attaching a time-to-live to each put.
+
+    Objects are stored in the child datastore in an envelope::
+
+        {'@expires': <unix time or None>, '@value': <object>}
+
+    so the child needs to store dicts (e.g. a DictDatastore, or a
+    FileSystemDatastore behind a SerializerShimDatastore). Expired objects are
+    hidden from get, contains and query, and deleted when read. A heap of
+    expiry times reclaims the objects put through this shim incrementally:
+    reap() deletes at most `batch` expired objects per call, and start() runs
+    it in a background thread. Objects already in the child (put before a
+    restart, or by another process) join the heap with rebuild(), which
+    start() calls. An object is only deleted after re-reading it under the
+    lock, and not while a put through this shim is writing it, so a put made
+    meanwhile is never deleted.
+
+    :param datastore: the child datastore.
+    :param ttl: default time-to-live in seconds. None never expires.
+    :param batch: maximum number of objects deleted per reap() call.
+    :param clock: returns the current time, in seconds.
+    """
+    def __init__(self, datastore, ttl=None, batch=100, clock=time.time):
+        super(ExpiringDatastore, self).__init__(datastore)
+        self.ttl = ttl
+        self.batch = batch
+        self.clock = clock
+        self.reaped = 0
+        self._heap = []
+        self._expires = {}
+        self._writing = collections.Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _expired(self, envelope, now):
+        expires = envelope.get(EXPIRES)
+        return expires is not None and expires <= now
+
+    def _unwrap(self, key, envelope, now):
+        """Returns the object in envelope, or None if it expired (deleting it)."""
+        if envelope is None:
+            return None
+        if not isinstance(envelope, dict) or VALUE not in envelope:
+            return envelope  # not written by an ExpiringDatastore; never expires.
+        if self._expired(envelope, now):
+            self._delete_expired([key], now)
+            return None
+        return envelope[VALUE]
+
+    def _delete_expired(self, keys, now):
+        """Deletes the objects named by keys that are still expired: puts
+        register under the lock before writing the child, and deregister after,
+        so re-reading under the lock sees any put finished since they were
+        read, and keys still being written (or with a newer expiry) are
+        skipped. Returns the number of objects deleted.
+        """
+        with self._lock:
+            expired = []
+            envelopes = self.child_datastore.get_many(keys)
+            for key, envelope in zip(keys, envelopes):
+                if not isinstance(envelope, dict) or VALUE not in envelope:
+                    continue
+                k, expires = str(key), envelope.get(EXPIRES)
+                if self._writing[k] or self._expires.get(k, expires) != expires:
+                    continue  # renewed by a put through this shim.
+                if self._expired(envelope, now):
+                    expired.append(key)
+                    if self._expires.get(k) == expires:
+                        del self._expires[k]
+                elif expires is not None and k not in self._expires:
+                    # renewed outside this shim; track its new expiry.
+                    self._expires[k] = expires
+                    heapq.heappush(self._heap, (expires, k))
+            if expired:
+                self.child_datastore.delete_many(expired)
+        return len(expired)
+
+    def _wrap(self, key, value, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else self.clock() + ttl
+        k = str(key)
+        with self._lock:
+            self._writing[k] += 1
+            if expires is None:
+                self._expires.pop(k, None)
+            else:
+                self._expires[k] = expires
+                heapq.heappush(self._heap, (expires, k))
+        return {EXPIRES: expires, VALUE: value}
+
+    def _written(self, keys):
+        """Deregisters the puts of keys (wrapped by _wrap) once written."""
+        with self._lock:
+            for key in keys:
+                k = str(key)
+                self._writing[k] -= 1
+                if not self._writing[k]:
+                    del self._writing[k]
+
+    def _forget(self, key):
+        with self._lock:
+            self._expires.pop(str(key), None)
+
+    def get(self, key):
+        """Return the object named by `key`, or None if it does not exist or
+        has expired.
+
+        :param key: Key naming the object to retrieve.
+        """
+        return self._unwrap(key, self.child_datastore.get(key), self.clock())
+
+    def put(self, key, value, ttl=None):
+        """Stores the object `value` named by `key`, expiring in `ttl` seconds.
+
+        :param key: Key naming `value`.
+        :param value: the object to store.
+        :param ttl: time-to-live in seconds. Defaults to self.ttl.
+        """
+        if value is None:
+            return self.delete(key)
+        envelope = self._wrap(key, value, ttl)
+        try:
+            self.child_datastore.put(key, envelope)
+        finally:
+            self._written([key])
+
+    def delete(self, key):
+        """Removes the object named by `key`.
+
+        :param key: Key naming the object to remove.
+        """
+        self._forget(key)
+        self.child_datastore.delete(key)
+
+    def contains(self, key):
+        """Returns whether the object named by `key` exists and has not expired.
+
+        :param key: Key naming the object to check.
+        """
+        return self.get(key) is not None
+
+    def query(self, query):
+        """Returns an iterable of unexpired objects matching criteria in
+        `query`. Filters and orders apply to the objects, not the envelopes,
+        so the query is applied here over an unconstrained child query.
+
+        :param query: Query object describing the objects to return.
+        """
+        child_query = query.__class__(query.key, query.object_getattr)
+        cursor = self.child_datastore.query(child_query)
+        return query(self._unexpired_gen(cursor))
+
+    def _unexpired_gen(self, iterable):
+        now = self.clock()
+        for envelope in iterable:
+            if not isinstance(envelope, dict) or VALUE not in envelope:
+                yield envelope
+            elif not self._expired(envelope, now):
+                yield envelope[VALUE]
+
+    def get_many(self, keys):
+        """Return the objects named by `keys` (None if missing or expired)."""
+        keys = list(keys)
+        now = self.clock()
+        return [self._unwrap(key, envelope, now) for key, envelope
+                in zip(keys, self.child_datastore.get_many(keys))]
+
+    def put_many(self, items, ttl=None):
+        """Stores the (key, value) pairs in items, expiring in `ttl` seconds."""
+        items = [(key, None if value is None else self._wrap(key, value, ttl))
+                 for key, value in items]
+        for key, value in items:
+            if value is None:
+                self._forget(key)
+        try:
+            self.child_datastore.put_many(items)
+        finally:
+            self._written([key for key, value in items if value is not None])
+
+    def delete_many(self, keys):
+        """Removes the objects named by `keys`."""
+        keys = list(keys)
+        for key in keys:
+            self._forget(key)
+        self.child_datastore.delete_many(keys)
+
+    def contains_many(self, keys):
+        """Returns whether each object named by `keys` exists, unexpired."""
+        return [value is not None for value in self.get_many(keys)]
+
+    def reap(self, limit=None):
+        """Deletes up to `limit` (default self.batch) expired objects, oldest
+        expiry first. Returns the number of objects deleted.
+        """
+        limit = self.batch if limit is None else limit
+        now = self.clock()
+        candidates = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(candidates) < limit:
+                expires, k = heapq.heappop(self._heap)
+                # skip entries superseded by a later put or delete.
+                if self._expires.get(k) == expires:
+                    del self._expires[k]
+                    candidates.append(Key(k))
+
+        if not candidates:
+            return 0
+        deleted = self._delete_expired(candidates, now)
+        self.reaped += deleted
+        return deleted
+
+    def rebuild(self):
+        """Adds the expiring objects in the child datastore (from
+        child_datastore.keys()) to the expiry heap, e.g. after a restart.
+        Returns the number of objects added.
+        """
+        keys = list(self.child_datastore.keys())
+        added = 0
+        for i in range(0, len(keys), 1000):
+            chunk = keys[i:i + 1000]
+            envelopes = self.child_datastore.get_many(chunk)
+            with self._lock:
+                for key, envelope in zip(chunk, envelopes):
+                    if not isinstance(envelope, dict) or envelope.get(EXPIRES) is None:
+                        continue
+                    k = str(key)
+                    if k not in self._expires:  # a put through this shim is newer
+                        self._expires[k] = envelope[EXPIRES]
+                        heapq.heappush(self._heap, (envelope[EXPIRES], k))
+                        added += 1
+        return added
+
+    def pending(self):
+        """Returns the number of objects awaiting expiry."""
+        return len(self._expires)
+
+    def start(self, interval=1.0):
+        """Starts reaping expired objects in a background thread, every
+        `interval` seconds (immediately again while a full batch was reaped).
+        The thread first calls rebuild(), if the child supports keys().
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread started by start()."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, interval):
+        try:
+            self.rebuild()
+        except NotImplementedError:
+            pass
+        while not self._stop.is_set():
+            if self.reap() < self.batch:
+                self._stop.wait(interval)
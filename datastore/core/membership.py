@@ -0,0 +1,376 @@
+"""Probabilistic membership filters, and a shim using them to answer misses.
+
+e.g.::
+
+    >>> from datastore.core.membership import BloomFilterDatastore
+    >>> fs = FileSystemDatastore('/tmp/.test_db')
+    >>> ds = BloomFilterDatastore(serialize.shim(fs), keyfn=fs.relative_path)
+    >>> ds.rebuild()            # scan existing keys
+    >>> ds.get(Key('/absent'))  # answered without touching the filesystem
+    None
+
+Filters support `add(item)` and `item in filter`, and never report an added
+item as absent; add raises ValueError if the filter cannot take the item
+(e.g. a full CuckooFilter). CuckooFilter also supports `remove(item)`. Hashes
+are stable across processes, so filters can be saved and loaded.
+"""
+import collections
+import hashlib
+import math
+import os
+import pickle
+
+from .stores import ShimDatastore
+
+
+def _hashes(item):
+    """Returns two independent 64 bit hashes of `item` (a string)."""
+    digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+    return (int.from_bytes(digest[:8], 'little'),
+            int.from_bytes(digest[8:], 'little') | 1)
+
+
+def _mix(value):
+    """splitmix64 finalizer."""
+    value = (value ^ (value >> 30)) * 0xBF58476D1CE4E5B9 & 0xFFFFFFFFFFFFFFFF
+    value = (value ^ (value >> 27)) * 0x94D049BB133111EB & 0xFFFFFFFFFFFFFFFF
+    return value ^ (value >> 31)
+
+
+class BloomFilter(object):
+    """Bloom filter sized for `capacity` items at a false positive rate of
+    `error_rate`. Adding more than `capacity` items raises the error rate.
+    """
+    def __init__(self, capacity=10000, error_rate=0.01):
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be in (0, 1). Got {}.'.format(error_rate))
+
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = int(math.ceil(-self.capacity * math.log(error_rate)
+                                  / math.log(2) ** 2))
+        self.hashes = max(int(round(self.size / float(self.capacity)
+                                    * math.log(2))), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _indexes(self, item):
+        h1, h2 = _hashes(item)
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, item):
+        """Adds item to the filter. Returns whether it may have been present."""
+        bits = self._bits
+        present = True
+        for i in self._indexes(item):
+            byte, mask = i >> 3, 1 << (i & 7)
+            if not bits[byte] & mask:
+                present = False
+                bits[byte] |= mask
+        if not present:
+            self.count += 1
+        return present
+
+    def __contains__(self, item):
+        bits = self._bits
+        for i in self._indexes(item):
+            if not bits[i >> 3] & (1 << (i & 7)):
+                return False
+        return True
+
+    @property
+    def full(self):
+        """Whether the filter holds `capacity` items."""
+        return self.count >= self.capacity
+
+    def __len__(self):
+        return self.count
+
+
+class ScalableBloomFilter(object):
+    """Bloom filter growing as items are added (Almeida et al.). A new filter,
+    `growth` times larger and with a tighter error rate (times `ratio`), is
+    added whenever the current one is full, so the overall false positive
+    rate stays below `error_rate`.
+    """
+    def __init__(self, capacity=10000, error_rate=0.01, growth=2, ratio=0.5):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.ratio = ratio
+        self.filters = []
+
+    def add(self, item):
+        """Adds item to the filter. Returns whether it may have been present."""
+        if item in self:
+            return True
+        if not self.filters or self.filters[-1].full:
+            n = len(self.filters)
+            self.filters.append(BloomFilter(
+                self.capacity * self.growth ** n,
+                self.error_rate * (1 - self.ratio) * self.ratio ** n))
+        self.filters[-1].add(item)
+        return False
+
+    def __contains__(self, item):
+        return any(item in f for f in reversed(self.filters))
+
+    def __len__(self):
+        return sum(len(f) for f in self.filters)
+
+
+class CuckooFilter(object):
+    """Cuckoo filter (Fan et al.) of `fingerprint_bits` bit fingerprints, in
+    buckets of `bucket_size`. Unlike Bloom filters, supports remove(item).
+    add(item) raises ValueError when the filter is too full to take the item.
+    """
+    def __init__(self, capacity=10000, bucket_size=4, fingerprint_bits=16,
+                 max_kicks=500):
+        buckets = 1
+        while buckets * bucket_size * 0.95 < capacity:
+            buckets <<= 1
+
+        self.capacity = capacity
+        self.bucket_size = bucket_size
+        self.fingerprint_bits = fingerprint_bits
+        self.max_kicks = max_kicks
+        self.count = 0
+        self._mask = buckets - 1
+        self._buckets = [[] for _ in range(buckets)]
+        self._victim = 0
+
+    def _fingerprint(self, item):
+        h1, h2 = _hashes(item)
+        fingerprint = (h2 >> 1) & ((1 << self.fingerprint_bits) - 1) or 1
+        return fingerprint, h1 & self._mask
+
+    def _alternate(self, index, fingerprint):
+        return (index ^ _mix(fingerprint)) & self._mask
+
+    def add(self, item):
+        """Adds item to the filter. Raises ValueError if the filter is full."""
+        fingerprint, i1 = self._fingerprint(item)
+        i2 = self._alternate(i1, fingerprint)
+        for i in (i1, i2):
+            if len(self._buckets[i]) < self.bucket_size:
+                self._buckets[i].append(fingerprint)
+                self.count += 1
+                return
+
+        # relocate existing fingerprints, cuckoo style.
+        i = (i1, i2)[self._victim & 1]
+        kicked = []
+        for _ in range(self.max_kicks):
+            bucket = self._buckets[i]
+            slot = self._victim % self.bucket_size
+            self._victim += 1
+            kicked.append((i, slot, bucket[slot]))
+            fingerprint, bucket[slot] = bucket[slot], fingerprint
+            i = self._alternate(i, fingerprint)
+            if len(self._buckets[i]) < self.bucket_size:
+                self._buckets[i].append(fingerprint)
+                self.count += 1
+                return
+
+        # undo the relocations, leaving the filter as it was.
+        for i, slot, previous in reversed(kicked):
+            self._buckets[i][slot] = previous
+        raise ValueError('CuckooFilter is full ({} items).'.format(self.count))
+
+    def remove(self, item):
+        """Removes (one addition of) item. Returns whether it was found.
+        Only remove items that were added, or another item may be removed.
+        """
+        fingerprint, i1 = self._fingerprint(item)
+        for i in (i1, self._alternate(i1, fingerprint)):
+            bucket = self._buckets[i]
+            if fingerprint in bucket:
+                bucket.remove(fingerprint)
+                self.count -= 1
+                return True
+        return False
+
+    def __contains__(self, item):
+        fingerprint, i1 = self._fingerprint(item)
+        return (fingerprint in self._buckets[i1] or
+                fingerprint in self._buckets[self._alternate(i1, fingerprint)])
+
+    def __len__(self):
+        return self.count
+
+
+class BloomFilterDatastore(ShimDatastore):
+    """Shim keeping a membership filter of the keys in the child datastore.
+    get and contains of keys the filter rules out return without reaching the
+    child datastore.
+
+    The filter only knows keys written through this shim, or scanned by
+    rebuild(); rebuild() after writes made around it. Deletes are forgotten
+    only by filters supporting remove (CuckooFilter); such filters only get
+    keys new to the child, so overwrites do not fill them. Writes of new
+    keys raise ValueError if the filter is full (its add raises ValueError);
+    rebuild() with a larger filter.
+
+    `stats` counts avoided (child reads saved) and false_positives.
+
+    :param datastore: the child datastore.
+    :param filterfn: returns a new, empty filter.
+    :param keyfn: returns the filter item for a key. Keys that the child
+                  stores identically must map to the same item (e.g. use
+                  FileSystemDatastore.relative_path for a filesystem).
+    """
+    def __init__(self, datastore, filterfn=ScalableBloomFilter, keyfn=str):
+        super(BloomFilterDatastore, self).__init__(datastore)
+        self.filterfn = filterfn
+        self.keyfn = keyfn
+        self.filter = filterfn()
+        self.stats = collections.Counter()
+
+    def _may_contain(self, key):
+        if self.filter is None or self.keyfn(key) in self.filter:
+            return True
+        self.stats['avoided'] += 1
+        return False
+
+    def _unique(self, keys):
+        """Returns keys without repeated filter items, in order."""
+        return list(dict((self.keyfn(key), key) for key in keys).values())
+
+    def _add(self, keys):
+        """Adds keys about to be written to the filter. A filter supporting
+        remove only gets the keys the child does not have yet, as each
+        addition must be matched by one removal.
+        """
+        keys = self._unique(keys)
+        if self.filter is None or not keys:
+            return
+        remove = getattr(self.filter, 'remove', None)
+        if remove is not None:
+            exists = self.child_datastore.contains_many(keys)
+            keys = [key for key, e in zip(keys, exists) if not e]
+
+        added = []
+        try:
+            for key in keys:
+                item = self.keyfn(key)
+                self.filter.add(item)
+                added.append(item)
+        except ValueError:
+            if remove is not None:
+                for item in added:
+                    remove(item)
+            raise ValueError('filter is full; rebuild() with a larger filter.')
+
+    def _remove(self, keys):
+        """Removes keys about to be deleted from the filter, if it supports
+        remove, with one contains_many call to the child.
+        """
+        remove = getattr(self.filter, 'remove', None)
+        keys = self._unique(keys)
+        if remove is None or not keys:
+            return
+        for key, exists in zip(keys, self.child_datastore.contains_many(keys)):
+            if exists:
+                remove(self.keyfn(key))
+
+    def get(self, key):
+        """Return the object named by `key`, or None. Keys ruled out by the
+        filter are not looked up in the child datastore.
+        """
+        if not self._may_contain(key):
+            return None
+        value = self.child_datastore.get(key)
+        if value is None:
+            self.stats['false_positives'] += 1
+        return value
+
+    def contains(self, key):
+        """Returns whether the object named by `key` exists."""
+        if not self._may_contain(key):
+            return False
+        exists = self.child_datastore.contains(key)
+        if not exists:
+            self.stats['false_positives'] += 1
+        return exists
+
+    def put(self, key, value):
+        """Stores the object `value` named by `key`, and adds key to the filter."""
+        if value is None:
+            return self.delete(key)
+        self._add([key])
+        self.child_datastore.put(key, value)
+
+    def delete(self, key):
+        """Removes the object named by `key` (and from the filter, if possible)."""
+        self._remove([key])
+        self.child_datastore.delete(key)
+
+    def get_many(self, keys):
+        """Return the objects named by `keys`. Only keys the filter does not
+        rule out are requested (in one batch) from the child datastore.
+        """
+        keys = list(keys)
+        values = [None] * len(keys)
+        maybe = [i for i, key in enumerate(keys) if self._may_contain(key)]
+        if maybe:
+            found = self.child_datastore.get_many([keys[i] for i in maybe])
+            for i, value in zip(maybe, found):
+                values[i] = value
+                if value is None:
+                    self.stats['false_positives'] += 1
+        return values
+
+    def contains_many(self, keys):
+        """Returns whether each object named by `keys` exists."""
+        keys = list(keys)
+        contains = [False] * len(keys)
+        maybe = [i for i, key in enumerate(keys) if self._may_contain(key)]
+        if maybe:
+            found = self.child_datastore.contains_many([keys[i] for i in maybe])
+            for i, exists in zip(maybe, found):
+                contains[i] = exists
+                if not exists:
+                    self.stats['false_positives'] += 1
+        return contains
+
+    def put_many(self, items):
+        """Stores the (key, value) pairs in items, adding keys to the filter."""
+        items = list(items)
+        self._remove([key for key, value in items if value is None])
+        self._add([key for key, value in items if value is not None])
+        self.child_datastore.put_many(items)
+
+    def delete_many(self, keys):
+        """Removes the objects named by `keys`."""
+        keys = list(keys)
+        self._remove(keys)
+        self.child_datastore.delete_many(keys)
+
+    def rebuild(self, keys=None):
+        """Replaces the filter with a new one holding `keys`, by default all
+        the keys in the child datastore (child_datastore.keys()).
+        """
+        if keys is None:
+            keys = self.child_datastore.keys()
+        filter = self.filterfn()
+        try:
+            for key in keys:
+                filter.add(self.keyfn(key))
+        except ValueError:
+            raise ValueError('filter too small to hold all keys.')
+        self.filter = filter
+
+    def save(self, path):
+        """Writes the filter to the file at `path`."""
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(self.filter, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def load(self, path):
+        """Replaces the filter with the one saved at `path`."""
+        with open(path, 'rb') as f:
+            self.filter = pickle.load(f)
@@ -0,0 +1,521 @@
+"""In-memory datastores beyond DictDatastore: SortedDictDatastore (ordered
+keys, range queries) and ConcurrentDictDatastore (lock-striped, for use
+from many threads).
+
+SortedDictDatastore keeps its keys sorted, so it answers subtree, prefix and
+key range queries by seeking, and returns results in key order without
+sorting::
+
+    >>> from datastore.core.memory import SortedDictDatastore
+    >>> ds = SortedDictDatastore()
+    >>> ds.put(Key('/users/alice'), {'key': '/users/alice'})
+    >>> ds.put(Key('/users/alice/posts/1'), {'key': '/users/alice/posts/1'})
+    >>> [o['key'] for o in ds.query_subtree(Query(Key('/users')))]
+    ['/users/alice', '/users/alice/posts/1']
+"""
+import sys
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+from .key import Key
+from .query import Query
+from .stores import Datastore, DictDatastore, _partition
+
+
+def _after(string):
+    """Returns the smallest string greater than `string`."""
+    return string + '\x00'
+
+
+def _takewhile(iterable, predicate):
+    for value in iterable:
+        if not predicate(value):
+            return
+        yield value
+
+
+def _direction(query):
+    """Returns (query, reverse): a copy of query without its order if it
+    orders by key (iterating in key order sorts it), and whether the order
+    is descending.
+    """
+    if len(query.orders) == 1 and query.orders[0].field == 'key':
+        reverse = query.orders[0].descending
+        query = query.copy()
+        query.orders = []
+        return query, reverse
+    return query, False
+
+
+def _seek(query, start, stop, reverse):
+    """Narrows [start, stop) to the keys after query.offset_key."""
+    offset_key = query.offset_key
+    if offset_key is None:
+        return start, stop
+    offset_key = str(offset_key)
+    if reverse:
+        if stop is None or offset_key < stop:
+            stop = offset_key
+    elif start is None or _after(offset_key) > start:
+        start = _after(offset_key)
+    return start, stop
+
+
+class SortedKeyList(object):
+    """Sorted list of strings, stored as a list of sorted blocks of up to
+    2 * `load` strings, with the maximum of each block. Inserts and removals
+    are O(log n + load); lookups are O(log n).
+    """
+    def __init__(self, load=1000):
+        self.load = load
+        self._lists = []
+        self._maxes = []
+        self._len = 0
+
+    def add(self, value):
+        """Inserts `value` (which must not be present)."""
+        lists, maxes = self._lists, self._maxes
+        self._len += 1
+        if not maxes:
+            lists.append([value])
+            maxes.append(value)
+            return
+
+        i = bisect_left(maxes, value)
+        if i == len(maxes):
+            i -= 1
+            lists[i].append(value)
+            maxes[i] = value
+        else:
+            insort(lists[i], value)
+
+        block = lists[i]
+        if len(block) > 2 * self.load:
+            half = block[self.load:]
+            del block[self.load:]
+            maxes[i] = block[-1]
+            lists.insert(i + 1, half)
+            maxes.insert(i + 1, half[-1])
+
+    def remove(self, value):
+        """Removes `value` (which must be present)."""
+        lists, maxes = self._lists, self._maxes
+        i = bisect_left(maxes, value)
+        block = lists[i]
+        j = bisect_left(block, value)
+        del block[j]
+        self._len -= 1
+        if not block:
+            del lists[i]
+            del maxes[i]
+        elif j == len(block):
+            maxes[i] = block[-1]
+
+    def ceiling(self, value):
+        """Returns the first string >= `value`, or None."""
+        maxes = self._maxes
+        i = bisect_left(maxes, value)
+        if i == len(maxes):
+            return None
+        block = self._lists[i]
+        return block[bisect_left(block, value)]
+
+    def irange(self, start=None, stop=None, reverse=False):
+        """Yields the strings in [start, stop) in order (or reverse order).
+        Strings added or removed during iteration may or may not be seen.
+        """
+        if reverse:
+            iterator = self._before(stop)
+            if start is None:
+                return iterator
+            return _takewhile(iterator, lambda s: s >= start)
+
+        iterator = self._from(start)
+        if stop is None:
+            return iterator
+        return _takewhile(iterator, lambda s: s < stop)
+
+    def _from(self, start):
+        # iterates over a copy of one block at a time, then seeks again
+        # after the last value, so concurrent changes cannot break iteration.
+        after = False
+        while True:
+            lists, maxes = self._lists, self._maxes
+            if start is None:
+                i, j = 0, 0
+            else:
+                seek = bisect_right if after else bisect_left
+                i = seek(maxes, start)
+                if i == len(maxes):
+                    return
+                j = seek(lists[i], start)
+            if i >= len(lists):
+                return
+
+            chunk = lists[i][j:]
+            for value in chunk:
+                yield value
+            start, after = chunk[-1], True
+
+    def _before(self, stop):
+        while True:
+            lists, maxes = self._lists, self._maxes
+            if not lists:
+                return
+            if stop is None:
+                i = len(lists) - 1
+                j = len(lists[i])
+            else:
+                i = bisect_left(maxes, stop)
+                if i == len(maxes):
+                    i -= 1
+                    j = len(lists[i])
+                else:
+                    j = bisect_left(lists[i], stop)
+                while j == 0:
+                    i -= 1
+                    if i < 0:
+                        return
+                    j = len(lists[i])
+
+            chunk = lists[i][:j]
+            for value in reversed(chunk):
+                yield value
+            stop = chunk[0]
+
+    def __iter__(self):
+        return self._from(None)
+
+    def __len__(self):
+        return self._len
+
+
+class SortedDictDatastore(DictDatastore):
+    """In-memory datastore keeping its keys sorted (in a SortedKeyList).
+
+    Reads are dict lookups, like DictDatastore. Queries seek in the sorted
+    keys, taking O(log n + k) for k results, and return objects in key order:
+
+        * query         : the objects in the collection of query.key, like
+                          DictDatastore (the keys whose path is query.key)
+        * query_subtree : all objects under query.key (its descendants)
+        * query_prefix  : the objects whose key string starts with a prefix
+        * query_range   : the objects with keys in [start, stop)
+
+    Results are only sorted when the query orders by a field other than
+    'key'; an order on 'key' ('+key' or '-key') is taken to mean the object
+    key, and served by iterating in that direction. `query.offset_key`
+    seeks: results start after that key (before it, for '-key').
+
+    :param load: the block size of the sorted key list.
+    """
+    _ordered = True
+
+    def __init__(self, load=1000):
+        super(SortedDictDatastore, self).__init__()
+        self._sorted = SortedKeyList(load)
+
+    def _add(self, k):
+        self._sorted.add(k)
+
+    def _remove(self, k):
+        self._sorted.remove(k)
+
+    def _collection(self, partition):
+        return list(self._members(partition, None))
+
+    def scan(self, start=None, stop=None, prefix=None, reverse=False):
+        """Yields (key, value) pairs in key order, for keys in [start, stop)
+        whose key string starts with `prefix`.
+        """
+        items = self._items
+        for k in self._irange(start, stop, prefix, reverse):
+            value = items.get(k)
+            if value is not None:
+                yield Key(k), value
+
+    def _irange(self, start, stop, prefix, reverse):
+        start = None if start is None else str(start)
+        stop = None if stop is None else str(stop)
+        if prefix is not None:
+            prefix = str(prefix)
+            if start is None or start < prefix:
+                start = prefix
+            if not reverse:
+                strings = self._sorted.irange(start, stop)
+                return _takewhile(strings, lambda k: k.startswith(prefix))
+
+            # the strings starting with prefix sort before prefix + max char
+            end = prefix + '\U0010ffff'
+            if stop is None or stop > end:
+                stop = end
+            strings = self._sorted.irange(start, stop, reverse=True)
+            return (k for k in strings if k.startswith(prefix))
+        return self._sorted.irange(start, stop, reverse)
+
+    def _members(self, partition, start):
+        """Yields the key strings in `partition` (>= start), in order, by
+        seeking past the subtrees of its members.
+        """
+        if partition == '/':
+            bases = ['/']
+        else:
+            bases = [partition + '/', partition + ':']
+
+        ceiling = self._sorted.ceiling
+        for base in bases:
+            k = ceiling(base if start is None or start < base else start)
+            while k is not None and k.startswith(base):
+                slash = k.find('/', len(base))
+                if slash < 0:
+                    if _partition(k) == partition:
+                        yield k
+                    k = ceiling(_after(k))
+                else:
+                    # skip the subtree: strings after k[:slash] + '/...'
+                    k = ceiling(k[:slash] + '0')
+
+    def _run(self, query, strings):
+        """Applies `query` to the objects named by `strings` (key strings in
+        key order, or in reverse order if query orders by '-key').
+        """
+        items = self._items
+        values = (items[k] for k in strings if k in items)
+        return query(values)
+
+    def query(self, query):
+        """Returns the objects in the collection of query.key (see Key.path),
+        like DictDatastore, in key order.
+
+        :param query: Query object describing the objects to return.
+        """
+        query, reverse = _direction(query)
+        start, stop = _seek(query, None, None, reverse)
+        strings = self._members(str(query.key), start)
+        if stop is not None:
+            strings = _takewhile(strings, lambda k: k < stop)
+        if reverse:
+            strings = reversed(list(strings))
+        return self._run(query, strings)
+
+    def query_subtree(self, query):
+        """Returns the objects named by descendants of query.key."""
+        k = str(query.key)
+        return self.query_prefix(query, '/' if k == '/' else k + '/')
+
+    def query_prefix(self, query, prefix):
+        """Returns the objects whose key string starts with `prefix`."""
+        query, reverse = _direction(query)
+        start, stop = _seek(query, None, None, reverse)
+        return self._run(query, self._irange(start, stop, prefix, reverse))
+
+    def query_range(self, query, start=None, stop=None):
+        """Returns the objects with keys in [start, stop) (Keys or strings;
+        None is unbounded). query.key is ignored.
+        """
+        query, reverse = _direction(query)
+        start, stop = _seek(query, start, stop, reverse)
+        return self._run(query, self._irange(start, stop, None, reverse))
+
+    def keys(self):
+        """Returns an iterable of the Keys of all objects, in order."""
+        return [Key(k) for k in self._sorted]
+
+    def memory_usage(self):
+        """Returns the approximate size in bytes of the datastore's index."""
+        size = sys.getsizeof(self._items) + sys.getsizeof(self._sorted._maxes)
+        size += sys.getsizeof(self._sorted._lists)
+        for k in self._items:
+            size += sys.getsizeof(k)
+        for block in self._sorted._lists:
+            size += sys.getsizeof(block)
+        return size
+
+
+class ConcurrentDictDatastore(Datastore):
+    """Thread-safe in-memory datastore, partitioned by key hash into
+    `segments` DictDatastores, each guarded by its own lock.
+
+    Writes lock only the segment of their key, so writers of different
+    segments do not contend. Reads take no lock: each is a single dict
+    lookup, which is atomic. Queries, keys() and len() see a consistent
+    snapshot of each segment (taken under its lock), though not of the
+    whole datastore.
+
+    update() and put_if_absent() are atomic read-modify-writes. snapshot()
+    returns a point-in-time view of all segments.
+
+    :param segments: number of segments (a power of two).
+    """
+    def __init__(self, segments=16):
+        if segments < 1 or segments & (segments - 1):
+            raise ValueError('segments must be a power of two. Got {}.'.format(segments))
+
+        self._mask = segments - 1
+        self._segments = [DictDatastore() for _ in range(segments)]
+        self._locks = [threading.Lock() for _ in range(segments)]
+
+    def _index(self, key):
+        return hash(str(key)) & self._mask
+
+    def get(self, key):
+        """Return the object named by `key` or None."""
+        return self._segments[hash(str(key)) & self._mask].get(key)
+
+    def contains(self, key):
+        """Returns whether the object named by `key` exists."""
+        return self._segments[hash(str(key)) & self._mask].contains(key)
+
+    def put(self, key, value):
+        """Stores the object `value` named by `key`."""
+        i = self._index(key)
+        with self._locks[i]:
+            self._segments[i].put(key, value)
+
+    def delete(self, key):
+        """Removes the object named by `key`."""
+        i = self._index(key)
+        with self._locks[i]:
+            self._segments[i].delete(key)
+
+    def update(self, key, fn):
+        """Atomically replaces the object named by `key` with fn(object)
+        (fn receives None if there is no object; returning None deletes it).
+        Returns the new object.
+        """
+        i = self._index(key)
+        with self._locks[i]:
+            segment = self._segments[i]
+            value = fn(segment.get(key))
+            segment.put(key, value)
+            return value
+
+    def put_if_absent(self, key, value):
+        """Stores `value` unless an object named by `key` exists. Returns the
+        existing object, or None if `value` was stored.
+        """
+        i = self._index(key)
+        with self._locks[i]:
+            segment = self._segments[i]
+            existing = segment.get(key)
+            if existing is None:
+                segment.put(key, value)
+            return existing
+
+    def get_many(self, keys):
+        """Return the objects named by `keys` (None for missing objects)."""
+        segments, mask = self._segments, self._mask
+        return [segments[hash(str(key)) & mask].get(key) for key in keys]
+
+    def contains_many(self, keys):
+        """Returns whether each object named by `keys` exists."""
+        segments, mask = self._segments, self._mask
+        return [segments[hash(str(key)) & mask].contains(key) for key in keys]
+
+    def _grouped(self, items, keyfn):
+        groups = {}
+        for item in items:
+            groups.setdefault(self._index(keyfn(item)), []).append(item)
+        return groups.items()
+
+    def put_many(self, items):
+        """Stores the (key, value) pairs in items, locking each segment once."""
+        for i, group in self._grouped(items, lambda item: item[0]):
+            with self._locks[i]:
+                self._segments[i].put_many(group)
+
+    def delete_many(self, keys):
+        """Removes the objects named by `keys`, locking each segment once."""
+        for i, group in self._grouped(keys, lambda key: key):
+            with self._locks[i]:
+                self._segments[i].delete_many(group)
+
+    def query(self, query):
+        """Returns the objects in the collection of query.key (like
+        DictDatastore), from a snapshot of each segment.
+        """
+        collection = Query(query.key)
+        values = []
+        for lock, segment in zip(self._locks, self._segments):
+            with lock:
+                values.extend(segment.query(collection))
+        return query(values)
+
+    def keys(self):
+        """Returns the Keys of all objects."""
+        keys = []
+        for lock, segment in zip(self._locks, self._segments):
+            with lock:
+                keys.extend(segment.keys())
+        return keys
+
+    def snapshot(self):
+        """Returns a read-only view of the objects as of now (of all
+        segments at once: writes are blocked while it is taken).
+        """
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            snapshots = [segment.snapshot() for segment in self._segments]
+        finally:
+            for lock in self._locks:
+                lock.release()
+        return ConcurrentSnapshot(snapshots, self._mask)
+
+    def memory_usage(self):
+        """Returns the approximate size in bytes of the segments' indexes."""
+        return sum(segment.memory_usage() for segment in self._segments)
+
+    def __len__(self):
+        return sum(len(segment) for segment in self._segments)
+
+
+class ConcurrentSnapshot(Datastore):
+    """Read-only, point-in-time view of a ConcurrentDictDatastore, from
+    ConcurrentDictDatastore.snapshot(): a Snapshot of each segment.
+    """
+    def __init__(self, snapshots, mask):
+        self._snapshots = snapshots
+        self._mask = mask
+
+    def get(self, key):
+        """Return the object named by `key` when the snapshot was taken."""
+        return self._snapshots[hash(str(key)) & self._mask].get(key)
+
+    def contains(self, key):
+        """Returns whether the object named by `key` existed."""
+        return self._snapshots[hash(str(key)) & self._mask].contains(key)
+
+    def put(self, key, value):
+        raise TypeError('Snapshot is read-only.')
+
+    def delete(self, key):
+        raise TypeError('Snapshot is read-only.')
+
+    def query(self, query):
+        """Returns the objects in the collection of query.key when the
+        snapshot was taken.
+        """
+        collection = Query(query.key)
+        values = []
+        for snapshot in self._snapshots:
+            values.extend(snapshot.query(collection))
+        return query(values)
+
+    def keys(self):
+        """Returns the Keys of the objects when the snapshot was taken."""
+        return [key for snapshot in self._snapshots for key in snapshot.keys()]
+
+    def close(self):
+        """Releases the snapshot; it must not be used afterwards."""
+        for snapshot in self._snapshots:
+            snapshot.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return sum(len(snapshot) for snapshot in self._snapshots)
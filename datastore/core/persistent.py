@@ -0,0 +1,337 @@
+"""Persistence for in-memory datastores: an append-only operation log, plus
+compact snapshots written in the background.
+
+e.g.::
+
+    >>> from datastore.core.persistent import PersistentDatastore
+    >>> ds = PersistentDatastore(DictDatastore(), '/var/lib/app/hot', sync=0.1)
+    >>> ds.put(Key('/a'), 1)  # logged, then applied
+    >>> ds.close()
+    >>> PersistentDatastore(DictDatastore(), '/var/lib/app/hot').get(Key('/a'))
+    1
+
+The directory holds `snapshot.<n>` (all objects as of the start of log n)
+and `log.<n>` files of framed records. On open, the latest snapshot is
+loaded and the logs from its generation on are replayed; a torn record at
+the end of a log (a crash mid-write) ends its replay.
+"""
+import collections
+import os
+import struct
+import threading
+import time
+import zlib
+
+from . import serialize
+from .key import Key
+from .stores import ShimDatastore
+
+_header = struct.Struct('<II')  # payload length, crc32
+
+_fsync = getattr(os, 'fdatasync', os.fsync)
+
+
+def write_records(fileobj, records, serializer):
+    """Writes `records` (lists) to `fileobj` as framed, checksummed records."""
+    binary = serialize.is_binary(serializer)
+    chunks = []
+    for record in records:
+        payload = serializer.dumps(record)
+        if not binary:
+            payload = payload.encode('utf-8')
+        chunks.append(_header.pack(len(payload), zlib.crc32(payload)))
+        chunks.append(payload)
+    fileobj.write(b''.join(chunks))
+
+
+def read_records(path, serializer):
+    """Yields the records in the file at `path`, stopping at the first
+    truncated or corrupt record.
+    """
+    binary = serialize.is_binary(serializer)
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    offset, end = 0, len(data)
+    while offset + _header.size <= end:
+        length, crc = _header.unpack_from(data, offset)
+        start = offset + _header.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        if not binary:
+            payload = payload.decode('utf-8')
+        yield serializer.loads(payload)
+        offset = start + length
+
+
+class PersistentDatastore(ShimDatastore):
+    """Shim persisting an in-memory datastore (e.g. DictDatastore) to the
+    directory `path`, with an append-only log of writes and periodic
+    snapshots.
+
+    Every write is appended to the log, then applied to the child. When the
+    log is synced to disk depends on `sync`:
+
+        * 'always' : fsync before each write returns (no acknowledged write
+                     is lost on a crash)
+        * seconds  : fsync every `sync` seconds, from a background thread
+                     (a crash loses at most the last interval of writes)
+        * 'os'     : never fsync; the OS writes the log back (a process
+                     crash loses nothing, a machine crash may)
+
+    After `snapshot_records` logged writes, or `snapshot_interval` seconds
+    with writes, a background thread writes a snapshot of the child and
+    drops the logs it covers. The snapshot is taken from child.snapshot()
+    (see DictDatastore.snapshot) if available, so writers are not blocked
+    while it is written.
+
+    Opening a path with a snapshot or logs loads them into the child.
+
+    :param datastore: the in-memory child datastore (with keys()).
+    :param path: directory of the snapshot and log files.
+    :param sync: 'always', 'os', or an interval in seconds.
+    :param snapshot_records: logged writes that trigger a snapshot.
+    :param snapshot_interval: seconds after which writes trigger a snapshot.
+    :param serializer: serializer of log records ([op, key, value] lists).
+    :param background: whether to run the background thread (when False,
+                       call sync() and checkpoint() yourself).
+    """
+    def __init__(self, datastore, path, sync=1.0, snapshot_records=100000,
+                 snapshot_interval=300.0, serializer=serialize.PickleSerializer,
+                 background=True):
+        super(PersistentDatastore, self).__init__(datastore)
+        if sync not in ('always', 'os') and \
+                not (isinstance(sync, (int, float)) and sync > 0):
+            raise ValueError("sync must be 'always', 'os' or seconds. Got {!r}.".format(sync))
+
+        self.path = path
+        self.sync_policy = sync
+        self.snapshot_records = snapshot_records
+        self.snapshot_interval = snapshot_interval
+        self.serializer = serializer
+        self.stats = collections.Counter()
+
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._log = None
+        self._dirty = False
+        self._pending = 0
+        self._last_snapshot = time.monotonic()
+        self._closed = False
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.generation = self._recover()
+        self._open_log(self.generation)
+
+        self._wakeup = threading.Event()
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    # files
+    def _file(self, kind, generation):
+        return os.path.join(self.path, '{}.{}'.format(kind, generation))
+
+    def _generations(self, kind):
+        generations = []
+        for name in os.listdir(self.path):
+            prefix, _, generation = name.partition('.')
+            if prefix == kind and generation.isdigit():
+                generations.append(int(generation))
+        return sorted(generations)
+
+    def _recover(self):
+        """Loads the latest snapshot, replays the logs after it, and returns
+        the generation of the new log.
+        """
+        # a crash in _write_snapshot leaves a partial snapshot.<n>.tmp behind.
+        for name in os.listdir(self.path):
+            if name.startswith('snapshot.') and name.endswith('.tmp'):
+                os.remove(os.path.join(self.path, name))
+
+        snapshots = self._generations('snapshot')
+        logs = self._generations('log')
+        base = snapshots[-1] if snapshots else 0
+
+        child = self.child_datastore
+        if snapshots:
+            for op, k, value in read_records(self._file('snapshot', base), self.serializer):
+                child.put(Key(k), value)
+                self.stats['loaded'] += 1
+
+        for generation in logs:
+            if generation < base:
+                continue
+            for op, k, value in read_records(self._file('log', generation), self.serializer):
+                if op == 'put':
+                    child.put(Key(k), value)
+                else:
+                    child.delete(Key(k))
+                self.stats['replayed'] += 1
+
+        # new writes go to a fresh log; replayed ones stay until a snapshot.
+        return max([base] + [g + 1 for g in logs])
+
+    def _open_log(self, generation):
+        self._log = open(self._file('log', generation), 'ab', buffering=0)
+        _fsync_directory(self.path)
+
+    # writes
+    def _append(self, records, apply):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('PersistentDatastore is closed.')
+            write_records(self._log, records, self.serializer)
+            if self.sync_policy == 'always':
+                _fsync(self._log.fileno())
+                self.stats['syncs'] += 1
+            else:
+                self._dirty = True
+            apply()
+            self._pending += len(records)
+            self.stats['logged'] += len(records)
+
+        if self._pending >= self.snapshot_records and self._thread is not None:
+            self._wakeup.set()
+
+    def put(self, key, value):
+        """Logs, then stores the object `value` named by `key`."""
+        if value is None:
+            return self.delete(key)
+        self._append([['put', str(key), value]],
+                     lambda: self.child_datastore.put(key, value))
+
+    def delete(self, key):
+        """Logs, then removes the object named by `key`."""
+        self._append([['delete', str(key), None]],
+                     lambda: self.child_datastore.delete(key))
+
+    def put_many(self, items):
+        """Logs the writes as one append (and sync), then stores them."""
+        items = list(items)
+        records = [['put', str(key), value] if value is not None
+                   else ['delete', str(key), None] for key, value in items]
+        self._append(records, lambda: self.child_datastore.put_many(items))
+
+    def delete_many(self, keys):
+        """Logs the deletes as one append (and sync), then removes them."""
+        keys = list(keys)
+        records = [['delete', str(key), None] for key in keys]
+        self._append(records, lambda: self.child_datastore.delete_many(keys))
+
+    def sync(self):
+        """Forces logged writes to disk."""
+        with self._lock:
+            if self._dirty and not self._closed:
+                _fsync(self._log.fileno())
+                self._dirty = False
+                self.stats['syncs'] += 1
+
+    # snapshots
+    def checkpoint(self):
+        """Writes a snapshot of the child datastore, and removes the logs and
+        snapshots it makes redundant. Writes continue meanwhile if the child
+        supports snapshot().
+        """
+        with self._snapshot_lock:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError('PersistentDatastore is closed.')
+                # rotate the log; the snapshot covers all older logs.
+                _fsync(self._log.fileno())
+                self._log.close()
+                self.generation += 1
+                generation = self.generation
+                self._open_log(generation)
+                self._dirty = False
+                self._pending = 0
+                self._last_snapshot = time.monotonic()
+                view = self._view()
+
+            try:
+                self._write_snapshot(view, generation)
+            finally:
+                if hasattr(view, 'close'):
+                    view.close()
+            self._remove_before(generation)
+            self.stats['snapshots'] += 1
+
+    def _view(self):
+        """Returns a point-in-time view of the child (called under _lock)."""
+        child = self.child_datastore
+        if hasattr(child, 'snapshot'):
+            return child.snapshot()
+        keys = list(child.keys())
+        return dict(zip(map(str, keys), child.get_many(keys)))
+
+    def _write_snapshot(self, view, generation):
+        if isinstance(view, dict):
+            items = view.items()
+        else:
+            keys = view.keys()
+            items = zip(map(str, keys), view.get_many(keys))
+
+        path = self._file('snapshot', generation)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            batch = []
+            for k, value in items:
+                if value is not None:
+                    batch.append(['put', k, value])
+                if len(batch) >= 1000:
+                    write_records(f, batch, self.serializer)
+                    batch = []
+            write_records(f, batch, self.serializer)
+            f.flush()
+            _fsync(f.fileno())
+        os.replace(tmp, path)
+        _fsync_directory(self.path)
+
+    def _remove_before(self, generation):
+        for kind in ('snapshot', 'log'):
+            for old in self._generations(kind):
+                if old < generation:
+                    os.remove(self._file(kind, old))
+
+    # background
+    def _run(self):
+        interval = self.sync_policy if self.sync_policy not in ('always', 'os') else 1.0
+        while not self._closed:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            if self._closed:
+                return
+            try:
+                self.sync()
+                elapsed = time.monotonic() - self._last_snapshot
+                if self._pending >= self.snapshot_records or \
+                        (self._pending and elapsed >= self.snapshot_interval):
+                    self.checkpoint()
+            except Exception:
+                self.stats['errors'] += 1
+
+    def close(self):
+        """Stops the background thread, syncs and closes the log."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._wakeup.set()
+            self._thread.join()
+        with self._lock:
+            _fsync(self._log.fileno())
+            self._log.close()
+
+
+def _fsync_directory(path):
+    """Makes file creations and renames in directory `path` durable."""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
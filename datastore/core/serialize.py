@@ -1,4 +1,17 @@
+import bz2
+import collections
+import copy
+import hashlib
+import importlib
+import io
 import json
+import lzma
+import marshal
+import pickle
+import struct
+import types
+import zlib
+
 from .stores import ShimDatastore
 
 
@@ -6,7 +19,16 @@ default_serializer = json
 
 
 class Serializer(object):
-    """Serializing protocol. Serialized data must be a string."""
+    """Serializing protocol. Serialized data must be a string (or bytes, for
+    serializers whose `binary` attribute is True).
+
+    Serializers may also implement the optional streaming protocol,
+    dump(value, fileobj) and load(fileobj), to move large values to and from
+    file objects without holding the serialized value in memory. Binary
+    serializers stream to binary files, others to text files.
+    """
+    binary = False
+
     @classmethod
     def loads(cls, value):
         """returns deserialized value."""
@@ -17,11 +39,28 @@ class Serializer(object):
         """returns serialized value."""
         raise NotImplementedError
 
+    @classmethod
+    def loads_many(cls, values):
+        """returns a list of deserialized values. Override to batch."""
+        return [cls.loads(value) for value in values]
+
+    @classmethod
+    def dumps_many(cls, values):
+        """returns a list of serialized values. Override to batch."""
+        return [cls.dumps(value) for value in values]
+
     @staticmethod
     def implements_serializer_interface(cls):
         return hasattr(cls, 'loads') and callable(cls.loads) \
             and hasattr(cls, 'dumps') and callable(cls.dumps)
 
+    @staticmethod
+    def implements_stream_interface(cls):
+        if isinstance(cls, Stack):
+            return cls.supports_streams()
+        return hasattr(cls, 'load') and callable(cls.load) \
+            and hasattr(cls, 'dump') and callable(cls.dump)
+
 
 class NonSerializer(Serializer):
     """Implements serializing protocol but does not serialize at all.
@@ -47,12 +86,674 @@ class prettyjson(Serializer):
         """returns json deserialized value."""
         return json.loads(value)
 
+    @classmethod
+    def loads_many(cls, values):
+        """returns json deserialized values, parsed as one document."""
+        return _json_loads_many(values)
+
     @classmethod
     def dumps(cls, value):
         """returns json serialized value, pretty-printed."""
         return json.dumps(value, sort_keys=True, indent=1)
 
 
+class PickleSerializer(Serializer):
+    """pickle wrapper serializer using the highest protocol available (5).
+    Handles arbitrary python objects; serialized values are bytes.
+    """
+    binary = True
+    protocol = min(5, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def loads(cls, value):
+        """returns pickle deserialized value."""
+        return pickle.loads(value)
+
+    @classmethod
+    def dumps(cls, value):
+        """returns pickle serialized value."""
+        return pickle.dumps(value, protocol=cls.protocol)
+
+    @classmethod
+    def load(cls, fileobj):
+        """returns value deserialized from binary file fileobj."""
+        return pickle.load(fileobj)
+
+    @classmethod
+    def dump(cls, value, fileobj):
+        """serializes value into binary file fileobj."""
+        pickle.dump(value, fileobj, protocol=cls.protocol)
+
+
+class MarshalSerializer(Serializer):
+    """marshal wrapper serializer. Only for plain data (None, bools, numbers,
+    strings, bytes, lists, tuples, dicts and sets); serialized values are bytes.
+
+    The marshal format is specific to the python version. Do not use it for
+    values that must outlive an interpreter upgrade.
+    """
+    binary = True
+    version = marshal.version
+
+    @classmethod
+    def loads(cls, value):
+        """returns marshal deserialized value."""
+        return marshal.loads(value)
+
+    @classmethod
+    def dumps(cls, value):
+        """returns marshal serialized value."""
+        return marshal.dumps(value, cls.version)
+
+    @classmethod
+    def load(cls, fileobj):
+        """returns value deserialized from binary file fileobj."""
+        return marshal.load(fileobj)
+
+    @classmethod
+    def dump(cls, value, fileobj):
+        """serializes value into binary file fileobj."""
+        marshal.dump(value, fileobj, cls.version)
+
+
+class TaggedSerializer(Serializer):
+    """Compact tagged binary serializer for plain data.
+
+    Every value is written as a one-byte tag followed by its payload:
+
+        N, T, F     None, True, False
+        i           zigzag varint (ints of any size)
+        f           8-byte big endian double
+        s, b        varint length + utf-8 text / raw bytes
+        l           varint count + items (tuples are stored as lists)
+        d           varint count + (key, varint length, value) entries
+
+    Map values are length-prefixed, so a reader can skip over fields it does
+    not need (see loads_field). Serialized values are bytes.
+    """
+    binary = True
+    _double = struct.Struct('>d')
+
+    @classmethod
+    def loads(cls, value):
+        """returns tagged binary deserialized value."""
+        value, pos = cls._decode(memoryview(value), 0)
+        return value
+
+    @classmethod
+    def dumps(cls, value):
+        """returns tagged binary serialized value."""
+        buf = bytearray()
+        cls._encode(value, buf)
+        return bytes(buf)
+
+    @classmethod
+    def loads_field(cls, value, field):
+        """returns the deserialized `field` of a serialized map, decoding
+        nothing else. Raises KeyError if the map has no such field, and
+        TypeError if value is not a serialized map.
+        """
+        buf = memoryview(value)
+        if buf[0] != 0x64:  # d
+            raise TypeError('serialized value is not a map')
+
+        # compare encoded text field names without decoding them.
+        target = field.encode('utf-8') if isinstance(field, str) else None
+        read_varint = cls._read_varint
+        count, pos = read_varint(buf, 1)
+        for _ in range(count):
+            if target is not None and buf[pos] == 0x73:  # s
+                length, pos = read_varint(buf, pos + 1)
+                found = buf[pos:pos + length] == target
+                pos += length
+            else:
+                name, pos = cls._decode(buf, pos)
+                found = name == field
+            length, pos = read_varint(buf, pos)
+            if found:
+                return cls._decode(buf, pos)[0]
+            pos += length
+        raise KeyError(field)
+
+    @staticmethod
+    def _write_varint(number, buf):
+        while number > 0x7f:
+            buf.append((number & 0x7f) | 0x80)
+            number >>= 7
+        buf.append(number)
+
+    @staticmethod
+    def _read_varint(buf, pos):
+        number = 0
+        shift = 0
+        while True:
+            byte = buf[pos]
+            pos += 1
+            number |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return number, pos
+            shift += 7
+
+    @classmethod
+    def _encode(cls, value, buf):
+        # bool is an int subclass, so it must be checked first.
+        if value is None:
+            buf.append(0x4e)  # N
+        elif value is True:
+            buf.append(0x54)  # T
+        elif value is False:
+            buf.append(0x46)  # F
+        elif isinstance(value, int):
+            buf.append(0x69)  # i
+            zigzag = (value << 1) if value >= 0 else ((-value << 1) - 1)
+            cls._write_varint(zigzag, buf)
+        elif isinstance(value, float):
+            buf.append(0x66)  # f
+            buf += cls._double.pack(value)
+        elif isinstance(value, str):
+            data = value.encode('utf-8')
+            buf.append(0x73)  # s
+            cls._write_varint(len(data), buf)
+            buf += data
+        elif isinstance(value, (bytes, bytearray)):
+            buf.append(0x62)  # b
+            cls._write_varint(len(value), buf)
+            buf += value
+        elif isinstance(value, (list, tuple)):
+            buf.append(0x6c)  # l
+            cls._write_varint(len(value), buf)
+            for item in value:
+                cls._encode(item, buf)
+        elif isinstance(value, dict):
+            buf.append(0x64)  # d
+            cls._write_varint(len(value), buf)
+            for field, item in value.items():
+                cls._encode(field, buf)
+                encoded = bytearray()
+                cls._encode(item, encoded)
+                cls._write_varint(len(encoded), buf)
+                buf += encoded
+        else:
+            raise TypeError('{!r} is not serializable by {}'.format(
+                value, cls.__name__))
+
+    @classmethod
+    def _decode(cls, buf, pos):
+        tag = buf[pos]
+        pos += 1
+        if tag == 0x73:  # s
+            length, pos = cls._read_varint(buf, pos)
+            return str(buf[pos:pos + length], 'utf-8'), pos + length
+        elif tag == 0x69:  # i
+            zigzag, pos = cls._read_varint(buf, pos)
+            return (zigzag >> 1) ^ -(zigzag & 1), pos
+        elif tag == 0x64:  # d
+            count, pos = cls._read_varint(buf, pos)
+            value = {}
+            for _ in range(count):
+                field, pos = cls._decode(buf, pos)
+                length, pos = cls._read_varint(buf, pos)
+                value[field], pos = cls._decode(buf, pos)
+            return value, pos
+        elif tag == 0x6c:  # l
+            count, pos = cls._read_varint(buf, pos)
+            value = []
+            for _ in range(count):
+                item, pos = cls._decode(buf, pos)
+                value.append(item)
+            return value, pos
+        elif tag == 0x66:  # f
+            return cls._double.unpack_from(buf, pos)[0], pos + 8
+        elif tag == 0x4e:  # N
+            return None, pos
+        elif tag == 0x54:  # T
+            return True, pos
+        elif tag == 0x46:  # F
+            return False, pos
+        elif tag == 0x62:  # b
+            length, pos = cls._read_varint(buf, pos)
+            return bytes(buf[pos:pos + length]), pos + length
+        raise ValueError('invalid tag {!r} at offset {}'.format(tag, pos - 1))
+
+
+class Record(object):
+    """Base for the lightweight `__slots__` record classes of StructSerializer.
+    Fields are readable as attributes or items, and records compare equal to
+    records or mappings with the same field values.
+    """
+    __slots__ = ()
+    _fields = ()
+
+    def __init__(self, *values):
+        for field, value in zip(self._fields, values):
+            setattr(self, field, value)
+
+    def __getitem__(self, field):
+        if field not in self._fields:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __contains__(self, field):
+        return field in self._fields
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def keys(self):
+        return list(self._fields)
+
+    def _astuple(self):
+        return tuple(getattr(self, field) for field in self._fields)
+
+    def _asdict(self):
+        return dict(zip(self._fields, self._astuple()))
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return self._fields == other._fields \
+                and self._astuple() == other._astuple()
+        if isinstance(other, dict):
+            return self._asdict() == other
+        return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        values = ', '.join('{}={!r}'.format(f, getattr(self, f))
+                           for f in self._fields)
+        return '{}({})'.format(self.__class__.__name__, values)
+
+
+def record_class(name, fields):
+    """Returns a new Record subclass with `__slots__` for fields."""
+    fields = tuple(fields)
+    return type(name, (Record,), {'__slots__': fields, '_fields': fields})
+
+
+class StructSerializer(Serializer):
+    """Schema-driven binary serializer for homogeneous records.
+
+    Records are packed with `struct` into a fixed-layout section followed by
+    a section for variable length fields. The schema is a list of
+    (field, kind) pairs, where kind is a single struct format character
+    (e.g. 'q', 'd', 'I', '?') or 'str' / 'bytes' for variable length values:
+
+        StructSerializer([('host', 'str'), ('time', 'q'), ('value', 'd')])
+
+    dumps accepts mappings, objects with the fields as attributes, or
+    sequences in schema order. loads returns instances of `record_class`
+    (lightweight `__slots__` objects) or plain tuples. None is not
+    representable, every field must have a value.
+
+    A serialized record does not describe its own layout, so values must be
+    loaded with the schema they were dumped with. Serialized values are bytes.
+
+    :param schema: list of (field, kind) pairs.
+    :param name: the name of the generated record class.
+    :param tuples: if True, loads returns tuples instead of records.
+    """
+    binary = True
+    varlen_kinds = ('str', 'bytes')
+
+    def __init__(self, schema, name='Record', tuples=False):
+        self.schema = [(field, kind) for field, kind in schema]
+        self.fields = tuple(field for field, kind in self.schema)
+        self.tuples = tuples
+        self.record_class = record_class(name, self.fields)
+
+        fmt = '<'
+        self._varlen = []
+        for index, (field, kind) in enumerate(self.schema):
+            if kind in self.varlen_kinds:
+                fmt += 'I'  # length of the value in the varlen section
+                self._varlen.append((index, kind == 'str'))
+            elif len(kind) == 1 and kind in 'cbB?hHiIlLqQnNefd':
+                fmt += kind
+            else:
+                raise ValueError('invalid kind {!r} for field {!r}'.format(
+                    kind, field))
+        self._struct = struct.Struct(fmt)
+        self._index = dict((field, i) for i, field in enumerate(self.fields))
+
+    def _values(self, record):
+        if isinstance(record, (dict, Record)):
+            return [record[field] for field in self.fields]
+        if isinstance(record, (tuple, list)):
+            if len(record) != len(self.fields):
+                raise ValueError('record has {} values, schema has {}'.format(
+                    len(record), len(self.fields)))
+            return list(record)
+        return [getattr(record, field) for field in self.fields]
+
+    def dumps(self, record):
+        """returns struct packed record."""
+        values = self._values(record)
+        varlen = []
+        for index, text in self._varlen:
+            data = values[index]
+            if text:
+                data = data.encode('utf-8')
+            values[index] = len(data)
+            varlen.append(data)
+        return self._struct.pack(*values) + b''.join(varlen)
+
+    def loads(self, value):
+        """returns record (or tuple) unpacked from value."""
+        values = list(self._struct.unpack_from(value))
+        self._load_varlen(value, values)
+        if self.tuples:
+            return tuple(values)
+        return self.record_class(*values)
+
+    def _load_varlen(self, value, values):
+        pos = self._struct.size
+        for index, text in self._varlen:
+            length = values[index]
+            data = value[pos:pos + length]
+            values[index] = str(data, 'utf-8') if text else bytes(data)
+            pos += length
+
+    def loads_field(self, value, field):
+        """returns a single field of a packed record. Raises KeyError if the
+        schema has no such field.
+        """
+        index = self._index[field]
+        values = list(self._struct.unpack_from(value))
+        if self.schema[index][1] in self.varlen_kinds:
+            self._load_varlen(value, values)
+        return values[index]
+
+    def loads_many(self, values):
+        """returns a list of records (or tuples)."""
+        return [self.loads(value) for value in values]
+
+    def dumps_many(self, records):
+        """returns a list of packed records."""
+        return [self.dumps(record) for record in records]
+
+
+class CompressionSerializer(Serializer):
+    """Base for compressing serializers, meant to be the last layer of a Stack.
+
+    Serialized values carry a one-byte header. Values shorter than
+    `threshold` bytes (or values that do not shrink) are stored raw behind
+    the header, so tiny values never grow by more than one byte and do not
+    pay for compression. Text values are encoded as utf-8 and come back as
+    text; bytes come back as bytes.
+
+    Subclasses implement compress and decompress.
+
+    Compressors also stream, inside a Stack whose first serializer streams:
+    stream_writer and stream_reader wrap file objects, and streamed values
+    are readable by loads (and vice versa).
+
+    :param threshold: minimum size (in bytes) of values to compress.
+    """
+    binary = True
+    RAW = 0x00
+    COMPRESSED = 0x01
+    TEXT = 0x02
+
+    def __init__(self, threshold=128):
+        self.threshold = int(threshold)
+
+    def compress(self, data):
+        """returns compressed bytes."""
+        raise NotImplementedError
+
+    def decompress(self, data):
+        """returns decompressed bytes."""
+        raise NotImplementedError
+
+    def compressor(self, fileobj):
+        """returns a binary file object compressing into fileobj. Closing it
+        must flush but not close fileobj.
+        """
+        raise NotImplementedError
+
+    def decompressor(self, fileobj):
+        """returns a binary file object decompressing from fileobj."""
+        raise NotImplementedError
+
+    def stream_writer(self, fileobj, text=False):
+        """Writes a header into fileobj, and returns a binary file object that
+        compresses into fileobj. Close the returned file object when done.
+
+        :param text: whether the data written is utf-8 encoded text.
+        """
+        flags = self.COMPRESSED | (self.TEXT if text else 0)
+        fileobj.write(bytes((flags,)))
+        return self.compressor(fileobj)
+
+    def stream_reader(self, fileobj):
+        """Reads the header from fileobj, and returns a (binary file object,
+        text flag) pair reading the decompressed data.
+        """
+        flags = fileobj.read(1)[0]
+        text = bool(flags & self.TEXT)
+        if flags & self.COMPRESSED:
+            return self.decompressor(fileobj), text
+        return fileobj, text
+
+    def loads(self, value):
+        """returns decompressed value."""
+        flags = value[0]
+        data = memoryview(value)[1:]
+        if flags & self.COMPRESSED:
+            data = self.decompress(data)
+        if flags & self.TEXT:
+            return str(data, 'utf-8')
+        return bytes(data)
+
+    def dumps(self, value):
+        """returns compressed value, prefixed with a header byte."""
+        flags = self.RAW
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+            flags |= self.TEXT
+
+        if len(value) >= self.threshold:
+            compressed = self.compress(value)
+            if len(compressed) < len(value):
+                value = compressed
+                flags |= self.COMPRESSED
+
+        return bytes((flags,)) + value
+
+    def loads_many(self, values):
+        """returns a list of decompressed values."""
+        return [self.loads(value) for value in values]
+
+    def dumps_many(self, values):
+        """returns a list of compressed values."""
+        return [self.dumps(value) for value in values]
+
+
+class _ZlibWriter(io.RawIOBase):
+    """Writable binary file object compressing into fileobj."""
+    def __init__(self, fileobj, compressobj):
+        self._fileobj = fileobj
+        self._compressobj = compressobj
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._fileobj.write(self._compressobj.compress(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._fileobj.write(self._compressobj.flush())
+        super(_ZlibWriter, self).close()
+
+
+class _ZlibReader(io.RawIOBase):
+    """Readable binary file object decompressing from fileobj."""
+    chunksize = 1 << 16
+
+    def __init__(self, fileobj, decompressobj):
+        self._fileobj = fileobj
+        self._decompressobj = decompressobj
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        decompressobj = self._decompressobj
+        while not decompressobj.eof:
+            data = decompressobj.unconsumed_tail
+            if not data:
+                data = self._fileobj.read(self.chunksize)
+                if not data:
+                    raise EOFError('compressed stream ended early')
+            out = decompressobj.decompress(data, len(buf))
+            if out:
+                buf[:len(out)] = out
+                return len(out)
+        return 0
+
+
+class ZlibSerializer(CompressionSerializer):
+    """zlib compressing serializer.
+
+    :param threshold: minimum size (in bytes) of values to compress.
+    :param level: zlib compression level (0-9).
+    :param zdict: optional preset dictionary (see train_dictionary). Values
+                  must be loaded with the same dictionary they were dumped with.
+    """
+    def __init__(self, threshold=128, level=6, zdict=None):
+        super(ZlibSerializer, self).__init__(threshold)
+        self.level = level
+        self.zdict = zdict
+
+    def compress(self, data):
+        if not self.zdict:
+            return zlib.compress(data, self.level)
+        compressor = zlib.compressobj(self.level, zdict=self.zdict)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        if not self.zdict:
+            return zlib.decompress(data)
+        decompressor = zlib.decompressobj(zdict=self.zdict)
+        return decompressor.decompress(data) + decompressor.flush()
+
+    def _compressobj(self):
+        if not self.zdict:
+            return zlib.compressobj(self.level)
+        return zlib.compressobj(self.level, zdict=self.zdict)
+
+    def _decompressobj(self):
+        if not self.zdict:
+            return zlib.decompressobj()
+        return zlib.decompressobj(zdict=self.zdict)
+
+    def compressor(self, fileobj):
+        return _ZlibWriter(fileobj, self._compressobj())
+
+    def decompressor(self, fileobj):
+        return io.BufferedReader(_ZlibReader(fileobj, self._decompressobj()))
+
+
+class Bz2Serializer(CompressionSerializer):
+    """bz2 compressing serializer. Best suited to large values.
+
+    :param threshold: minimum size (in bytes) of values to compress.
+    :param level: bz2 compression level (1-9).
+    """
+    def __init__(self, threshold=1024, level=9):
+        super(Bz2Serializer, self).__init__(threshold)
+        self.level = level
+
+    def compress(self, data):
+        return bz2.compress(data, self.level)
+
+    def decompress(self, data):
+        return bz2.decompress(data)
+
+    def compressor(self, fileobj):
+        return bz2.BZ2File(fileobj, 'wb', compresslevel=self.level)
+
+    def decompressor(self, fileobj):
+        return bz2.BZ2File(fileobj, 'rb')
+
+
+class LzmaSerializer(CompressionSerializer):
+    """lzma compressing serializer. Best ratio, slowest to compress.
+
+    :param threshold: minimum size (in bytes) of values to compress.
+    :param preset: lzma compression preset (0-9).
+    """
+    def __init__(self, threshold=512, preset=6):
+        super(LzmaSerializer, self).__init__(threshold)
+        self.preset = preset
+
+    def compress(self, data):
+        return lzma.compress(data, format=lzma.FORMAT_RAW,
+                             filters=self._filters())
+
+    def decompress(self, data):
+        return lzma.decompress(data, format=lzma.FORMAT_RAW,
+                               filters=self._filters())
+
+    def compressor(self, fileobj):
+        return lzma.LZMAFile(fileobj, 'wb', format=lzma.FORMAT_RAW,
+                             filters=self._filters())
+
+    def decompressor(self, fileobj):
+        return lzma.LZMAFile(fileobj, 'rb', format=lzma.FORMAT_RAW,
+                             filters=self._filters())
+
+    def _filters(self):
+        # raw format avoids the ~60 bytes of xz container per value.
+        return [{'id': lzma.FILTER_LZMA2, 'preset': self.preset}]
+
+
+def train_dictionary(samples, size=16384, segment=64, gram=8):
+    """Returns a preset compression dictionary trained from `samples`.
+
+    Segments of the samples are scored by how many samples share their
+    `gram`-byte substrings, and the best segments are packed into at most
+    `size` bytes, the most useful last (closest to the compressed data).
+
+    :param samples: stored values (str or bytes), e.g. a sample of a store.
+    :param size: maximum dictionary size in bytes (zlib uses at most 32KB).
+    """
+    samples = [s.encode('utf-8') if isinstance(s, str) else bytes(s)
+               for s in samples]
+
+    counts = collections.Counter()
+    for sample in samples:
+        counts.update(set(sample[i:i + gram]
+                          for i in range(len(sample) - gram + 1)))
+
+    scores = {}
+    for sample in samples:
+        for start in range(0, len(sample), segment):
+            chunk = sample[start:start + segment]
+            if chunk not in scores:
+                scores[chunk] = sum(counts[chunk[i:i + gram]]
+                                    for i in range(len(chunk) - gram + 1))
+
+    chosen = []
+    total = 0
+    for chunk in sorted(scores, key=scores.get, reverse=True):
+        if scores[chunk] <= len(chunk):
+            break  # remaining segments are unique to a single sample.
+        if total + len(chunk) <= size:
+            chosen.append(chunk)
+            total += len(chunk)
+
+    return b''.join(reversed(chosen))
+
+
 class Stack(Serializer, list):
     """represents a stack of serializers, applying each in sequence."""
     def loads(self, value):
@@ -67,6 +768,87 @@ class Stack(Serializer, list):
             value = serializer.dumps(value)
         return value
 
+    def loads_many(self, values):
+        """Returns a list of deserialized values, one layer at a time."""
+        for serializer in reversed(self):
+            values = loads_many(serializer, values)
+        return values
+
+    def dumps_many(self, values):
+        """returns a list of serialized values, one layer at a time."""
+        for serializer in self:
+            values = dumps_many(serializer, values)
+        return values
+
+    def supports_fields(self):
+        """Returns whether loads_field can decode single fields."""
+        return len(self) > 0 and hasattr(self[0], 'loads_field')
+
+    def loads_field(self, value, field):
+        """Returns the deserialized `field` of a serialized map. Requires the
+        first serializer in the stack to implement loads_field.
+        """
+        if not self.supports_fields():
+            raise TypeError('{} does not support loads_field'.format(self[0]))
+        for serializer in reversed(self[1:]):
+            value = serializer.loads(value)
+        return self[0].loads_field(value, field)
+
+    @property
+    def binary(self):
+        """Whether the stack serializes to bytes (decided by its last layer)."""
+        return len(self) > 0 and is_binary(self[-1])
+
+    def supports_streams(self):
+        """Returns whether the stack streams: its first serializer must
+        implement dump/load, and any others must be CompressionSerializers.
+        """
+        return len(self) > 0 \
+            and Serializer.implements_stream_interface(self[0]) \
+            and all(isinstance(s, CompressionSerializer) for s in self[1:])
+
+    def dump(self, value, fileobj):
+        """Serializes value into fileobj, streaming through every layer."""
+        if not self.supports_streams():
+            raise TypeError('{!r} does not support streaming'.format(self))
+
+        text = not is_binary(self[0])
+        streams = []
+        for serializer in reversed(self[1:]):
+            fileobj = serializer.stream_writer(fileobj, text=text and
+                                               serializer is self[1])
+            streams.append(fileobj)
+
+        if text and streams:
+            wrapper = io.TextIOWrapper(fileobj, encoding='utf-8')
+            self[0].dump(value, wrapper)
+            wrapper.flush()
+            wrapper.detach()
+        else:
+            self[0].dump(value, fileobj)
+
+        for stream in reversed(streams):
+            stream.close()
+
+    def load(self, fileobj):
+        """Returns value deserialized from fileobj, streaming through every
+        layer.
+        """
+        if not self.supports_streams():
+            raise TypeError('{!r} does not support streaming'.format(self))
+
+        text = False
+        for serializer in reversed(self[1:]):
+            fileobj, text = serializer.stream_reader(fileobj)
+
+        if text:
+            fileobj = io.TextIOWrapper(fileobj, encoding='utf-8')
+        return self[0].load(fileobj)
+
+    def __reduce__(self):
+        # module serializers (json, pickle) are sent to worker processes by name.
+        return (_resolve_stack, ([_portable(s) for s in self],))
+
 
 class MapSerializer(Serializer):
     """map serializer that ensures the serialized value is a mapping type."""
@@ -88,16 +870,139 @@ class MapSerializer(Serializer):
         return value
 
 
-def deserialized_gen(serializer, iterable):
-    """Generator that yields deserialized objects from iterable."""
-    for item in iterable:
-        yield serializer.loads(item)
+def is_binary(serializer):
+    """Returns whether serializer produces bytes (and streams to binary files).
+    """
+    if serializer in (pickle, marshal):
+        return True
+    return bool(getattr(serializer, 'binary', False))
+
+
+def _json_loads_many(values):
+    values = list(values)
+    if not all(isinstance(value, str) for value in values):
+        return [json.loads(value) for value in values]
+
+    loaded = json.loads('[' + ','.join(values) + ']')
+    if len(loaded) != len(values):
+        raise ValueError('json values do not each hold a single document')
+    return loaded
+
+
+def _portable(serializer):
+    """Returns serializer, or its module name if it is a module (not picklable)."""
+    if isinstance(serializer, type(json)):
+        return serializer.__name__
+    return serializer
+
+
+def _resolve(serializer):
+    """Inverse of _portable."""
+    if isinstance(serializer, str):
+        return importlib.import_module(serializer)
+    return serializer
+
+
+def _resolve_stack(layers):
+    return Stack([_resolve(layer) for layer in layers])
+
+
+def loads_many(serializer, values):
+    """Returns a list of deserialized values, batched when serializer supports
+    it (loads_many). Works with any object implementing the serializer protocol.
+    """
+    serializer = _resolve(serializer)
+    if serializer is json:
+        return _json_loads_many(values)
+    if hasattr(serializer, 'loads_many'):
+        return serializer.loads_many(values)
+    return [serializer.loads(value) for value in values]
+
+
+def dumps_many(serializer, values):
+    """Returns a list of serialized values, batched when serializer supports
+    it (dumps_many). Works with any object implementing the serializer protocol.
+    """
+    serializer = _resolve(serializer)
+    if hasattr(serializer, 'dumps_many'):
+        return serializer.dumps_many(values)
+    return [serializer.dumps(value) for value in values]
 
 
-def serialized_gen(serializer, iterable):
-    """Generator that yields serialized objects from iterable."""
+def _pages(iterable, pagesize):
+    """Generator that yields lists of up to pagesize items from iterable."""
+    page = []
     for item in iterable:
-        yield serializer.dumps(item)
+        page.append(item)
+        if len(page) >= pagesize:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def _batched_gen(fn, serializer, iterable, pagesize, executor):
+    """Generator applying fn(serializer, page) to pages of iterable, in order.
+    With an executor, up to two pages per worker are processed concurrently.
+    """
+    pages = _pages(iterable, pagesize or 1000)
+
+    if executor is None:
+        for page in pages:
+            for item in fn(serializer, page):
+                yield item
+        return
+
+    serializer = _portable(serializer)
+    window = 2 * (getattr(executor, '_max_workers', None) or 1)
+    pending = collections.deque()
+    try:
+        for page in pages:
+            pending.append(executor.submit(fn, serializer, page))
+            if len(pending) >= window:
+                for item in pending.popleft().result():
+                    yield item
+
+        while pending:
+            for item in pending.popleft().result():
+                yield item
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def deserialized_gen(serializer, iterable, pagesize=None, executor=None):
+    """Generator that yields deserialized objects from iterable.
+
+    :param pagesize: if given, deserializes pages of items with loads_many.
+    :param executor: an optional concurrent.futures executor (e.g. a
+                     ProcessPoolExecutor) to deserialize pages in parallel.
+                     Results keep the order of iterable.
+    """
+    if pagesize is None and executor is None:
+        for item in iterable:
+            yield serializer.loads(item)
+    else:
+        for item in _batched_gen(loads_many, serializer, iterable, pagesize,
+                                 executor):
+            yield item
+
+
+def serialized_gen(serializer, iterable, pagesize=None, executor=None):
+    """Generator that yields serialized objects from iterable.
+
+    :param pagesize: if given, serializes pages of items with dumps_many.
+    :param executor: an optional concurrent.futures executor (e.g. a
+                     ProcessPoolExecutor) to serialize pages in parallel.
+                     Results keep the order of iterable.
+    """
+    if pagesize is None and executor is None:
+        for item in iterable:
+            yield serializer.dumps(item)
+    else:
+        for item in _batched_gen(dumps_many, serializer, iterable, pagesize,
+                                 executor):
+            yield item
 
 
 def monkey_patch_bson(bson=None):
@@ -112,6 +1017,248 @@ def monkey_patch_bson(bson=None):
         bson.dumps = lambda document: bson.BSON.encode(document)
 
 
+def supports_streams(datastore):
+    """Returns whether datastore implements get_stream and put_stream."""
+    return callable(getattr(datastore, 'get_stream', None)) \
+        and callable(getattr(datastore, 'put_stream', None))
+
+
+def supports_fields(serializer):
+    """Returns whether serializer can decode single map fields (loads_field)."""
+    if isinstance(serializer, Stack):
+        return serializer.supports_fields()
+    return hasattr(serializer, 'loads_field')
+
+
+class LazyValue(object):
+    """Proxy for a serialized value that is deserialized on first use.
+
+    If the serializer supports it (see supports_fields), item access and
+    membership tests decode only the requested field, so query filters can
+    reject a value without ever decoding it in full. The deserialized value
+    itself is available as `value`.
+    """
+    __slots__ = ('_serializer', '_serialized', '_value', '_loaded', '_fields')
+
+    def __init__(self, serializer, serialized):
+        self._serializer = serializer
+        self._serialized = serialized
+        self._value = None
+        self._loaded = False
+        self._fields = None if supports_fields(serializer) else False
+
+    @property
+    def value(self):
+        """Returns the deserialized value, decoding it on first access."""
+        if not self._loaded:
+            self._value = self._serializer.loads(self._serialized)
+            self._serialized = None
+            self._loaded = True
+            self._fields = False
+        return self._value
+
+    @property
+    def loaded(self):
+        """Returns whether the value has been fully deserialized."""
+        return self._loaded
+
+    def _field(self, field):
+        """Returns the field decoded on its own, or a sentinel if the value
+        must be fully decoded instead. Raises KeyError if field is missing.
+        """
+        if self._fields is False:
+            return LazyValue
+        if self._fields is None:
+            self._fields = {}
+        if field not in self._fields:
+            try:
+                self._fields[field] = self._serializer.loads_field(
+                    self._serialized, field)
+            except KeyError:
+                self._fields[field] = KeyError
+            except TypeError:
+                self._fields = False  # not a map
+                return LazyValue
+        if self._fields[field] is KeyError:
+            raise KeyError(field)
+        return self._fields[field]
+
+    def __getitem__(self, field):
+        value = self._field(field)
+        return self.value[field] if value is LazyValue else value
+
+    def __contains__(self, field):
+        try:
+            value = self._field(field)
+        except KeyError:
+            return False
+        return field in self.value if value is LazyValue else True
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except (KeyError, IndexError):
+            return default
+
+    def __getattr__(self, name):
+        if name in LazyValue.__slots__:
+            raise AttributeError(name)
+
+        # field lookups (e.g. Filter) check attributes before items. A map
+        # has no attributes named like its fields, so answer without decoding.
+        if not self._loaded and self._fields is not False \
+                and not hasattr(dict, name):
+            try:
+                is_map = self._field(name) is not LazyValue
+            except KeyError:
+                is_map = True
+            if is_map:
+                raise AttributeError(name)
+        return getattr(self.value, name)
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyValue):
+            other = other.value
+        return self.value == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'LazyValue({!r})'.format(self.value)
+
+
+def lazy_gen(serializer, iterable):
+    """Generator that yields LazyValue proxies for items in iterable."""
+    for item in iterable:
+        yield LazyValue(serializer, item)
+
+
+_immutable_types = (str, bytes, int, float, bool, type(None))
+
+
+def _copy_value(value):
+    """Returns a deep copy of value. Faster than copy.deepcopy on plain data."""
+    if isinstance(value, dict):
+        return {k: _copy_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_value(v) for v in value]
+    if isinstance(value, _immutable_types):
+        return value
+    return copy.deepcopy(value)
+
+
+def _freeze_value(value):
+    """Returns a read-only version of value: dicts become mapping proxies,
+    lists become tuples and sets become frozensets.
+    """
+    if isinstance(value, dict):
+        return types.MappingProxyType(
+            {k: _freeze_value(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze_value(v) for v in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+class DeserializedCache(object):
+    """Bounded LRU cache of deserialized values, for SerializerShimDatastore.
+
+    Entries map a key to (fingerprint of the serialized value, deserialized
+    value). A cached value is only used while the child datastore still holds
+    the same serialized bytes, so writes that bypass the shim are safe.
+
+    Modes control what callers receive, as cached objects are shared:
+
+        copy    a fresh deep copy per read (default, transparent)
+        freeze  a shared read-only object (dicts become mapping proxies,
+                lists become tuples). Hits cost O(1).
+        None    the shared cached object itself. Callers must not mutate it.
+
+    :param size: the maximum number of cached values.
+    :param mode: one of 'copy', 'freeze' or None.
+    """
+    modes = ('copy', 'freeze', None)
+
+    def __init__(self, size=1024, mode='copy'):
+        if mode not in self.modes:
+            raise ValueError('mode must be one of {}'.format(self.modes))
+
+        self.size = int(size)
+        self.mode = mode
+        self.stats = collections.Counter()
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        """Returns the fraction of lookups served from the cache."""
+        lookups = self.stats['hits'] + self.stats['misses']
+        return float(self.stats['hits']) / lookups if lookups else 0.0
+
+    @staticmethod
+    def fingerprint(value):
+        """Returns a digest of serialized value, or None if it is not text or
+        bytes (such values are never cached).
+        """
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        elif not isinstance(value, (bytes, bytearray, memoryview)):
+            return None
+        return hashlib.blake2b(value, digest_size=16).digest()
+
+    def loads(self, key, value, loads):
+        """Returns the deserialized value named by key, calling loads(value)
+        only if the cached entry is missing or stale.
+        """
+        key = str(key)
+        fingerprint = self.fingerprint(value)
+        entry = self._entries.get(key)
+
+        if entry is not None and fingerprint is not None \
+                and entry[0] == fingerprint:
+            self.stats['hits'] += 1
+            self._entries.move_to_end(key)
+            return self._read(entry[1])
+
+        self.stats['misses'] += 1
+        loaded = loads(value)
+        if fingerprint is None or self.size <= 0:
+            return loaded
+
+        if self.mode == 'freeze':
+            loaded = _freeze_value(loaded)
+        self._entries[key] = (fingerprint, loaded)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+        return self._read(loaded)
+
+    def _read(self, value):
+        return _copy_value(value) if self.mode == 'copy' else value
+
+    def invalidate(self, key):
+        """Drops the cached value named by key, if any."""
+        if self._entries.pop(str(key), None) is not None:
+            self.stats['invalidations'] += 1
+
+    def clear(self):
+        """Drops all cached values."""
+        self._entries.clear()
+
+
 class SerializerShimDatastore(ShimDatastore):
     """Represents a Datastore that serializes and deserializes values.
 
@@ -121,23 +1268,54 @@ class SerializerShimDatastore(ShimDatastore):
 
     :param datastore: a child datastore for the ShimDatastore superclass.
     :param serializer: a serializer object (responds to loads and dumps).
+    :param pagesize: if given, query results are deserialized in pages of
+                     this many values with the serializer's loads_many.
+    :param executor: an optional concurrent.futures executor to deserialize
+                     query result pages in parallel. Use a ProcessPoolExecutor
+                     for CPU-bound serializers; the serializer must be
+                     picklable (modules and Stacks of modules are).
+    :param cache: an optional DeserializedCache, letting get skip loads for
+                  values that have not changed since they were last read.
+    :param lazy: if True, query results are LazyValue proxies that deserialize
+                 on first use (only the needed fields, if the serializer
+                 supports loads_field, e.g. TaggedSerializer).
+    :param check: if True (default), ensure the serializer round-trips a
+                  sample value. Disable for schema-bound serializers such as
+                  StructSerializer.
+    :param streams: whether get and put stream values through the serializer's
+                    dump/load and the child's get_stream/put_stream, instead
+                    of holding whole serialized values in memory. Defaults to
+                    True when both support it (and no cache is used).
     """
     # override this with their own custom serializer on a class-wide or per-
     # instance basis. If you plan to store mostly strings, use NonSerializer.
     serializer = default_serializer
 
-    def __init__(self, datastore, serializer=None):
+    def __init__(self, datastore, serializer=None, pagesize=None,
+                 executor=None, cache=None, lazy=False, check=True,
+                 streams=None):
         """Initializes internals and tests the serializer."""
         super(SerializerShimDatastore, self).__init__(datastore)
 
         if serializer:
             self.serializer = serializer
 
+        self.pagesize = pagesize
+        self.executor = executor
+        self.cache = cache
+        self.lazy = lazy
+
+        if streams is None:
+            streams = cache is None and supports_streams(datastore) \
+                and Serializer.implements_stream_interface(self.serializer)
+        self.streams = streams
+
         # ensure serializer works
-        test = {'value': repr(self)}
-        errstr = 'Serializer error: serialized value does not match original'
-        val = self.serializer.dumps(test)
-        assert self.serializer.loads(val) == test, errstr
+        if check:
+            test = {'value': repr(self)}
+            errstr = 'Serializer error: serialized value does not match original'
+            val = self.serializer.dumps(test)
+            assert self.serializer.loads(val) == test, errstr
 
     def serializedValue(self, value):
         """Returns serialized value or None."""
@@ -154,8 +1332,17 @@ class SerializerShimDatastore(ShimDatastore):
 
         :param key: Key object naming the object to retrieve
         """
+        if self.streams:
+            return self._load_stream(key)
+
         value = self.child_datastore.get(key)
-        return self.deserializedValue(value)
+        if self.cache is None:
+            return self.deserializedValue(value)
+
+        if value is None:
+            self.cache.invalidate(key)
+            return None
+        return self.cache.loads(key, value, self.serializer.loads)
 
     def put(self, key, value):
         """Stores the object value named by key. Serializes values on the way in,
@@ -164,9 +1351,108 @@ class SerializerShimDatastore(ShimDatastore):
         :param key: Key naming value
         :param value: the object to store.
         """
+        if self.streams and value is not None:
+            self.child_datastore.put_stream(key, lambda fileobj:
+                                            self._dump_stream(value, fileobj))
+            return
+
         value = self.serializedValue(value)
+        if self.cache is not None:
+            self.cache.invalidate(key)
         self.child_datastore.put(key, value)
 
+    def delete(self, key):
+        """Removes the object named by key from the child_datastore.
+
+        :param key: Key naming the object to remove.
+        """
+        if self.cache is not None:
+            self.cache.invalidate(key)
+        self.child_datastore.delete(key)
+
+    def get_many(self, keys):
+        """Return the objects named by keys. Retrieves the values from the
+        child_datastore in one batch, and de-serializes them together.
+
+        :param keys: iterable of Key objects naming the objects to retrieve.
+        """
+        keys = list(keys)
+        if self.streams:
+            return [self._load_stream(key) for key in keys]
+
+        values = self.child_datastore.get_many(keys)
+        present = [i for i, value in enumerate(values) if value is not None]
+        if self.cache is not None:
+            for i, key in enumerate(keys):
+                if values[i] is None:
+                    self.cache.invalidate(key)
+                else:
+                    values[i] = self.cache.loads(key, values[i],
+                                                 self.serializer.loads)
+            return values
+
+        loaded = loads_many(self.serializer, [values[i] for i in present])
+        for i, value in zip(present, loaded):
+            values[i] = value
+        return values
+
+    def put_many(self, items):
+        """Stores the (key, value) pairs in items. Serializes the values
+        together, and stores them into the child_datastore in one batch.
+
+        :param items: iterable of (key, value) pairs.
+        """
+        items = list(items)
+        if self.streams:
+            for key, value in items:
+                self.put(key, value)
+            return
+
+        keys = [key for key, value in items]
+        present = [i for i, (key, value) in enumerate(items) if value is not None]
+        values = [None] * len(items)
+        dumped = dumps_many(self.serializer, [items[i][1] for i in present])
+        for i, value in zip(present, dumped):
+            values[i] = value
+
+        if self.cache is not None:
+            for key in keys:
+                self.cache.invalidate(key)
+        self.child_datastore.put_many(list(zip(keys, values)))
+
+    def delete_many(self, keys):
+        """Removes the objects named by keys from the child_datastore.
+
+        :param keys: iterable of Key objects naming the objects to remove.
+        """
+        keys = list(keys)
+        if self.cache is not None:
+            for key in keys:
+                self.cache.invalidate(key)
+        self.child_datastore.delete_many(keys)
+
+    def _load_stream(self, key):
+        """Returns the value named by key, streamed from the child_datastore."""
+        fileobj = self.child_datastore.get_stream(key)
+        if fileobj is None:
+            return None
+
+        with fileobj:
+            if is_binary(self.serializer):
+                return self.serializer.load(fileobj)
+            return self.serializer.load(io.TextIOWrapper(fileobj,
+                                                         encoding='utf-8'))
+
+    def _dump_stream(self, value, fileobj):
+        """Serializes value into binary file fileobj."""
+        if is_binary(self.serializer):
+            self.serializer.dump(value, fileobj)
+        else:
+            text = io.TextIOWrapper(fileobj, encoding='utf-8')
+            self.serializer.dump(value, text)
+            text.flush()
+            text.detach()
+
     def query(self, query):
         """Returns an iterable of objects matching criteria expressed in query.
         De-serializes values on the way out, using deserialized_gen to
@@ -174,18 +1460,32 @@ class SerializerShimDatastore(ShimDatastore):
         if iteration over results does not finish (subject to order generator
         constraint).
 
+        Filters and orders need deserialized values, so queries that use them
+        fetch the whole collection from the child_datastore and apply the
+        query here. In lazy mode, values are LazyValue proxies and values
+        rejected by filters are never fully deserialized.
+
         :param query: Query object describing the objects to return.
         """
-        # run the query on the child datastore
-        cursor = self.child_datastore.query(query)
+        if not query.filters and not query.orders:
+            cursor = self.child_datastore.query(query)
+            cursor._iterable = self._deserialized_gen(cursor._iterable)
+            return cursor
 
-        # chain the deserializing generator to the cursor's result set iterable
-        cursor._iterable = deserialized_gen(self.serializer, cursor._iterable)
+        # run an unconstrained query on the child datastore
+        child_query = query.__class__(query.key, query.object_getattr)
+        cursor = self.child_datastore.query(child_query)
+        return query(self._deserialized_gen(cursor))
 
-        return cursor
+    def _deserialized_gen(self, iterable):
+        """Returns a generator deserializing (or proxying) iterable."""
+        if self.lazy:
+            return lazy_gen(self.serializer, iterable)
+        return deserialized_gen(self.serializer, iterable, self.pagesize,
+                                self.executor)
 
 
-def shim(datastore, serializer=None):
+def shim(datastore, serializer=None, **kwargs):
     """Return a SerializerShimDatastore wrapping datastore.
 
     Can be used as a syntacticly-nicer eay to wrap a datastore with a
@@ -195,4 +1495,4 @@ def shim(datastore, serializer=None):
 
         my_store = datastore.serialize.shim(my_store, json)
     """
-    return SerializerShimDatastore(datastore, serializer=serializer)
+    return SerializerShimDatastore(datastore, serializer=serializer, **kwargs)
@@ -0,0 +1,321 @@
+"""Placement strategies mapping keys to the shards of a ShardedDatastore.
+
+A placement is built from the shards' (name, weight) pairs with update(),
+and maps a key hash (the value of the sharding function) to a shard index
+with locate(). Besides Modulo (hash % shards, the original behavior), the
+placements here move about 1/n of the keys when growing to n shards:
+
+* ConsistentHashRing: virtual nodes on a hash ring, O(log n) lookups.
+* JumpHash: jump consistent hash (Lamping & Veach), O(log n), no memory;
+  shards may only be added or removed at the end.
+* Rendezvous: weighted highest random weight hashing, O(n) lookups.
+
+e.g.::
+
+    >>> from datastore.core.sharding import ConsistentHashRing
+    >>> ds = ShardedDatastore(shards, placement=ConsistentHashRing())
+
+To change the shards or placement of a live ShardedDatastore, reshard() it
+and run the returned Rebalancer::
+
+    >>> rebalancer = ds.reshard(shards + [new_shard])
+    >>> rebalancer.run()  # moves ~1/9 of the objects; ds stays usable
+"""
+import bisect
+import collections
+import hashlib
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .key import Key
+
+_mask64 = (1 << 64) - 1
+
+
+def mix64(value):
+    """splitmix64 finalizer: spreads the low 64 bits of `value`."""
+    value = (value + 0x9E3779B97F4A7C15) & _mask64
+    value = (value ^ (value >> 30)) * 0xBF58476D1CE4E5B9 & _mask64
+    value = (value ^ (value >> 27)) * 0x94D049BB133111EB & _mask64
+    return value ^ (value >> 31)
+
+
+def stable_hash(string):
+    """Returns a 64 bit hash of `string`, identical across processes."""
+    digest = hashlib.blake2b(string.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class Modulo(object):
+    """Places a key hash on shard hash % len(shards). Changing the number of
+    shards moves almost every key.
+    """
+    def update(self, nodes):
+        self.count = len(nodes)
+
+    def locate(self, value):
+        return int(value % self.count)
+
+
+class ConsistentHashRing(object):
+    """Consistent hashing: each shard owns `vnodes` points (times its weight)
+    on a ring of 64 bit hashes, and a key belongs to the shard owning the
+    first point at or after the key's hash.
+    """
+    def __init__(self, vnodes=160):
+        self.vnodes = vnodes
+        self._points = []
+        self._owners = []
+
+    def update(self, nodes):
+        ring = []
+        for index, (name, weight) in enumerate(nodes):
+            for i in range(int(round(self.vnodes * weight))):
+                ring.append((stable_hash('{}#{}'.format(name, i)), index))
+        ring.sort()
+        self._points = [point for point, index in ring]
+        self._owners = [index for point, index in ring]
+
+    def locate(self, value):
+        i = bisect.bisect_left(self._points, mix64(int(value)))
+        return self._owners[i if i < len(self._owners) else 0]
+
+
+class JumpHash(object):
+    """Jump consistent hash. Needs no state beyond the number of shards, but
+    keys only move correctly when shards are appended or removed from the
+    end; weights are ignored.
+    """
+    def update(self, nodes):
+        self.count = len(nodes)
+
+    def locate(self, value):
+        key = mix64(int(value))
+        b, j = -1, 0
+        while j < self.count:
+            b = j
+            key = (key * 2862933555777941757 + 1) & _mask64
+            j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+        return b
+
+
+class Rendezvous(object):
+    """Weighted rendezvous (highest random weight) hashing: a key belongs to
+    the shard with the highest score -weight / ln(hash(shard, key)). Only the
+    keys of a removed shard move, and shards take keys in proportion to
+    their weights.
+    """
+    def update(self, nodes):
+        self._nodes = [(stable_hash(str(name)), float(weight))
+                       for name, weight in nodes]
+
+    def locate(self, value):
+        key = mix64(int(value))
+        best, best_score = 0, None
+        for index, (seed, weight) in enumerate(self._nodes):
+            u = (mix64(seed ^ key) >> 11) + 0.5
+            score = -weight / math.log(u / float(1 << 53))
+            if best_score is None or score > best_score:
+                best, best_score = index, score
+        return best
+
+
+class ShardRouter(object):
+    """Maps keys to shard indexes for a sharded collection: the key hash
+    (`shardingfn(key)`) is placed by `placement`, and routes are cached by
+    key (up to `cache_size` keys) until shards change.
+
+    Shards are named, so placements can keep keys on the same shards when
+    others are added or removed. Names default to 'shard:<n>', in order of
+    addition.
+    """
+    def __init__(self, shardingfn=hash, placement=None, cache_size=100000):
+        if not callable(shardingfn):
+            raise TypeError('shardingfn (type {}) is not callable'.format(type(shardingfn)))
+
+        self.shardingfn = shardingfn
+        self.placement = Modulo() if placement is None else placement
+        self.cache_size = cache_size
+        self.names = []
+        self.weights = []
+        self._added = 0
+        self._routes = {}
+
+    def reserve(self, router):
+        """Continues the default names of `router`, so they are not reused."""
+        self._added = max(self._added, router._added)
+
+    def insert(self, index, name=None, weight=1):
+        """Adds a shard at `index`."""
+        if name is None:
+            while 'shard:{}'.format(self._added) in self.names:
+                self._added += 1
+            name = 'shard:{}'.format(self._added)
+            self._added += 1
+        elif name in self.names:
+            raise ValueError('shard name {!r} is already used.'.format(name))
+        self.names.insert(index, name)
+        self.weights.insert(index, weight)
+        self.update()
+
+    def remove(self, index):
+        """Removes the shard at `index`."""
+        del self.names[index]
+        del self.weights[index]
+        self.update()
+
+    def update(self):
+        """Rebuilds the placement, and forgets cached routes."""
+        self.placement.update(list(zip(self.names, self.weights)))
+        self._routes = {}
+
+    def shard(self, key):
+        """Returns the index of the shard owning `key`."""
+        k = str(key)
+        index = self._routes.get(k)
+        if index is None:
+            index = self.placement.locate(self.shardingfn(key))
+            if self.cache_size:
+                if len(self._routes) >= self.cache_size:
+                    self._routes = {}
+                self._routes[k] = index
+        return index
+
+
+class Throttle(object):
+    """Limits a rate (e.g. objects per second) across threads."""
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, amount):
+        """Blocks until `amount` more units are allowed."""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + amount / float(self.rate)
+        if start > now:
+            time.sleep(start - now)
+
+
+class Rebalancer(object):
+    """Moves the objects of a ShardedDatastore whose shard changed with
+    ShardedDatastore.reshard(). Returned by reshard().
+
+    Each previous shard is scanned (with keys()); objects owned by another
+    shard are moved in batches of `batch_size`, by `workers` threads, at up
+    to `rate` objects per second. Batches take the datastore's per-key locks,
+    so concurrent writes are never overwritten by moved values.
+
+    Progress is checkpointed per previous shard to `checkpoint` (a Datastore)
+    under `checkpoint_key`: after a restart, reshard() to the same
+    configuration with the same checkpoint resumes with the shards not done.
+
+    :param sharded: the ShardedDatastore being resharded.
+    :param batch_size: objects moved per batch.
+    :param workers: number of threads moving batches.
+    :param rate: maximum objects moved per second (None: unlimited).
+    :param checkpoint: optional Datastore recording progress.
+    :param checkpoint_key: Key of the progress record.
+    """
+    def __init__(self, sharded, batch_size=500, workers=4, rate=None,
+                 checkpoint=None, checkpoint_key=None):
+        self.sharded = sharded
+        self.batch_size = batch_size
+        self.workers = workers
+        self.throttle = Throttle(rate)
+        self.checkpoint = checkpoint
+        self.checkpoint_key = checkpoint_key or Key('/datastore/rebalance')
+        self.stats = collections.Counter()
+        self._stats_lock = threading.Lock()
+        self._done = set()
+
+    def done(self):
+        """Returns the names of the previous shards already rebalanced."""
+        if self.checkpoint is None:
+            return set(self._done)
+        state = self.checkpoint.get(self.checkpoint_key) or {}
+        return set(state.get('done', []))
+
+    def _save(self, done):
+        self._done = set(done)
+        if self.checkpoint is not None:
+            self.checkpoint.put(self.checkpoint_key, {'done': sorted(done)})
+
+    def run(self):
+        """Moves all objects to their new shards, then completes the
+        resharding (reads stop falling back to previous shards).
+        """
+        previous = self.sharded._previous
+        if previous is None:
+            return
+        stores, router = previous
+
+        done = self.done()
+        with ThreadPoolExecutor(self.workers) as executor:
+            for name, store in zip(router.names, stores):
+                if name in done:
+                    continue
+                self._rebalance(store, executor)
+                done.add(name)
+                self._save(done)
+
+        self.sharded._finish_resharding()
+        if self.checkpoint is not None:
+            self.checkpoint.delete(self.checkpoint_key)
+
+    def _rebalance(self, store, executor):
+        """Moves the objects of previous shard `store` that belong elsewhere."""
+        sharded = self.sharded
+        pending = collections.deque()
+        stripes = {}
+        for key in store.keys():
+            self.stats['scanned'] += 1
+            if sharded.shardDatastore(key) is store:
+                continue
+
+            lock = sharded._lock(key)
+            batch = stripes.setdefault(id(lock), [])
+            batch.append(key)
+            if len(batch) >= self.batch_size:
+                del stripes[id(lock)]
+                pending.append(executor.submit(self._move, store, lock, batch))
+                while len(pending) > 2 * self.workers:
+                    pending.popleft().result()
+
+        for keys in stripes.values():
+            pending.append(executor.submit(
+                self._move, store, sharded._lock(keys[0]), keys))
+        for future in pending:
+            future.result()
+
+    def _move(self, store, lock, keys):
+        """Moves `keys` (sharing `lock`) from `store` to their new shards."""
+        self.throttle(len(keys))
+        sharded = self.sharded
+        moved = 0
+        with lock:
+            values = store.get_many(keys)
+            groups = {}
+            for key, value in zip(keys, values):
+                if value is not None:
+                    target = sharded.shardDatastore(key)
+                    groups.setdefault(id(target), (target, []))[1].append((key, value))
+
+            for target, items in groups.values():
+                # objects written since resharding are newer; keep them.
+                exists = target.contains_many([key for key, value in items])
+                items = [item for item, found in zip(items, exists) if not found]
+                if items:
+                    target.put_many(items)
+                    moved += len(items)
+            store.delete_many(keys)
+
+        with self._stats_lock:
+            self.stats['moved'] += moved
+            self.stats['batches'] += 1
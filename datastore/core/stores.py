@@ -1,5 +1,16 @@
+import collections
+import copy
+import random
+import sys
+import threading
+import time
+import weakref
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+
 from .key import Key
 from .query import Cursor
+from .sharding import ShardRouter, Rebalancer
 
 class Datastore(object):
     """A Datastore represents storage for any key-value pair.
@@ -18,7 +29,8 @@ class Datastore(object):
     support queries efficiently.
 
     Datastore implementations MUST implement: get, put, delete, query
-    Datastore implementations may optionally implement: contains
+    Datastore implementations may optionally implement: contains, and the
+    batch operations get_many, put_many, delete_many, contains_many
     """
     def get(self, key):
         """Return the object named by key or None if it does not exist.
@@ -65,6 +77,46 @@ class Datastore(object):
         """
         return self.get(key) is not None
 
+    # batch operations. The default implementations loop over the single key
+    # operations. Datastores that can batch (or save per-call work) override.
+    def get_many(self, keys):
+        """Returns a list of the objects named by keys, with None for objects
+        that do not exist.
+
+        :param keys: iterable of Key objects naming the objects to retrieve.
+        """
+        return [self.get(key) for key in keys]
+
+    def put_many(self, items):
+        """Stores each object value named by key in items.
+
+        :param items: iterable of (key, value) pairs.
+        """
+        for key, value in items:
+            self.put(key, value)
+
+    def delete_many(self, keys):
+        """Removes the objects named by keys.
+
+        :param keys: iterable of Key objects naming the objects to remove.
+        """
+        for key in keys:
+            self.delete(key)
+
+    def contains_many(self, keys):
+        """Returns a list of whether each object named by keys exists.
+
+        :param keys: iterable of Key objects naming the objects to check.
+        """
+        return [self.contains(key) for key in keys]
+
+    def keys(self):
+        """Returns an iterable of the Keys of all objects in this datastore.
+        Optional: used by datastores that scan the whole keyspace (e.g. to
+        rebuild an index).
+        """
+        raise NotImplementedError
+
 
 class NullDatastore(Datastore):
     """Stores nothing, but conforms to the API. Useful for testing."""
@@ -85,79 +137,269 @@ class NullDatastore(Datastore):
         return query([])
 
 
+def _partition(kstring):
+    """Returns the partition of the key string `kstring`: str(key.path),
+    computed without building intermediate Keys.
+    """
+    i = kstring.rfind('/')
+    parent = kstring[:i]
+    colon = kstring.find(':', i + 1)
+    if colon <= i + 1:
+        return parent or '/'
+    return parent + '/' + kstring[i + 1:colon]
+
+
+_missing = object()
+
+
 class DictDatastore(Datastore):
-    """Simple in-memory datastore backed by nested dicts."""
+    """Simple in-memory datastore backed by dicts.
+
+    Objects are stored in one dict keyed by key string, so reads hash a
+    string (not a Key) and never allocate. Key strings are also indexed by
+    partition (the key path, see Key.path) for queries; partitions are only
+    computed when keys are added or removed, and empty ones are dropped.
+
+    snapshot() returns a read-only, point-in-time view (see Snapshot).
+    """
+    _ordered = False
+
     def __init__(self):
         self._items = dict()
+        self._partitions = dict()
+        self._snapshots = ()
+
+    def _add(self, k):
+        partition = _partition(k)
+        keys = self._partitions.get(partition)
+        if keys is None:
+            keys = self._partitions[partition] = dict()
+        keys[k] = None
+
+    def _remove(self, k):
+        partition = _partition(k)
+        keys = self._partitions[partition]
+        del keys[k]
+        if not keys:
+            del self._partitions[partition]
+
+    def _collection(self, partition):
+        """Returns the key strings in `partition`."""
+        return list(self._partitions.get(partition, ()))
+
+    def _preserve(self, k):
+        """Records the object named by `k` in open snapshots, before it is
+        changed (only the first change after a snapshot is recorded).
+        """
+        value = self._items.get(k, _missing)
+        for ref in self._snapshots:
+            snapshot = ref()
+            if snapshot is not None:
+                snapshot._before.setdefault(k, value)
+
+    def snapshot(self):
+        """Returns a Snapshot: a read-only view of the objects as of now."""
+        snapshot = Snapshot(self)
+        self._snapshots = self._snapshots + (weakref.ref(snapshot, self._forget),)
+        return snapshot
 
-    def _collection(self, key):
-        """Returns the namespace collection for key."""
-        collection = str(key.path)
-        if not collection in self._items:
-            self._items[collection] = dict()
-        return self._items[collection]
+    def _forget(self, ref):
+        self._snapshots = tuple(r for r in self._snapshots if r is not ref)
+
+    def _release(self, snapshot):
+        self._snapshots = tuple(r for r in self._snapshots if r() is not snapshot)
 
     def get(self, key):
-        """Return the object named by `key` or None. Retrieves the object from
-        the collection corresponding to key.path.
+        """Return the object named by `key` or None.
 
         :param key: Key naming the object to retrieve.
         """
-        try:
-            return self._collection(key)[key]
-        except KeyError:
-            return None
+        return self._items.get(str(key))
 
     def put(self, key, value):
-        """Stores the `value` named by `key`. Stores the object in the
-        collection corresponding to key.path.
+        """Stores the `value` named by `key`, indexing new keys under their
+        partition (key.path).
 
         :param key: Key object naming value
         :param value: the object to store.
         """
         if value is None:
             self.delete(key)
-        else:
-            self._collection(key)[key] = value
+            return
+
+        k = str(key)
+        if self._snapshots:
+            self._preserve(k)
+        items = self._items
+        if k not in items:
+            self._add(k)
+        items[k] = value
 
     def delete(self, key):
-        """Removes the object named by `key`. Removes the object from the
-        collection corresponding to key.path.
+        """Removes the object named by `key`.
 
         :param key: Key naming the object to remove.
         """
-        try:
-            del self._collection(key)[key]
-
-            if len(self._collection(key)) == 0:
-                del self._items[str(key.path)]
-        except KeyError:
-            pass
+        k = str(key)
+        if self._snapshots:
+            self._preserve(k)
+        if self._items.pop(k, None) is not None:
+            self._remove(k)
 
     def contains(self, key):
-        """Returns whether the object named by `key` exists. Checks for the object
-        in the collection corresponding to key.path.
+        """Returns whether the object named by `key` exists.
 
         :param key: Key naming the object to check.
         """
-        return key in self._collection(key)
+        return str(key) in self._items
+
+    def get_many(self, keys):
+        """Return the objects named by `keys` (None for missing objects)."""
+        get = self._items.get
+        return [get(str(key)) for key in keys]
+
+    def put_many(self, items):
+        """Stores each `value` named by `key` in items of (key, value) pairs."""
+        stored = self._items
+        for key, value in items:
+            if value is None:
+                self.delete(key)
+                continue
+
+            k = str(key)
+            if self._snapshots:
+                self._preserve(k)
+            if k not in stored:
+                self._add(k)
+            stored[k] = value
+
+    def contains_many(self, keys):
+        """Returns whether each object named by `keys` exists."""
+        items = self._items
+        return [str(key) in items for key in keys]
 
     def query(self, query):
         """Returns an iterable of objects matching criteria expressed in `query`.
 
-        Naively applies the query operations on the objects within the namespaced
-        collection corresponding to query.key.path.
+        Naively applies the query operations on the objects within the
+        partition corresponding to query.key.
 
         :param query: Query object describing the objects to return.
         """
         # entire dataset already in memory, so ok to apply query naively
-        if str(query.key) in self._items:
-            return query(self._items[str(query.key)].values())
-        else:
+        keys = self._partitions.get(str(query.key))
+        if not keys:
             return query([])
+        items = self._items
+        return query([items[k] for k in list(keys)])
+
+    def keys(self):
+        """Returns an iterable of the Keys of all objects."""
+        return [Key(k) for k in list(self._items)]
+
+    def memory_usage(self):
+        """Returns the approximate size in bytes of the datastore's index:
+        its dicts and key strings. Values are not included (they are shared
+        with callers).
+        """
+        size = sys.getsizeof(self._items) + sys.getsizeof(self._partitions)
+        for k in self._items:
+            size += sys.getsizeof(k)
+        for partition, keys in self._partitions.items():
+            size += sys.getsizeof(partition) + sys.getsizeof(keys)
+        return size
 
     def __len__(self):
-        return sum(map(len, self._items.values()))
+        return len(self._items)
+
+
+class Snapshot(Datastore):
+    """Read-only, point-in-time view of a DictDatastore, from
+    DictDatastore.snapshot(). Reads and queries return the objects as they
+    were when the snapshot was taken, while writers keep changing the
+    datastore.
+
+    Nothing is copied up front: the first change of each object after the
+    snapshot records the previous object in the snapshot (multi-version
+    entries for changed keys only), and reads of unchanged objects go to the
+    datastore. close() the snapshot (or use it as a context manager) to stop
+    recording.
+
+    A snapshot may be read from one thread while others write, if writes of
+    each key are serialized (e.g. ConcurrentDictDatastore): writers record
+    before they write, and readers read before checking the records.
+    """
+    def __init__(self, datastore):
+        self.datastore = datastore
+        self._before = {}
+
+    def _get(self, k):
+        value = self.datastore._items.get(k, _missing)
+        before = self._before
+        if k in before:
+            value = before[k]
+        return value
+
+    def get(self, key):
+        """Return the object named by `key` when the snapshot was taken."""
+        value = self._get(str(key))
+        return None if value is _missing else value
+
+    def contains(self, key):
+        """Returns whether the object named by `key` existed."""
+        return self._get(str(key)) is not _missing
+
+    def put(self, key, value):
+        raise TypeError('Snapshot is read-only.')
+
+    def delete(self, key):
+        raise TypeError('Snapshot is read-only.')
+
+    def _keys(self, partition=None):
+        """Returns the key strings (in `partition`) when the snapshot was
+        taken, in datastore order.
+        """
+        if partition is None:
+            strings = list(self.datastore._items)
+        else:
+            strings = self.datastore._collection(partition)
+
+        before = dict(self._before)
+        strings = [k for k in strings if before.get(k) is not _missing]
+        present = set(strings)
+        restored = [k for k, value in before.items()
+                    if value is not _missing and k not in present
+                    and (partition is None or _partition(k) == partition)]
+        if restored:
+            strings.extend(restored)
+            if self.datastore._ordered:
+                strings.sort()
+        return strings
+
+    def query(self, query):
+        """Returns the objects in the collection of query.key (like
+        DictDatastore.query) when the snapshot was taken.
+        """
+        values = (self._get(k) for k in self._keys(str(query.key)))
+        return query([value for value in values if value is not _missing])
+
+    def keys(self):
+        """Returns the Keys of the objects when the snapshot was taken."""
+        return [Key(k) for k in self._keys()]
+
+    def close(self):
+        """Releases the snapshot; it must not be used afterwards."""
+        self.datastore._release(self)
+        self._before = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._keys())
 
 
 class InterfaceMappingDatastore(Datastore):
@@ -281,26 +523,140 @@ class ShimDatastore(Datastore):
         """
         return self.child_datastore.query(query)
 
+    # batch calls pass to the child only while the single key operations
+    # they stand for are the defaults above; a shim overriding get (or put,
+    # delete, contains) gets the looping Datastore implementations, so its
+    # per key work is not bypassed. Shims that can batch override these.
+    def _passes(self, *names):
+        """Returns whether the named operations are not overridden."""
+        return all(getattr(type(self), name) is getattr(ShimDatastore, name)
+                   for name in names)
+
+    def get_many(self, keys):
+        """Return the objects named by keys. Passes call to child, unless
+        get is overridden.
+        """
+        if self._passes('get'):
+            return self.child_datastore.get_many(keys)
+        return Datastore.get_many(self, keys)
+
+    def put_many(self, items):
+        """Stores the (key, value) pairs in items. Passes call to child,
+        unless put or delete is overridden.
+        """
+        if self._passes('put', 'delete'):
+            return self.child_datastore.put_many(items)
+        return Datastore.put_many(self, items)
+
+    def delete_many(self, keys):
+        """Removes the objects named by keys. Passes call to child, unless
+        delete is overridden.
+        """
+        if self._passes('delete'):
+            return self.child_datastore.delete_many(keys)
+        return Datastore.delete_many(self, keys)
+
+    def contains_many(self, keys):
+        """Returns whether each object named by keys exists. Passes call to
+        child, unless get or contains is overridden.
+        """
+        if self._passes('get', 'contains'):
+            return self.child_datastore.contains_many(keys)
+        return Datastore.contains_many(self, keys)
+
+    def keys(self):
+        """Returns the Keys of all objects. Passes call to child."""
+        return self.child_datastore.keys()
+
 
 class CacheShimDatastore(ShimDatastore):
-    """Wraps a datastore with a caching shim optimizes some calls."""
+    """Wraps a datastore with a caching shim optimizes some calls.
+
+    Reads (including contains) are read-through: objects found in
+    child_datastore are put into cache_datastore. With a `negative_size`, keys found missing in
+    child_datastore are remembered (for up to `negative_ttl` seconds), so
+    repeated get and contains calls for absent keys are answered without
+    reaching child_datastore. Writes through this shim update both caches;
+    writes made directly to child_datastore are not seen until the negative
+    entry expires.
+
+    `stats` counts hits, negative_hits, misses and fills; `avoided` is the
+    number of child_datastore reads saved.
+
+    :param cache: the cache datastore.
+    :param negative_size: maximum number of absent keys remembered (0: off).
+    :param negative_ttl: seconds absent keys are remembered (None: until
+                         written through this shim or displaced).
+    """
     def __init__(self, *args, **kwargs):
         self.cache_datastore = kwargs.pop('cache', None)
+        self.negative_size = kwargs.pop('negative_size', 0)
+        self.negative_ttl = kwargs.pop('negative_ttl', None)
 
         if not isinstance(self.cache_datastore, Datastore):
             raise TypeError("datastore must be of type {}. Got {}.".format(Datastore, self.cache_datastore))
 
         super(CacheShimDatastore, self).__init__(*args, **kwargs)
+        self.stats = collections.Counter()
+        self._negative = collections.OrderedDict()
+
+    @property
+    def avoided(self):
+        """Number of child_datastore reads served by the caches instead."""
+        return self.stats['hits'] + self.stats['negative_hits']
+
+    def _is_negative(self, key):
+        """Returns whether `key` is remembered as absent."""
+        if not self._negative:
+            return False
+        k = str(key)
+        expires = self._negative.get(k)
+        if expires is None:
+            return False
+        if self.negative_ttl is not None and expires <= time.monotonic():
+            del self._negative[k]
+            return False
+        return True
+
+    def _remember_negative(self, key):
+        if self.negative_size <= 0:
+            return
+        k = str(key)
+        self._negative.pop(k, None)
+        ttl = self.negative_ttl
+        self._negative[k] = time.monotonic() + ttl if ttl is not None else True
+        while len(self._negative) > self.negative_size:
+            self._negative.popitem(last=False)
+
+    def _forget_negative(self, key):
+        if self._negative:
+            self._negative.pop(str(key), None)
 
     def get(self, key):
         """Return the object named by `key` or None if it does not exist.
-        CacheShimDatastore first checks its cache_datastore.
+        CacheShimDatastore first checks its cache_datastore (and negative
+        cache), then reads child_datastore and fills the cache.
         """
         value = self.cache_datastore.get(key)
-        return value if value is not None else self.child_datastore.get(key)
+        if value is not None:
+            self.stats['hits'] += 1
+            return value
+        if self._is_negative(key):
+            self.stats['negative_hits'] += 1
+            return None
+
+        self.stats['misses'] += 1
+        value = self.child_datastore.get(key)
+        if value is None:
+            self._remember_negative(key)
+        else:
+            self.stats['fills'] += 1
+            self.cache_datastore.put(key, value)
+        return value
 
     def put(self, key, value):
         """Stores the object value named by `key`. Writes to both cache_datastore and child_datastore."""
+        self._forget_negative(key)
         self.cache_datastore.put(key, value)
         self.child_datastore.put(key, value)
 
@@ -308,11 +664,316 @@ class CacheShimDatastore(ShimDatastore):
         """Removes the object named by `key`. Writes to both cache_datastore and child_datastore."""
         self.cache_datastore.delete(key)
         self.child_datastore.delete(key)
+        self._remember_negative(key)
+
+    def contains(self, key):
+        """Returns whether the object named by `key` exists. First checks
+        cache_datastore and the negative cache; on a miss, the object is read
+        from child_datastore and filled into the cache, so later calls are
+        answered by the caches either way.
+        """
+        if self.cache_datastore.contains(key):
+            self.stats['hits'] += 1
+            return True
+        if self._is_negative(key):
+            self.stats['negative_hits'] += 1
+            return False
+
+        self.stats['misses'] += 1
+        value = self.child_datastore.get(key)
+        if value is None:
+            self._remember_negative(key)
+            return False
+        self.stats['fills'] += 1
+        self.cache_datastore.put(key, value)
+        return True
+
+    def get_many(self, keys):
+        """Return the objects named by `keys`. Only missing objects are
+        requested (in one batch) from child_datastore, and those found are
+        put (in one batch) into cache_datastore.
+        """
+        keys = list(keys)
+        values = self.cache_datastore.get_many(keys)
+        missing = []
+        for i, value in enumerate(values):
+            if value is not None:
+                self.stats['hits'] += 1
+            elif self._is_negative(keys[i]):
+                self.stats['negative_hits'] += 1
+            else:
+                missing.append(i)
+
+        if missing:
+            self.stats['misses'] += len(missing)
+            found = self.child_datastore.get_many([keys[i] for i in missing])
+            fill = []
+            for i, value in zip(missing, found):
+                values[i] = value
+                if value is None:
+                    self._remember_negative(keys[i])
+                else:
+                    fill.append((keys[i], value))
+            if fill:
+                self.stats['fills'] += len(fill)
+                self.cache_datastore.put_many(fill)
+        return values
+
+    def put_many(self, items):
+        """Stores the (key, value) pairs in items. Writes to both."""
+        items = list(items)
+        for key, value in items:
+            self._forget_negative(key)
+        self.cache_datastore.put_many(items)
+        self.child_datastore.put_many(items)
+
+    def delete_many(self, keys):
+        """Removes the objects named by `keys`. Writes to both."""
+        keys = list(keys)
+        self.cache_datastore.delete_many(keys)
+        self.child_datastore.delete_many(keys)
+        for key in keys:
+            self._remember_negative(key)
+
+    def contains_many(self, keys):
+        """Returns whether each object named by `keys` exists. First checks
+        the caches, then reads the rest from child_datastore (in one batch),
+        filling cache_datastore with those found.
+        """
+        keys = list(keys)
+        contains = self.cache_datastore.contains_many(keys)
+        missing = []
+        for i, found in enumerate(contains):
+            if found:
+                self.stats['hits'] += 1
+            elif self._is_negative(keys[i]):
+                self.stats['negative_hits'] += 1
+            else:
+                missing.append(i)
+
+        if missing:
+            self.stats['misses'] += len(missing)
+            found = self.child_datastore.get_many([keys[i] for i in missing])
+            fill = []
+            for i, value in zip(missing, found):
+                contains[i] = value is not None
+                if value is None:
+                    self._remember_negative(keys[i])
+                else:
+                    fill.append((keys[i], value))
+            if fill:
+                self.stats['fills'] += len(fill)
+                self.cache_datastore.put_many(fill)
+        return contains
+
+
+class WriteBackDatastore(ShimDatastore):
+    """Write-behind caching shim. Writes are acknowledged once they are in
+    cache_datastore, and queued for child_datastore. Queued (dirty) writes to
+    the same key coalesce, and are flushed to child_datastore in batches
+    (put_many, delete_many) by a background thread, when `flush_size` writes
+    are queued or `flush_interval` seconds have passed.
+
+    Writes queued but not yet flushed are lost if the process dies; at most
+    `max_dirty` writes are queued, beyond which writers flush synchronously.
+    Call close() (or flush()) before exiting. Errors raised by the child while
+    flushing in the background re-queue the batch and are raised by the next
+    flush() or close().
+
+    e.g.::
+
+        >>> ds = WriteBackDatastore(FileSystemDatastore(path), cache=DictDatastore())
+        >>> for i in range(0, 10000):
+        ...     ds.put(Key(str(i)), str(i))   # returns before syncing to disk
+        >>> ds.close()
+
+    :param cache: the upper datastore, also serving reads.
+    :param max_dirty: maximum number of queued writes.
+    :param flush_size: number of queued writes that triggers a flush.
+    :param flush_interval: seconds between background flushes.
+    :param background: whether to flush from a background thread. If False,
+                       writes are flushed when flush_size or max_dirty is
+                       reached, or flush() is called.
+    """
+    _deleted = object()
+
+    def __init__(self, *args, **kwargs):
+        self.cache_datastore = kwargs.pop('cache', None)
+        self.max_dirty = kwargs.pop('max_dirty', 10000)
+        self.flush_size = kwargs.pop('flush_size', 1000)
+        self.flush_interval = kwargs.pop('flush_interval', 1.0)
+        background = kwargs.pop('background', True)
+
+        if not isinstance(self.cache_datastore, Datastore):
+            raise TypeError("datastore must be of type {}. Got {}.".format(Datastore, self.cache_datastore))
+
+        super(WriteBackDatastore, self).__init__(*args, **kwargs)
+        self.stats = collections.Counter()
+        self.error = None
+        self._dirty = collections.OrderedDict()
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _pending(self, key):
+        """Returns the queued value for key, _deleted, or None."""
+        k = str(key)
+        with self._lock:
+            entry = self._dirty.get(k) or self._flushing.get(k)
+        return entry[1] if entry else None
+
+    def get(self, key):
+        """Return the object named by `key` or None if it does not exist.
+        Checks queued writes, then cache_datastore, then child_datastore.
+        """
+        value = self._pending(key)
+        if value is self._deleted:
+            return None
+        if value is not None:
+            return value
+        value = self.cache_datastore.get(key)
+        return value if value is not None else self.child_datastore.get(key)
 
     def contains(self, key):
-        """Returns whether the object named by `key` exists. First checks cache_datastore."""
+        """Returns whether the object named by `key` exists."""
+        value = self._pending(key)
+        if value is not None:
+            return value is not self._deleted
         return self.cache_datastore.contains(key) or self.child_datastore.contains(key)
 
+    def put(self, key, value):
+        """Stores the object `value` named by `key` in cache_datastore, and
+        queues it for child_datastore.
+        """
+        if value is None:
+            return self.delete(key)
+        self._queue([(key, value)], self.cache_datastore.put, key, value)
+
+    def delete(self, key):
+        """Removes the object named by `key` from cache_datastore, and queues
+        its removal from child_datastore.
+        """
+        self._queue([(key, self._deleted)], self.cache_datastore.delete, key)
+
+    def put_many(self, items):
+        """Stores the (key, value) pairs in items; queues them (one batch)."""
+        items = list(items)
+        puts = [(key, value) for key, value in items if value is not None]
+        deletes = [key for key, value in items if value is None]
+
+        def write():
+            self.cache_datastore.put_many(puts)
+            self.cache_datastore.delete_many(deletes)
+        self._queue(puts + [(key, self._deleted) for key in deletes], write)
+
+    def delete_many(self, keys):
+        """Removes the objects named by keys; queues the removals."""
+        keys = list(keys)
+        self._queue([(key, self._deleted) for key in keys],
+                    self.cache_datastore.delete_many, keys)
+
+    get_many = Datastore.get_many
+    contains_many = Datastore.contains_many
+
+    def _queue(self, entries, write, *args):
+        """Calls write(*args) (the cache_datastore write) and queues entries
+        under the lock, so concurrent writes to a key reach cache_datastore in
+        the order they are flushed to child_datastore.
+        """
+        if self._closed:
+            raise RuntimeError('WriteBackDatastore is closed.')
+
+        with self._lock:
+            write(*args)
+            dirty = self._dirty
+            for key, value in entries:
+                k = str(key)
+                if k in dirty:
+                    self.stats['coalesced'] += 1
+                    del dirty[k]
+                dirty[k] = (key, value)
+            self.stats['queued'] += len(entries)
+            size = len(dirty)
+
+        if size >= self.max_dirty:
+            self.stats['stalls'] += 1
+            self.flush()
+        elif size >= self.flush_size:
+            if self._thread is None:
+                self.flush()
+            else:
+                self._wakeup.set()
+
+    def query(self, query):
+        """Returns objects matching criteria expressed in `query`. Flushes
+        queued writes first, so that child_datastore is up to date.
+        """
+        self.flush()
+        return self.child_datastore.query(query)
+
+    def flush(self):
+        """Writes all queued writes to child_datastore."""
+        self._flush()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._flushing, self._dirty = self._dirty, collections.OrderedDict()
+                batch = self._flushing
+
+            puts = [entry for entry in batch.values() if entry[1] is not self._deleted]
+            deletes = [key for key, value in batch.values() if value is self._deleted]
+            try:
+                if puts:
+                    self.child_datastore.put_many(puts)
+                if deletes:
+                    self.child_datastore.delete_many(deletes)
+            except Exception as error:
+                # requeue the batch, behind any newer writes to the same keys.
+                with self._lock:
+                    for k, entry in batch.items():
+                        self._dirty.setdefault(k, entry)
+                    self._flushing = {}
+                self.error = error
+                return
+
+            with self._lock:
+                self._flushing = {}
+            self.stats['flushes'] += 1
+            self.stats['flushed'] += len(batch)
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._flush()
+
+    def pending(self):
+        """Returns the number of writes not yet flushed to child_datastore."""
+        with self._lock:
+            return len(self._dirty.keys() | self._flushing.keys())
+
+    def close(self):
+        """Stops the background thread and flushes queued writes."""
+        self._closed = True
+        if self._thread is not None:
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
 
 class LoggingDatastore(ShimDatastore):
     """Wraps a datastore with a logging shim."""
@@ -348,6 +1009,33 @@ class LoggingDatastore(ShimDatastore):
         self.logger.info("{}: contains {}".format(self, key))
         return super(LoggingDatastore, self).contains(key)
 
+    def get_many(self, keys):
+        """Return the objects named by `keys`. LoggingDatastore logs the access."""
+        keys = list(keys)
+        self.logger.info("{}: get_many {}".format(self, keys))
+        values = super(LoggingDatastore, self).get_many(keys)
+        self.logger.debug("{}: {}".format(self, values))
+        return values
+
+    def put_many(self, items):
+        """Stores the (key, value) pairs in items. LoggingDatastore logs the access."""
+        items = list(items)
+        self.logger.info("{}: put_many {}".format(self, [k for k, v in items]))
+        self.logger.debug("{}: {}".format(self, [v for k, v in items]))
+        super(LoggingDatastore, self).put_many(items)
+
+    def delete_many(self, keys):
+        """Removes the objects named by `keys`. LoggingDatastore logs the access."""
+        keys = list(keys)
+        self.logger.info("{}: delete_many {}".format(self, keys))
+        super(LoggingDatastore, self).delete_many(keys)
+
+    def contains_many(self, keys):
+        """Returns whether each object named by `keys` exists. LoggingDatastore logs the access."""
+        keys = list(keys)
+        self.logger.info("{}: contains_many {}".format(self, keys))
+        return super(LoggingDatastore, self).contains_many(keys)
+
     def query(self, query):
         """Returns an iterable of objects matching criteria expressed in query.
         LoggingDatastore logs the access.
@@ -399,12 +1087,33 @@ class KeyTransformDatastore(ShimDatastore):
         """Returns whether the object named by `key` is in this datastore."""
         return self.child_datastore.contains(self._transform(key))
 
+    def get_many(self, keys):
+        """Return the objects named by keytransform(key) for each key."""
+        return self.child_datastore.get_many(map(self._transform, keys))
+
+    def put_many(self, items):
+        """Stores the objects named by keytransform(key) for each item."""
+        transform = self._transform
+        self.child_datastore.put_many((transform(k), v) for k, v in items)
+
+    def delete_many(self, keys):
+        """Removes the objects named by keytransform(key) for each key."""
+        self.child_datastore.delete_many(map(self._transform, keys))
+
+    def contains_many(self, keys):
+        """Returns whether the objects named by `keys` are in this datastore."""
+        return self.child_datastore.contains_many(map(self._transform, keys))
+
     def query(self, query):
         """Returns a sequence of objects matching criteria expressed in `query`"""
         query = query.copy()
         query.key = self._transform(query.key)
         return self.child_datastore.query(query)
 
+    def keys(self):
+        """Not supported: key transforms cannot be inverted."""
+        raise NotImplementedError
+
     def _transform(self, key):
         """Returns a `key` transformed by `self.keytransform`."""
         return self.keytransform(key) if self.keytransform else key
@@ -666,6 +1375,12 @@ class SymlinkDatastore(ShimDatastore):
         else:
             super(SymlinkDatastore, self).put(key, value)
 
+    # links must be followed key by key.
+    get_many = Datastore.get_many
+    put_many = Datastore.put_many
+    delete_many = Datastore.delete_many
+    contains_many = Datastore.contains_many
+
     def query(self, query):
         """Returns objects matching criteria expressed in `query`. Follows links."""
         results = super(SymlinkDatastore, self).query(query)
@@ -696,12 +1411,20 @@ class DirectoryDatastore(ShimDatastore):
         ...  print item
         'bar'
         'baz'
+
+    Directory updates (read, modify, write) are made under a lock, so
+    concurrent updates from threads sharing this shim are not lost.
     """
+    def __init__(self, datastore):
+        super(DirectoryDatastore, self).__init__(datastore)
+        self._lock = threading.Lock()
+
     def directory(self, dir_key):
         """Initializes directory at `dir_key`."""
-        dir_items = self.get(dir_key)
-        if not isinstance(dir_items, list):
-            self.put(dir_key, [])
+        with self._lock:
+            dir_items = self.get(dir_key)
+            if not isinstance(dir_items, list):
+                self.put(dir_key, [])
 
     def directoryRead(self, dir_key):
         """Returns a generator that iterates over all keys in the directory
@@ -714,10 +1437,11 @@ class DirectoryDatastore(ShimDatastore):
         `dir_key` if it does not exist."""
         key = str(key)
 
-        dir_items = self.get(dir_key) or []
-        if key not in dir_items:
-            dir_items.append(key)
-            self.put(dir_key, dir_items)
+        with self._lock:
+            dir_items = list(self.get(dir_key) or [])
+            if key not in dir_items:
+                dir_items.append(key)
+                self.put(dir_key, dir_items)
 
     def directoryRemove(self, dir_key, key):
         """Removes directory entry `key` from directory at `dir_key`.
@@ -727,10 +1451,11 @@ class DirectoryDatastore(ShimDatastore):
         """
         key = str(key)
 
-        dir_items = self.get(dir_key) or []
-        if key in dir_items:
-            dir_items = [k for k in dir_items if k != key]
-            self.put(dir_key, dir_items)
+        with self._lock:
+            dir_items = self.get(dir_key) or []
+            if key in dir_items:
+                dir_items = [k for k in dir_items if k != key]
+                self.put(dir_key, dir_items)
 
     def directory_entries_generator(self, dir_key):
         dir_items = self.get(dir_key) or []
@@ -771,7 +1496,14 @@ class DirectoryTreeDatastore(ShimDatastore):
         >>> rds.delete(c)
         >>> rds.get(a)
         []
+
+    Directory updates are made under a lock, so concurrent updates from
+    threads sharing this shim are not lost.
     """
+    def __init__(self, datastore):
+        super(DirectoryTreeDatastore, self).__init__(datastore)
+        self._lock = threading.Lock()
+
     def put(self, key, value):
         """Stores the object value named by `key`.
         DirectoryTreeDatastore stores a directory entry.
@@ -786,12 +1518,13 @@ class DirectoryTreeDatastore(ShimDatastore):
 
         # retrieve directory, to add entry
         dir_key = key.parent.instance('directory')
-        directory = self.directory(dir_key)
+        with self._lock:
+            directory = self.directory(dir_key)
 
-        # ensure key is in directory
-        if str_key not in directory:
-            directory.append(str_key)
-            super(DirectoryTreeDatastore, self).put(dir_key, directory)
+            # ensure key is in directory
+            if str_key not in directory:
+                directory.append(str_key)
+                super(DirectoryTreeDatastore, self).put(dir_key, directory)
 
     def delete(self, key):
         """Removes the object named by `key`.
@@ -807,15 +1540,20 @@ class DirectoryTreeDatastore(ShimDatastore):
 
         # retrieve directory, to remove entry
         dir_key = key.parent.instance('directory')
-        directory = self.directory(dir_key)
+        with self._lock:
+            directory = self.directory(dir_key)
 
-        # ensure key is not in directory
-        if directory and str_key in directory:
-            directory.remove(str_key)
-            if len(directory) > 0:
-                super(DirectoryTreeDatastore, self).put(dir_key, directory)
-            else:
-                super(DirectoryTreeDatastore, self).delete(dir_key)
+            # ensure key is not in directory
+            if directory and str_key in directory:
+                directory.remove(str_key)
+                if len(directory) > 0:
+                    super(DirectoryTreeDatastore, self).put(dir_key, directory)
+                else:
+                    super(DirectoryTreeDatastore, self).delete(dir_key)
+
+    # directory entries must be updated key by key.
+    put_many = Datastore.put_many
+    delete_many = Datastore.delete_many
 
     def query(self, query):
         """Returns objects matching criteria expressed in `query`.
@@ -827,7 +1565,8 @@ class DirectoryTreeDatastore(ShimDatastore):
         """Retrieves directory entries for given `key`."""
         if key.name != 'directory':
             key = key.instance('directory')
-        return self.get(key) or []
+        # a copy: the stored list may be shared with other readers.
+        return list(self.get(key) or [])
 
     def directory_values_generator(self, key):
         """Retrieve directory values for given `key`."""
@@ -874,6 +1613,51 @@ class DatastoreCollection(ShimDatastore):
         self._stores.insert(index, store)
 
 
+def always_promote(key, tier):
+    """Promotion policy promoting every value found below the first tier."""
+    return True
+
+
+def never_promote(key, tier):
+    """Promotion policy never promoting values to higher tiers."""
+    return False
+
+
+class HitCountPromotion(object):
+    """Promotion policy promoting a key once it has been found `hits` times
+    below the first tier. Counts are kept for the `size` most recently seen
+    keys, so one-off scans do not reach the higher tiers.
+    """
+    def __init__(self, hits=2, size=10000):
+        self.hits = hits
+        self.size = size
+        self._counts = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, key, tier):
+        k = str(key)
+        with self._lock:
+            count = self._counts.pop(k, 0) + 1
+            if count >= self.hits:
+                return True
+            self._counts[k] = count
+            if len(self._counts) > self.size:
+                self._counts.popitem(last=False)
+        return False
+
+
+class ProbabilisticPromotion(object):
+    """Promotion policy promoting a found value with probability `p`, so
+    frequently read keys are promoted early, and rarely read ones seldom.
+    """
+    def __init__(self, p=0.1, random=random.random):
+        self.p = p
+        self.random = random
+
+    def __call__(self, key, tier):
+        return self.random() < self.p
+
+
 class TieredDatastore(DatastoreCollection):
     """Represents a hierarchical collection of datastores.
 
@@ -889,33 +1673,124 @@ class TieredDatastore(DatastoreCollection):
         * delete   : deletes through to all
         * contains : returns first found value
         * query    : queries bottom (most complete) datastore
+
+    Values found below the first tier are promoted (written to the tiers
+    above) when `promotion(key, tier)` returns True: always_promote (the
+    default), never_promote, HitCountPromotion(k) or ProbabilisticPromotion(p).
+    With an `executor`, promotions are written in the background, and reads
+    return as soon as the serving tier answers.
+
+    Writes to different keys run concurrently; the lock only guards the
+    write counts of 64 key stripes. A promotion is dropped if its key's
+    stripe was being written when the value was read, or has been written
+    since, and is deleted from the upper tiers again if a write started
+    while it was written: a promotion never leaves a stale value behind.
+
+    :param stores: a list of datastores, fastest first.
+    :param promotion: a promotion policy, called with (key, tier).
+    :param executor: an optional concurrent.futures executor for promotions.
     """
+    def __init__(self, stores=[], promotion=always_promote, executor=None):
+        super(TieredDatastore, self).__init__(stores)
+        if not callable(promotion):
+            raise TypeError('promotion (type {}) is not callable'.format(
+                type(promotion)))
+
+        self.promotion = promotion
+        self.executor = executor
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+        self._sequence = [0] * 64  # writes started, per key stripe
+        self._writing = [0] * 64   # writes in progress, per key stripe
+
+    def _stripes(self, keys):
+        return [hash(str(key)) & 63 for key in keys]
+
+    def _versions(self, keys):
+        """Returns the write count of each key's stripe, or None for stripes
+        being written.
+        """
+        stripes = self._stripes(keys)
+        with self._lock:
+            return [None if self._writing[s] else self._sequence[s] for s in stripes]
+
+    def _begin(self, keys):
+        """Marks the stripes of keys as being written; returns them."""
+        stripes = set(self._stripes(keys))
+        with self._lock:
+            for s in stripes:
+                self._sequence[s] += 1
+                self._writing[s] += 1
+        return stripes
+
+    def _end(self, stripes):
+        with self._lock:
+            for s in stripes:
+                self._writing[s] -= 1
+
+    def _promote(self, tier, items, versions):
+        """Writes items to the tiers above `tier`, in the background if there
+        is an executor. `versions` are the _versions() of the keys, taken
+        before the items were read from `tier`.
+        """
+        items = [(item, version) for item, version in zip(items, versions)
+                 if version is not None and self.promotion(item[0], tier)]
+        if not items:
+            return
+        with self._lock:
+            self.stats['promotions'] += len(items)
+
+        if self.executor is None:
+            self._write_promotion(tier, items)
+        else:
+            self.executor.submit(self._write_promotion, tier, items)
+
+    def _write_promotion(self, tier, items):
+        current = self._versions(key for (key, value), version in items)
+        items = [item for (item, version), now in zip(items, current) if version == now]
+        if not items:
+            return
+        for store in self._stores[:tier]:
+            store.put_many(items)
+
+        # a write that started meanwhile may have been overwritten.
+        keys = [key for key, value in items]
+        stale = [key for key, version, now in zip(keys, current, self._versions(keys))
+                 if version != now]
+        if stale:
+            for store in self._stores[:tier]:
+                store.delete_many(stale)
+
     def get(self, key):
         """Return the object named by `key`. Checks each datastore in order."""
-        value = None
-        for store in self._stores:
+        versions = None
+        for tier, store in enumerate(self._stores):
+            if tier == 1:
+                versions = self._versions([key])
             value = store.get(key)
             if value is not None:
-                break
-
-        # add model to lower stores only
-        if value is not None:
-            for store2 in self._stores:
-                if store == store2:
-                    break
-                store2.put(key, value)
-
-        return value
+                if tier > 0:
+                    self._promote(tier, [(key, value)], versions)
+                return value
+        return None
 
     def put(self, key, value):
         """Stores the object `value` in all underlying datastores with `key`."""
-        for store in self._stores:
-            store.put(key, value)
+        stripes = self._begin([key])
+        try:
+            for store in self._stores:
+                store.put(key, value)
+        finally:
+            self._end(stripes)
 
     def delete(self, key):
         """Removes the object at `key` from all underlying datastores."""
-        for store in self._stores:
-            store.delete(key)
+        stripes = self._begin([key])
+        try:
+            for store in self._stores:
+                store.delete(key)
+        finally:
+            self._end(stripes)
 
     def query(self, query):
         """Returns a sequence of objects matching criteria expressed in `query`.
@@ -932,6 +1807,77 @@ class TieredDatastore(DatastoreCollection):
                 return True
         return False
 
+    def get_many(self, keys):
+        """Return the objects named by `keys`. Each datastore is asked (in one
+        batch) only for the objects not found in the datastores before it.
+        Found objects are promoted (in one batch per tier) per the policy.
+        """
+        keys = list(keys)
+        values = [None] * len(keys)
+        missing = list(range(len(keys)))
+        versions = {}
+
+        for tier, store in enumerate(self._stores):
+            if not missing:
+                break
+            if tier == 1:
+                versions = dict(zip(missing, self._versions(keys[i] for i in missing)))
+
+            found = store.get_many([keys[i] for i in missing])
+            still_missing = []
+            promote = []
+            for i, value in zip(missing, found):
+                if value is None:
+                    still_missing.append(i)
+                else:
+                    values[i] = value
+                    promote.append(i)
+            missing = still_missing
+
+            if promote and tier > 0:
+                self._promote(tier, [(keys[i], values[i]) for i in promote],
+                              [versions[i] for i in promote])
+
+        return values
+
+    def put_many(self, items):
+        """Stores the (key, value) pairs in items in all underlying datastores."""
+        items = list(items)
+        stripes = self._begin(key for key, value in items)
+        try:
+            for store in self._stores:
+                store.put_many(items)
+        finally:
+            self._end(stripes)
+
+    def delete_many(self, keys):
+        """Removes the objects at `keys` from all underlying datastores."""
+        keys = list(keys)
+        stripes = self._begin(keys)
+        try:
+            for store in self._stores:
+                store.delete_many(keys)
+        finally:
+            self._end(stripes)
+
+    def contains_many(self, keys):
+        """Returns whether each object at `keys` is in this datastore."""
+        keys = list(keys)
+        contains = [False] * len(keys)
+        missing = list(range(len(keys)))
+        for store in self._stores:
+            if not missing:
+                break
+            found = store.contains_many([keys[i] for i in missing])
+            still_missing = []
+            for i, exists in zip(missing, found):
+                if exists:
+                    contains[i] = True
+                else:
+                    still_missing.append(i)
+            missing = still_missing
+        return contains
+
 
 class ShardedDatastore(DatastoreCollection):
     """Represents a collection of datastore shards.
@@ -939,46 +1885,274 @@ class ShardedDatastore(DatastoreCollection):
     A datastore is selected based on a sharding function.
     Sharding functions should take a Key and return an integer.
 
+    Shards are chosen by a placement strategy (see datastore.core.sharding):
+    by default Modulo, the sharding function's value modulo the number of
+    shards. With ConsistentHashRing, JumpHash or Rendezvous, adding or
+    removing a shard moves only about 1/n of the keys.
+
     WARNING: adding or removing datastores while mid-use may severely affect
             consistency. Also ensure the order is correct upon initialization.
             While this is not as important for caches, it is crucial for
             persistent datastores.
     """
-    def __init__(self, stores=[], shardingfn=hash):
+    def __init__(self, stores=[], shardingfn=hash, placement=None,
+                 names=None, weights=None, cache_size=100000):
         """Initialize the datastore with any provided datastore.
 
         :param stores:     a list of datastores
         :param shardingfn: a callable function
+        :param placement:  a placement strategy (default: Modulo())
+        :param names:      stable shard names for placement (default:
+                           'shard:<n>' in order)
+        :param weights:    relative shard weights (for weighted placements)
+        :param cache_size: number of key routes to cache
         """
-        if not callable(shardingfn):
-            raise TypeError('shardingfn (type {}) is not callable'.format(type(shardingfn)))
-
         super(ShardedDatastore, self).__init__(stores)
+        self._router = ShardRouter(shardingfn, placement, cache_size)
         self._shardingfn = shardingfn
+        self._previous = None
+        self._locks = [threading.Lock() for i in range(0, 64)]
+        names = names or [None] * len(self._stores)
+        weights = weights or [1] * len(self._stores)
+        if not len(names) == len(weights) == len(self._stores):
+            raise ValueError('names and weights must match stores.')
+        for index, (name, weight) in enumerate(zip(names, weights)):
+            self._router.insert(index, name, weight)
+
+    @property
+    def placement(self):
+        """The placement strategy."""
+        return self._router.placement
+
+    @property
+    def names(self):
+        """The shard names, in shard order."""
+        return list(self._router.names)
+
+    def appendDatastore(self, store, name=None, weight=1):
+        """Appends datastore `store` as a new shard."""
+        super(ShardedDatastore, self).appendDatastore(store)
+        self._router.insert(len(self._stores) - 1, name, weight)
+
+    def removeDatastore(self, store):
+        """Removes shard `store`."""
+        index = self._stores.index(store)
+        super(ShardedDatastore, self).removeDatastore(store)
+        self._router.remove(index)
+
+    def insertDatastore(self, index, store, name=None, weight=1):
+        """Inserts datastore `store` as a new shard at `index`."""
+        super(ShardedDatastore, self).insertDatastore(index, store)
+        self._router.insert(index, name, weight)
 
     def shard(self, key):
-        """Returns the shard index to handle `key`, according to sharding fn."""
-        return int(self._shardingfn(key) % len(self._stores))
+        """Returns the shard index to handle `key`, according to sharding fn
+        and placement.
+        """
+        return self._router.shard(key)
 
     def shardDatastore(self, key):
         """Returns the shard to handle `key`."""
         return self.datastore(self.shard(key))
 
+    # online resharding
+    def reshard(self, stores=None, placement=None, names=None, weights=None,
+                **kwargs):
+        """Switches to a new shard configuration, and returns a Rebalancer
+        that moves the objects whose shard changed (see Rebalancer.run).
+
+        Until the rebalancer finishes, objects not found on their new shard
+        are read from their previous one, and writes go to the new shard
+        (removing the object from the previous one).
+
+        :param stores:    the new shards (default: the current ones)
+        :param placement: the new placement (default: a copy of the current)
+        :param names:     the new shard names. By default, shards keep their
+                          current names, and new shards get new ones.
+        :param weights:   the new shard weights (default: 1, or unchanged)
+        :param kwargs:    Rebalancer arguments.
+        """
+        if self._previous is not None:
+            raise RuntimeError('a resharding is already in progress.')
+
+        old_stores, old_router = list(self._stores), self._router
+        stores = old_stores if stores is None else list(stores)
+        for store in stores:
+            if not isinstance(store, Datastore):
+                raise TypeError("All stores must be of type {}".format(Datastore))
+
+        if names is None:
+            names = [old_router.names[old_stores.index(store)]
+                     if store in old_stores else None for store in stores]
+        if weights is None:
+            weights = [old_router.weights[old_stores.index(store)]
+                       if store in old_stores else 1 for store in stores]
+        if not len(names) == len(weights) == len(stores):
+            raise ValueError('names and weights must match stores.')
+
+        if placement is None:
+            placement = copy.copy(old_router.placement)
+        router = ShardRouter(old_router.shardingfn, placement,
+                             old_router.cache_size)
+        router.reserve(old_router)
+        for index, (name, weight) in enumerate(zip(names, weights)):
+            router.insert(index, name, weight)
+
+        self._previous = (old_stores, old_router)
+        self._stores, self._router = stores, router
+        return Rebalancer(self, **kwargs)
+
+    @property
+    def resharding(self):
+        """Whether objects are being moved to a new shard configuration."""
+        return self._previous is not None
+
+    def previousDatastore(self, key):
+        """Returns the shard that handled `key` before reshard() if it differs
+        from the current one, otherwise None.
+        """
+        return self._previous_store(key, self._previous)
+
+    def _previous_store(self, key, previous):
+        if previous is None:
+            return None
+        store = previous[0][previous[1].shard(key)]
+        return None if store is self.shardDatastore(key) else store
+
+    def _lock(self, key):
+        return self._locks[hash(str(key)) % len(self._locks)]
+
+    def _finish_resharding(self):
+        self._previous = None
+
     def get(self, key):
         """Return the object named by `key` from the corresponding datastore."""
-        return self.shardDatastore(key).get(key)
+        previous = self.previousDatastore(key)
+        value = self.shardDatastore(key).get(key)
+        if value is None and previous is not None:
+            value = previous.get(key)
+            if value is None:
+                # moved (put to the new shard, then deleted) between the reads?
+                value = self.shardDatastore(key).get(key)
+        return value
 
     def put(self, key, value):
         """Stores the object `value` to the corresponding datastore with `key`."""
-        self.shardDatastore(key).put(key, value)
+        if self._previous is None:
+            return self.shardDatastore(key).put(key, value)
+
+        with self._lock(key):
+            self.shardDatastore(key).put(key, value)
+            previous = self.previousDatastore(key)
+            if previous is not None:
+                previous.delete(key)
 
     def delete(self, key):
         """Removes the object responding to `key` from the corresponding datastore."""
-        self.shardDatastore(key).delete(key)
+        if self._previous is None:
+            return self.shardDatastore(key).delete(key)
+
+        with self._lock(key):
+            self.shardDatastore(key).delete(key)
+            previous = self.previousDatastore(key)
+            if previous is not None:
+                previous.delete(key)
 
     def contains(self, key):
         """Returns whether the object responding to `key` is in this datastore."""
-        return self.shardDatastore(key).contains(key)
+        previous = self.previousDatastore(key)
+        if self.shardDatastore(key).contains(key):
+            return True
+        if previous is None:
+            return False
+        # re-checking the new shard catches objects moved between the reads.
+        return previous.contains(key) or self.shardDatastore(key).contains(key)
+
+    def _group_by_shard(self, keys):
+        """Returns {shard index: [positions in keys]} for `keys`."""
+        groups = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(self.shard(key), []).append(i)
+        return groups
+
+    def _group_by_previous(self, keys, positions, previous):
+        """Returns {previous shard: [positions]} for keys whose shard changed."""
+        groups = {}
+        for i in positions:
+            store = self._previous_store(keys[i], previous)
+            if store is not None:
+                groups.setdefault(id(store), (store, []))[1].append(i)
+        return groups.values()
+
+    def get_many(self, keys):
+        """Return the objects named by `keys`, with one batch per shard."""
+        keys = list(keys)
+        previous = self._previous
+        values = [None] * len(keys)
+        self._read_many('get_many', keys, range(0, len(keys)), values)
+
+        if previous is not None:
+            missing = [i for i, value in enumerate(values) if value is None]
+            moved = []
+            for store, positions in self._group_by_previous(keys, missing, previous):
+                found = store.get_many([keys[i] for i in positions])
+                for i, value in zip(positions, found):
+                    values[i] = value
+                moved.extend(i for i in positions if values[i] is None)
+            # objects moved between the reads are on their new shard by now.
+            self._read_many('get_many', keys, moved, values)
+        return values
+
+    def _read_many(self, method, keys, positions, results):
+        """Sets results[i] to the new shards' `method` answer for keys[i], for
+        each i in positions (one batch per shard).
+        """
+        positions = list(positions)
+        groups = self._group_by_shard([keys[i] for i in positions])
+        for shard, group in groups.items():
+            group = [positions[j] for j in group]
+            found = getattr(self.datastore(shard), method)([keys[i] for i in group])
+            for i, result in zip(group, found):
+                results[i] = result
+
+    def put_many(self, items):
+        """Stores the (key, value) pairs in items, with one batch per shard."""
+        items = list(items)
+        if self._previous is not None:
+            return Datastore.put_many(self, items)
+
+        groups = self._group_by_shard([key for key, value in items])
+        for shard, positions in groups.items():
+            self.datastore(shard).put_many([items[i] for i in positions])
+
+    def delete_many(self, keys):
+        """Removes the objects named by `keys`, with one batch per shard."""
+        keys = list(keys)
+        if self._previous is not None:
+            return Datastore.delete_many(self, keys)
+
+        for shard, positions in self._group_by_shard(keys).items():
+            self.datastore(shard).delete_many([keys[i] for i in positions])
+
+    def contains_many(self, keys):
+        """Returns whether each object named by `keys` is in this datastore,
+        with one batch per shard.
+        """
+        keys = list(keys)
+        previous = self._previous
+        contains = [False] * len(keys)
+        self._read_many('contains_many', keys, range(0, len(keys)), contains)
+
+        if previous is not None:
+            missing = [i for i, exists in enumerate(contains) if not exists]
+            moved = []
+            for store, positions in self._group_by_previous(keys, missing, previous):
+                found = store.contains_many([keys[i] for i in positions])
+                for i, exists in zip(positions, found):
+                    contains[i] = exists
+                moved.extend(i for i in positions if not contains[i])
+            self._read_many('contains_many', keys, moved, contains)
+        return contains
 
     def query(self, query):
         """Returns a sequence of objects matching criteria expressed in `query`"""
@@ -989,7 +2163,12 @@ class ShardedDatastore(DatastoreCollection):
     def shard_query_generator(self, query):
         """A generator that queries each shard in sequence with `query`."""
         shard_query = query.copy()
-        for shard in self._stores:
+        stores = list(self._stores)
+        if self._previous is not None:
+            # objects not yet moved are still in previous shards
+            stores += [s for s in self._previous[0]
+                       if not any(s is store for store in stores)]
+        for shard in stores:
             # yield all items matching within this shard
             cursor = shard.query(shard_query)
             for item in cursor:
@@ -1002,3 +2181,299 @@ class ShardedDatastore(DatastoreCollection):
 
                 if shard_query.limit <= 0:
                     break  # we're already done!
+
+
+class ReplicatedDatastore(DatastoreCollection):
+    """Represents a collection of replicas, each holding all objects.
+
+    Writes go to all replicas concurrently, and return once `write_quorum`
+    of them succeeded (the others complete in the background). Each replica
+    applies writes in the order they were made: a replica's writes are
+    queued, and run one at a time. Reads go to
+    the replica with the lowest observed latency (an exponentially weighted
+    moving average). If it has not answered after its `hedge_percentile`
+    latency, the same read is sent to the next fastest replica (a hedged
+    request), and the first answer wins.
+
+    A replica answering None may have missed a write that reached a quorum,
+    so a miss is only returned once enough replicas agree (n - write_quorum
+    + 1). With `read_repair`, replicas found missing an object are sent the
+    found value in the background, through their write queues. A repair is
+    skipped if the key had writes in flight when the read started, or was
+    written since (among the last `repair_window` written keys).
+
+    Semantics:
+        * get      : returns the fastest found value
+        * put      : writes to all, waits for write_quorum
+        * delete   : deletes from all, waits for write_quorum
+        * contains : like get
+        * query    : queries the fastest replica
+
+    :param stores: the replicas.
+    :param write_quorum: replicas that must acknowledge writes (default: a
+                         majority).
+    :param hedge: whether to send hedged reads.
+    :param hedge_percentile: the latency percentile after which to hedge.
+    :param read_repair: whether to repair replicas missing read objects.
+    :param executor: a concurrent.futures executor for replica calls.
+    :param window: latency samples kept per replica for the percentile.
+    """
+    repair_window = 10000
+
+    def __init__(self, stores=[], write_quorum=None, hedge=True,
+                 hedge_percentile=95, read_repair=False, executor=None,
+                 window=100):
+        super(ReplicatedDatastore, self).__init__(stores)
+        if write_quorum is not None and not 0 < write_quorum <= len(self._stores):
+            raise ValueError('write_quorum must be in 1..{}. Got {}.'.format(
+                len(self._stores), write_quorum))
+
+        self._write_quorum = write_quorum
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.read_repair = read_repair
+        self._owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(4 * max(len(self._stores), 1))
+        self.window = window
+        self.stats = collections.Counter()
+        self._latency = {}
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._queues = collections.defaultdict(collections.deque)
+        self._draining = set()
+        self._sequence = 0                   # writes made
+        self._inflight = collections.Counter()  # replica writes pending, per key
+        self._recent = collections.OrderedDict()  # key: sequence of last write
+        self._floor = 0                      # writes older than _recent holds
+
+    def _count(self, stat, n=1):
+        with self._lock:
+            self.stats[stat] += n
+
+    @property
+    def write_quorum(self):
+        """Number of replicas that must acknowledge a write."""
+        if self._write_quorum is not None:
+            return self._write_quorum
+        return len(self._stores) // 2 + 1
+
+    # latency tracking
+    def _timed(self, store, method, *args):
+        start = time.monotonic()
+        try:
+            return getattr(store, method)(*args)
+        finally:
+            self._observe(store, time.monotonic() - start)
+
+    def _observe(self, store, elapsed):
+        with self._lock:
+            average = self._latency.get(id(store))
+            self._latency[id(store)] = elapsed if average is None \
+                else 0.8 * average + 0.2 * elapsed
+            samples = self._samples.get(id(store))
+            if samples is None:
+                samples = self._samples[id(store)] = collections.deque(maxlen=self.window)
+            samples.append(elapsed)
+
+    def latency(self, store):
+        """Returns the average observed latency of `store` (0 if unknown)."""
+        return self._latency.get(id(store), 0.0)
+
+    def _hedge_delay(self, store):
+        """Returns the `hedge_percentile` latency of store (of all replicas
+        while store has few samples), or None.
+        """
+        if not self.hedge:
+            return None
+        with self._lock:
+            samples = list(self._samples.get(id(store), ()))
+            if len(samples) < 10:
+                samples = [s for window in self._samples.values() for s in window]
+        if len(samples) < 10:
+            return None
+        ordered = sorted(samples)
+        index = min(int(len(ordered) * self.hedge_percentile / 100.0), len(ordered) - 1)
+        return ordered[index]
+
+    def replicas(self):
+        """Returns the replicas, fastest first."""
+        return sorted(self._stores, key=self.latency)
+
+    # reads
+    def _read(self, method, key):
+        """Returns (value, replica) from the fastest replica with a value,
+        hedging slow calls, or (None, None) once enough replicas miss.
+        """
+        order = self.replicas()
+        misses_needed = len(order) - self.write_quorum + 1
+        missing = False if method == 'contains' else None  # a stored False is a value
+        pending = {}
+        misses, errors = [], []
+
+        def launch():
+            store = order[len(pending) + len(misses) + len(errors)]
+            pending[self.executor.submit(self._timed, store, method, key)] = store
+            return store
+
+        current = launch()
+        while pending:
+            launched = len(pending) + len(misses) + len(errors)
+            timeout = self._hedge_delay(current) if launched < len(order) else None
+            done, _ = futures.wait(list(pending), timeout, futures.FIRST_COMPLETED)
+            if not done:
+                self._count('hedged')
+                current = launch()
+                continue
+
+            for future in done:
+                store = pending.pop(future)
+                try:
+                    value = future.result()
+                except Exception as error:
+                    errors.append(error)
+                    value = None
+                else:
+                    if value is not None and value is not missing:
+                        return value, store
+                    misses.append(store)
+                    if len(misses) >= misses_needed:
+                        return value, None
+
+                launched = len(pending) + len(misses) + len(errors)
+                if not pending and launched < len(order):
+                    current = launch()
+
+        if errors:
+            raise RuntimeError('all replicas failed to read {}: {!r}'.format(key, errors[0]))
+        return None, None
+
+    def get(self, key):
+        """Return the object named by `key` from the fastest replica."""
+        with self._lock:
+            sequence = self._sequence
+            busy = self._inflight[str(key)] > 0
+        value, store = self._read('get', key)
+        if value is not None and self.read_repair and not busy:
+            # replicas not asked may be missing the object as well
+            others = [s for s in self._stores if s is not store]
+            self._repair(key, value, others, sequence)
+        return value
+
+    def _repair(self, key, value, stores, sequence):
+        """Queues writes of `value` to the stores missing it, unless key was
+        written after `sequence` (its value may be stale).
+        """
+        with self._lock:
+            if sequence < self._floor or self._recent.get(str(key), 0) > sequence:
+                return
+            for store in stores:
+                self._enqueue(store, (), self._repair_missing, store, key, value)
+
+    def _repair_missing(self, store, key, value):
+        if not store.contains(key):
+            store.put(key, value)
+            self._count('repairs')
+
+    def contains(self, key):
+        """Returns whether the object named by `key` is in the replicas."""
+        return bool(self._read('contains', key)[0])
+
+    def query(self, query):
+        """Returns objects matching `query` from the fastest replica."""
+        error = None
+        for store in self.replicas():
+            try:
+                return self._timed(store, 'query', query)
+            except Exception as e:
+                error = e
+        raise RuntimeError('all replicas failed to query: {!r}'.format(error))
+
+    get_many = Datastore.get_many
+    contains_many = Datastore.contains_many
+
+    # writes
+    def _enqueue(self, store, keys, fn, *args):
+        """Queues fn(*args) behind the earlier writes to store, and returns
+        its Future (called with the lock held).
+        """
+        future = futures.Future()
+        self._queues[id(store)].append((future, keys, fn, args))
+        if id(store) not in self._draining:
+            self._draining.add(id(store))
+            self.executor.submit(self._drain, store)
+        return future
+
+    def _drain(self, store):
+        """Runs the queued writes of store, in order."""
+        queue = self._queues[id(store)]
+        while True:
+            with self._lock:
+                if not queue:
+                    self._draining.discard(id(store))
+                    return
+                future, keys, fn, args = queue.popleft()
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(fn(*args))
+            except Exception as error:
+                future.set_exception(error)
+            finally:
+                with self._lock:
+                    for k in keys:
+                        self._inflight[k] -= 1
+                        if self._inflight[k] <= 0:
+                            del self._inflight[k]
+
+    def _write(self, method, keys, *args):
+        """Queues method on all replicas (in the same order on each, for
+        concurrent writers), returning once write_quorum succeeded.
+        """
+        quorum = self.write_quorum
+        keys = [str(key) for key in keys]
+        with self._lock:
+            self._sequence += 1
+            for k in keys:
+                self._inflight[k] += len(self._stores)
+                self._recent[k] = self._sequence
+                self._recent.move_to_end(k)
+            while len(self._recent) > self.repair_window:
+                self._floor = self._recent.popitem(last=False)[1]
+            pending = [self._enqueue(store, keys, self._timed, store, method, *args)
+                       for store in self._stores]
+        succeeded, errors = 0, []
+        for future in futures.as_completed(pending):
+            try:
+                future.result()
+            except Exception as error:
+                errors.append(error)
+                if len(self._stores) - len(errors) < quorum:
+                    self._count('failed_writes')
+                    raise RuntimeError('write quorum ({}) not reached: {!r}'.format(
+                        quorum, errors[0]))
+            else:
+                succeeded += 1
+                if succeeded >= quorum:
+                    return
+
+    def put(self, key, value):
+        """Stores `value` on all replicas; waits for write_quorum of them."""
+        self._write('put', [key], key, value)
+
+    def delete(self, key):
+        """Removes the object from all replicas; waits for write_quorum."""
+        self._write('delete', [key], key)
+
+    def put_many(self, items):
+        """Stores items on all replicas (one batch each); waits for quorum."""
+        items = list(items)
+        self._write('put_many', [key for key, value in items], items)
+
+    def delete_many(self, keys):
+        """Removes the objects from all replicas; waits for quorum."""
+        keys = list(keys)
+        self._write('delete_many', keys, keys)
+
+    def close(self):
+        """Waits for background writes, and shuts down the executor."""
+        if self._owns_executor:
+            self.executor.shutdown(wait=True)
@@ -1 +1,3 @@
 from .filesystem import FileSystemDatastore
+from .logstructured import LogStructuredDatastore
+from .lsm import LSMDatastore
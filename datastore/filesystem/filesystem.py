@@ -1,5 +1,6 @@
 import os
 from datastore.core.stores import Datastore
+from datastore.core.key import Key
 
 
 def ensure_directory_exists(directory):
@@ -76,11 +77,13 @@ class FileSystemDatastore(Datastore):
     object_extension = '.obj'
     ignore_list = list()
 
-    def __init__(self, root, case_sensitive=True):
+    def __init__(self, root, case_sensitive=True, binary=False):
         """Initialize the datastore with given root directory.
 
         :param root:            A path at which to mount this filesystem datastore.
         :param case_sensitive   bool, case sensitivity
+        :param binary           bool, read objects back as bytes (for binary
+                                serializers, e.g. compression)
         """
         root = os.path.normpath(root)
 
@@ -92,6 +95,7 @@ class FileSystemDatastore(Datastore):
 
         self.root_path = root
         self.case_sensitive = bool(case_sensitive)
+        self.binary = bool(binary)
 
     def relative_path(self, key):
         """Returns the relative path for given key"""
@@ -114,14 +118,25 @@ class FileSystemDatastore(Datastore):
         """return the object path for key."""
         return os.path.join(self.root_path, self.relative_object_path(key))
 
-    def _write_object(self, path, value):
+    def _write_object(self, path, value, sync=True):
         """write out object to file at path"""
         ensure_directory_exists(os.path.dirname(path))
 
-        with open(path, 'w') as f:
+        mode = 'wb' if isinstance(value, (bytes, bytearray)) else 'w'
+        with open(path, mode) as f:
             f.write(value)
             f.flush()
-            os.fdatasync(f.fileno())
+            if sync:
+                os.fdatasync(f.fileno())
+
+    def _sync_objects(self, paths):
+        """flush the data of the files at paths to disk"""
+        for path in paths:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fdatasync(fd)
+            finally:
+                os.close(fd)
 
     def _read_object(self, path):
         """read in object from file at path"""
@@ -131,11 +146,20 @@ class FileSystemDatastore(Datastore):
         if os.path.isdir(path):
             raise RuntimeError('{} is a directory, not a file.'.format(path))
 
-        with open(path) as f:
+        with open(path, 'rb' if self.binary else 'r') as f:
             file_contents = f.read()
 
         return file_contents
 
+    def _write_object_stream(self, path, write):
+        """write out object to file at path, calling write(fileobj)"""
+        ensure_directory_exists(os.path.dirname(path))
+
+        with open(path, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fdatasync(f.fileno())
+
     def _read_object_gen(self, iterable):
         """Generator that reads objects in from filenames in iterable."""
         for filename in iterable:
@@ -159,6 +183,53 @@ class FileSystemDatastore(Datastore):
         path = self.object_path(key)
         self._write_object(path, value)
 
+    def put_many(self, items):
+        """Stores each object value named by key in items of (key, value) pairs.
+        All objects are written before any is synced to disk, letting the OS
+        schedule the writes together, and each directory is checked once.
+
+        :param items: iterable of (key, value) pairs.
+        """
+        directories = set()
+        paths = []
+        for key, value in items:
+            path = self.object_path(key)
+            directory = os.path.dirname(path)
+            if directory not in directories:
+                ensure_directory_exists(directory)
+                directories.add(directory)
+
+            mode = 'wb' if isinstance(value, (bytes, bytearray)) else 'w'
+            with open(path, mode) as f:
+                f.write(value)
+            paths.append(path)
+
+        self._sync_objects(paths)
+
+    def get_stream(self, key):
+        """Return a binary file object reading the object named by key, or None
+        if it does not exist. The caller must close it.
+
+        :param key: Key naming the object to retrieve
+        """
+        path = self.object_path(key)
+        try:
+            return open(path, 'rb')
+        except (IOError, OSError):
+            if os.path.isdir(path):
+                raise RuntimeError('{} is a directory, not a file.'.format(path))
+            return None
+
+    def put_stream(self, key, write):
+        """Stores the object named by key, written by calling write(fileobj)
+        with a binary file object. Lets large values be written in pieces.
+
+        :param key: Key object naming value
+        :param write: a callable writing the object into the given file object.
+        """
+        path = self.object_path(key)
+        self._write_object_stream(path, write)
+
     def delete(self, key):
         """Removes the object named by `key`.
 
@@ -189,6 +260,20 @@ class FileSystemDatastore(Datastore):
 
         return query(iterable)
 
+    def keys(self):
+        """Returns a generator of the Keys of all objects. Keys are rebuilt
+        from object paths, so namespace fields come back as path components
+        (Key('/a:b') is returned as Key('/a/b'), which names the same file).
+        """
+        extension = self.object_extension
+        for dirpath, dirnames, filenames in os.walk(self.root_path):
+            relative = os.path.relpath(dirpath, self.root_path)
+            for filename in filenames:
+                if not filename.endswith(extension) or filename in self.ignore_list:
+                    continue
+                path = os.path.normpath(os.path.join(relative, filename[:-len(extension)]))
+                yield Key('/' + path.replace(os.sep, '/'))
+
     def contains(self, key):
         """Returns whether the object named by key exists.
 
@@ -0,0 +1,434 @@
+"""Log-structured (Bitcask-style) datastore: objects are appended to segment
+files, and found through an in-memory index.
+"""
+import collections
+import os
+import struct
+import threading
+import zlib
+
+from datastore.core.key import Key
+from datastore.core.persistent import _fsync, _fsync_directory
+from datastore.core.stores import Datastore, _partition
+
+from .filesystem import ensure_directory_exists
+
+_record = struct.Struct('<III')   # crc32, key length, value length
+_hint = struct.Struct('<IQI')     # key length, record offset, record length
+_tombstone = 0xFFFFFFFF
+
+
+def _encode(k, value):
+    """Returns the record for key string `k` and `value` (None: deleted)."""
+    kbytes = k.encode('utf-8')
+    if value is None:
+        body = _record.pack(0, len(kbytes), _tombstone)[4:] + kbytes
+    else:
+        body = _record.pack(0, len(kbytes), len(value))[4:] + kbytes + value
+    return struct.pack('<I', zlib.crc32(body)) + body
+
+
+class LogStructuredDatastore(Datastore):
+    """Datastore appending objects to segment files, Bitcask style.
+
+    Every put and delete is appended to the active segment (`<n>.data`), and
+    an in-memory index maps each key to the (segment, offset, length) of its
+    latest record, so a get is a single pread. Writes are sequential, with
+    no per-object files or directories, which for small objects is orders
+    of magnitude faster than FileSystemDatastore.
+
+    When the active segment reaches `max_segment_size` (and on close), it
+    becomes immutable and a hint file (`<n>.hint`: keys and record
+    locations, no values) is written next to it, so opening the datastore
+    rebuilds the index from hint files without reading values. Each open
+    starts a new active segment, so a torn record at the end of a segment
+    (a crash mid-write) only ends the scan of that segment.
+
+    Overwritten and deleted objects leave stale records behind. Compaction
+    copies the live records of immutable segments whose live fraction is
+    below `compact_ratio` to the active segment, and removes them; it runs
+    in the background every `compact_interval` seconds, or with compact().
+
+    Like FileSystemDatastore, objects are strings (stored as utf-8) or bytes,
+    and are returned as bytes if `binary`, else as strings. Use a serializer
+    shim for other values. When the log is synced to disk depends on `sync`
+    ('always', 'os', or an interval in seconds; see PersistentDatastore).
+
+    :param root: directory of the segment files.
+    :param binary: bool, read objects back as bytes.
+    :param sync: 'always', 'os', or an interval in seconds.
+    :param max_segment_size: bytes after which a new segment is started.
+    :param compact_ratio: live fraction below which a segment is compacted.
+    :param compact_interval: seconds between background compactions (None:
+                             only compact()).
+    :param background: whether to run the background sync/compaction thread.
+    """
+    def __init__(self, root, binary=False, sync=1.0, max_segment_size=64 << 20,
+                 compact_ratio=0.5, compact_interval=60.0, background=True):
+        if sync not in ('always', 'os') and \
+                not (isinstance(sync, (int, float)) and sync > 0):
+            raise ValueError("sync must be 'always', 'os' or seconds. Got {!r}.".format(sync))
+
+        root = os.path.normpath(root)
+        ensure_directory_exists(root)
+
+        self.root_path = root
+        self.binary = bool(binary)
+        self.sync_policy = sync
+        self.max_segment_size = max_segment_size
+        self.compact_ratio = compact_ratio
+        self.compact_interval = compact_interval
+        self.stats = collections.Counter()
+
+        self._index = {}
+        self._live = collections.Counter()   # live record bytes per segment
+        self._total = collections.Counter()  # record bytes per segment
+        self._readers = {}
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._dirty = False
+        self._closed = False
+
+        segments = self._segments()
+        for segment in segments:
+            self._load(segment)
+        # segments may have no hint after a crash: the last one was active,
+        # others were rolled over (or written by compaction) just before.
+        for segment in segments:
+            if not os.path.exists(self._path(segment, 'hint')):
+                self._write_hint(segment)
+        self._open_active((segments[-1] + 1) if segments else 0)
+
+        self._wakeup = threading.Event()
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    # files
+    def _path(self, segment, extension):
+        return os.path.join(self.root_path, '{:010d}.{}'.format(segment, extension))
+
+    def _segments(self):
+        segments = []
+        for name in os.listdir(self.root_path):
+            number, _, extension = name.partition('.')
+            if extension == 'data' and number.isdigit():
+                segments.append(int(number))
+        return sorted(segments)
+
+    def _open_active(self, segment):
+        self._active = segment
+        self._fd = os.open(self._path(segment, 'data'),
+                           os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._offset = os.fstat(self._fd).st_size
+        self._total[segment] += 0
+        _fsync_directory(self.root_path)
+
+    def _reader(self, segment):
+        fd = self._readers.get(segment)
+        if fd is None:
+            fd = os.open(self._path(segment, 'data'), os.O_RDONLY)
+            shared = self._readers.setdefault(segment, fd)
+            if shared != fd:  # another thread opened it first
+                os.close(fd)
+                fd = shared
+        return fd
+
+    # index
+    def _apply(self, k, segment, offset, length, deleted):
+        """Points the index for `k` to a record, keeping live byte counts."""
+        self._total[segment] += length
+        old = self._index.pop(k, None)
+        if old is not None:
+            self._live[old[0]] -= old[2]
+        if not deleted:
+            self._index[k] = (segment, offset, length)
+            self._live[segment] += length
+
+    def _load(self, segment):
+        """Adds the records of `segment` to the index, from its hint file if
+        it has one, else by scanning the segment.
+        """
+        hint = self._path(segment, 'hint')
+        if os.path.exists(hint):
+            with open(hint, 'rb') as f:
+                data = f.read()
+            offset = 0
+            while offset < len(data):
+                klen, position, length = _hint.unpack_from(data, offset)
+                offset += _hint.size
+                k = data[offset:offset + klen].decode('utf-8')
+                offset += klen
+                self._apply(k, segment, position, length & 0x7FFFFFFF,
+                            bool(length & 0x80000000))
+            self.stats['hinted'] += 1
+            return
+
+        for k, position, length, deleted in self._scan(segment):
+            self._apply(k, segment, position, length, deleted)
+        self.stats['scanned'] += 1
+
+    def _scan(self, segment):
+        """Yields (key, offset, length, deleted) for the records of segment,
+        stopping at the first truncated or corrupt record.
+        """
+        with open(self._path(segment, 'data'), 'rb') as f:
+            offset = 0
+            while True:
+                header = f.read(_record.size)
+                if len(header) < _record.size:
+                    return
+                crc, klen, vlen = _record.unpack(header)
+                body = f.read(klen + (0 if vlen == _tombstone else vlen))
+                if len(body) < klen + (0 if vlen == _tombstone else vlen) or \
+                        zlib.crc32(header[4:] + body) != crc:
+                    return
+                length = _record.size + len(body)
+                yield body[:klen].decode('utf-8'), offset, length, vlen == _tombstone
+                offset += length
+
+    def _write_hint(self, segment):
+        """Writes the hint file of immutable `segment`."""
+        chunks = []
+        for k, position, length, deleted in self._scan(segment):
+            kbytes = k.encode('utf-8')
+            flags = 0x80000000 if deleted else 0
+            chunks.append(_hint.pack(len(kbytes), position, length | flags) + kbytes)
+
+        path = self._path(segment, 'hint')
+        with open(path + '.tmp', 'wb') as f:
+            f.write(b''.join(chunks))
+            f.flush()
+            _fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    # writes
+    def _append(self, entries):
+        """Appends records for (key string, value bytes or None) entries."""
+        with self._lock:
+            previous = self._append_locked(entries)
+
+        # the previous segment is immutable; scan it without blocking writes.
+        if previous is not None:
+            self._write_hint(previous)
+
+    def _append_locked(self, entries):
+        """Appends records for entries (called with the lock held). Returns
+        the segment made immutable by a rollover, if any.
+        """
+        if self._closed:
+            raise RuntimeError('LogStructuredDatastore is closed.')
+        records = [_encode(k, value) for k, value in entries]
+        os.write(self._fd, b''.join(records))
+        if self.sync_policy == 'always':
+            _fsync(self._fd)
+        else:
+            self._dirty = True
+
+        offset = self._offset
+        for (k, value), record in zip(entries, records):
+            self._apply(k, self._active, offset, len(record), value is None)
+            offset += len(record)
+        self._offset = offset
+        if offset >= self.max_segment_size:
+            return self._rollover()
+        return None
+
+    def _rollover(self):
+        """Starts a new active segment and returns the previous one (called
+        with the lock held).
+        """
+        _fsync(self._fd)
+        os.close(self._fd)
+        self._dirty = False
+        previous = self._active
+        self._open_active(previous + 1)
+        return previous
+
+    def _value(self, value):
+        if isinstance(value, str):
+            return value.encode('utf-8')
+        return bytes(value)
+
+    def put(self, key, value):
+        """Stores the object `value` (a string or bytes) named by `key`."""
+        if value is None:
+            return self.delete(key)
+        self._append([(str(key), self._value(value))])
+
+    def delete(self, key):
+        """Removes the object named by `key`."""
+        k = str(key)
+        if k in self._index:
+            self._append([(k, None)])
+
+    def put_many(self, items):
+        """Stores (key, value) pairs with a single append (and sync)."""
+        entries = [(str(key), None if value is None else self._value(value))
+                   for key, value in items]
+        if entries:
+            self._append(entries)
+
+    def delete_many(self, keys):
+        """Removes the objects named by `keys` with a single append."""
+        entries = [(str(key), None) for key in keys if str(key) in self._index]
+        if entries:
+            self._append(entries)
+
+    def sync(self):
+        """Forces appended records to disk."""
+        with self._lock:
+            if self._dirty and not self._closed:
+                _fsync(self._fd)
+                self._dirty = False
+
+    # reads
+    def _read(self, k, location):
+        """Returns the value of the record at `location`, or raises
+        ValueError if the record there is not k's (it was compacted away).
+        """
+        segment, offset, length = location
+        data = os.pread(self._reader(segment), length, offset)
+        if len(data) < length:
+            raise ValueError('stale location')
+        crc, klen, vlen = _record.unpack_from(data)
+        if zlib.crc32(data[4:]) != crc or \
+                data[_record.size:_record.size + klen] != k.encode('utf-8'):
+            raise ValueError('stale location')
+        return data[_record.size + klen:]
+
+    def get(self, key):
+        """Return the object named by `key` or None, with a single pread."""
+        k = str(key)
+        location = self._index.get(k)
+        if location is None:
+            return None
+        try:
+            value = self._read(k, location)
+        except (OSError, ValueError):
+            # moved by a compaction meanwhile; look again under the lock.
+            with self._lock:
+                location = self._index.get(k)
+                if location is None:
+                    return None
+                value = self._read(k, location)
+        return value if self.binary else value.decode('utf-8')
+
+    def contains(self, key):
+        """Returns whether the object named by `key` exists."""
+        return str(key) in self._index
+
+    def query(self, query):
+        """Returns the objects in the collection of query.key (the keys whose
+        path is query.key, like DictDatastore). Matching keys are found in
+        the in-memory index.
+        """
+        collection = str(query.key)
+        keys = [k for k in list(self._index) if _partition(k) == collection]
+        values = (self.get(k) for k in keys)
+        return query([value for value in values if value is not None])
+
+    def keys(self):
+        """Returns the Keys of all objects."""
+        return [Key(k) for k in list(self._index)]
+
+    def __len__(self):
+        return len(self._index)
+
+    # compaction
+    def compact(self, ratio=None):
+        """Rewrites the live records of immutable segments whose live
+        fraction is below `ratio` (default compact_ratio) to the active
+        segment, and removes those segments. Returns the bytes reclaimed.
+        """
+        ratio = self.compact_ratio if ratio is None else ratio
+        with self._compact_lock:
+            with self._lock:
+                segments = sorted(s for s in self._total if s != self._active)
+                candidates = [s for s in segments
+                              if os.path.exists(self._path(s, 'hint')) and
+                              (self._live[s] < ratio * self._total[s] or not self._total[s])]
+            reclaimed = 0
+            for segment in candidates:
+                with self._lock:
+                    oldest = segment == min(s for s in self._total)
+                reclaimed += self._compact(segment, keep_tombstones=not oldest)
+            return reclaimed
+
+    def _compact(self, segment, keep_tombstones):
+        moved = []
+        for k, offset, length, deleted in self._scan(segment):
+            if deleted:
+                if keep_tombstones:
+                    moved.append((k, offset, None))
+            elif self._index.get(k) == (segment, offset, length):
+                moved.append((k, offset, self._read(k, (segment, offset, length))))
+
+        previous = None
+        with self._lock:
+            # copy the records still current, in the same critical section
+            # as the check, so a write made meanwhile is never overwritten.
+            entries = []
+            for k, offset, value in moved:
+                location = self._index.get(k)
+                if value is None:
+                    if location is None:
+                        entries.append((k, None))
+                elif location is not None and location[:2] == (segment, offset):
+                    entries.append((k, value))
+            if entries:
+                previous = self._append_locked(entries)
+        if previous is not None:
+            self._write_hint(previous)
+        self.sync()
+
+        with self._lock:
+            reclaimed = self._total.pop(segment, 0)
+            self._live.pop(segment, None)
+            fd = self._readers.pop(segment, None)
+            if fd is not None:
+                os.close(fd)
+            for extension in ('data', 'hint'):
+                path = self._path(segment, extension)
+                if os.path.exists(path):
+                    os.remove(path)
+        self.stats['compactions'] += 1
+        self.stats['reclaimed'] += reclaimed
+        return reclaimed
+
+    # background
+    def _run(self):
+        interval = self.sync_policy if self.sync_policy not in ('always', 'os') else 1.0
+        waited = 0.0
+        while not self._closed:
+            self._wakeup.wait(interval)
+            if self._closed:
+                return
+            waited += interval
+            try:
+                self.sync()
+                if self.compact_interval and waited >= self.compact_interval:
+                    waited = 0.0
+                    self.compact()
+            except Exception:
+                self.stats['errors'] += 1
+
+    def close(self):
+        """Stops the background thread, and makes the active segment
+        immutable (writing its hint file).
+        """
+        if self._closed:
+            return
+        if self._thread is not None:
+            self._closed = True
+            self._wakeup.set()
+            self._thread.join()
+        with self._compact_lock, self._lock:
+            self._closed = True
+            _fsync(self._fd)
+            os.close(self._fd)
+            self._write_hint(self._active)
+            for fd in self._readers.values():
+                os.close(fd)
+            self._readers = {}
@@ -0,0 +1,754 @@
+"""LSM-tree datastore: writes go to a sorted in-memory table (the memtable)
+and a write-ahead log, and are flushed to immutable sorted tables (SSTables),
+merged by background compaction. Keys are kept in order, so range and prefix
+scans read tables sequentially.
+
+e.g.::
+
+    >>> from datastore.filesystem.lsm import LSMDatastore
+    >>> ds = LSMDatastore('/var/lib/app/events')
+    >>> ds.put(Key('/events/2024-01-01/a'), 'a')
+    >>> [str(k) for k, v in ds.scan(prefix='/events/2024-01')]
+    ['/events/2024-01-01/a']
+
+The directory holds `<n>.wal` logs (of the memtables not yet flushed),
+`<n>.sst` tables, and `MANIFEST`, listing the tables of each level.
+"""
+import collections
+import heapq
+import itertools
+import json
+import os
+import struct
+import threading
+import zlib
+from bisect import bisect_right
+
+from datastore.core import serialize
+from datastore.core.key import Key
+from datastore.core.memory import SortedKeyList, _direction, _seek, _takewhile
+from datastore.core.membership import BloomFilter
+from datastore.core.persistent import (_fsync, _fsync_directory, read_records,
+                                       write_records)
+from datastore.core.stores import Datastore, _partition
+
+from .filesystem import ensure_directory_exists
+
+_entry = struct.Struct('<II')          # key length, value length
+_block = struct.Struct('<IQII')        # first key length, offset, length, crc32
+_bloom = struct.Struct('<QdQ')         # capacity, error rate, count
+_footer = struct.Struct('<QQQQQI8s')   # metadata offset, index, bloom and last
+                                       # key lengths, entries, crc32, magic
+_magic = b'LSMTABLE'
+_tombstone = 0xFFFFFFFF
+_missing = object()
+
+
+def _merge(sources):
+    """Merges sorted iterables of (key string, value) pairs, given newest
+    first, into one sorted iterable with the newest value of each key.
+    """
+    def tagged(source, age):
+        for k, value in source:
+            yield k, age, value
+
+    previous = None
+    merged = heapq.merge(*[tagged(source, age) for age, source in enumerate(sources)])
+    for k, age, value in merged:
+        if k != previous:
+            previous = k
+            yield k, value
+
+
+class _Memtable(object):
+    """Sorted in-memory table of key strings to values (None: deleted), with
+    the generation of the write-ahead log holding its writes.
+    """
+    def __init__(self, generation):
+        self.generation = generation
+        self.items = {}
+        self.keys = SortedKeyList()
+        self.size = 0
+
+    def put(self, k, value):
+        added = k not in self.items
+        self.items[k] = value
+        if added:
+            self.keys.add(k)
+        self.size += len(k) + (0 if value is None else len(value))
+
+    def get(self, k):
+        return self.items.get(k, _missing)
+
+    def scan(self, start=None, stop=None):
+        items = self.items
+        for k in self.keys.irange(start, stop):
+            value = items.get(k, _missing)
+            if value is not _missing:
+                yield k, value
+
+
+class _TableWriter(object):
+    """Writes sorted (key string, value) entries to a new SSTable."""
+    def __init__(self, path, block_size, error_rate):
+        self.path = path
+        self.block_size = block_size
+        self.error_rate = error_rate
+        self.size = 0
+        self._file = open(path + '.tmp', 'wb')
+        self._block = []
+        self._pending = 0
+        self._index = []
+        self._keys = []
+
+    def add(self, k, value):
+        kbytes = k.encode('utf-8')
+        if value is None:
+            chunk = _entry.pack(len(kbytes), _tombstone) + kbytes
+        else:
+            chunk = _entry.pack(len(kbytes), len(value)) + kbytes + value
+        if not self._block:
+            self._first = kbytes
+        self._block.append(chunk)
+        self._pending += len(chunk)
+        self._keys.append(k)
+        if self._pending >= self.block_size:
+            self._end_block()
+
+    def _end_block(self):
+        data = b''.join(self._block)
+        self._file.write(data)
+        self._index.append(_block.pack(len(self._first), self.size, len(data),
+                                       zlib.crc32(data)) + self._first)
+        self.size += len(data)
+        self._block = []
+        self._pending = 0
+
+    def finish(self):
+        """Writes the index, filter and footer, and moves the table in place."""
+        if self._block:
+            self._end_block()
+        bloom = BloomFilter(len(self._keys), self.error_rate)
+        for k in self._keys:
+            bloom.add(k)
+
+        index = b''.join(self._index)
+        bloom = _bloom.pack(bloom.capacity, bloom.error_rate, bloom.count) + bytes(bloom._bits)
+        last = self._keys[-1].encode('utf-8')
+        meta = index + bloom + last
+        self._file.write(meta)
+        self._file.write(_footer.pack(self.size, len(index), len(bloom), len(last),
+                                      len(self._keys), zlib.crc32(meta), _magic))
+        self._file.flush()
+        _fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.path + '.tmp', self.path)
+
+
+class SSTable(object):
+    """Immutable sorted table in the file at `path`: blocks of entries, an
+    index of the first key of each block, and a Bloom filter of its keys.
+    The index and filter are kept in memory, so a get reads a single block,
+    and none when the filter rules the key out.
+
+    The file stays open while the table is referenced, so scans and gets
+    in progress survive a compaction removing it.
+    """
+    def __init__(self, path, number):
+        self.path = path
+        self.number = number
+        self._fd = os.open(path, os.O_RDONLY)
+        self.size = os.fstat(self._fd).st_size
+
+        footer = os.pread(self._fd, _footer.size, self.size - _footer.size)
+        if len(footer) < _footer.size or footer[-len(_magic):] != _magic:
+            raise ValueError('{} is not an SSTable.'.format(path))
+        offset, index_length, bloom_length, last_length, self.count, crc, magic = \
+            _footer.unpack(footer)
+        meta = os.pread(self._fd, index_length + bloom_length + last_length, offset)
+        if zlib.crc32(meta) != crc:
+            raise ValueError('{} is corrupt.'.format(path))
+
+        self._firsts = []
+        self._blocks = []
+        position = 0
+        while position < index_length:
+            klen, block_offset, length, block_crc = _block.unpack_from(meta, position)
+            position += _block.size
+            self._firsts.append(meta[position:position + klen].decode('utf-8'))
+            position += klen
+            self._blocks.append((block_offset, length, block_crc))
+
+        capacity, error_rate, count = _bloom.unpack_from(meta, index_length)
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.bloom.count = count
+        self.bloom._bits = bytearray(meta[index_length + _bloom.size:
+                                          index_length + bloom_length])
+        self.first = self._firsts[0]
+        self.last = meta[index_length + bloom_length:].decode('utf-8')
+
+    def _read_block(self, i):
+        offset, length, crc = self._blocks[i]
+        data = os.pread(self._fd, length, offset)
+        if len(data) < length or zlib.crc32(data) != crc:
+            raise ValueError('{} is corrupt (block at {}).'.format(self.path, offset))
+
+        entries = []
+        position = 0
+        while position < length:
+            klen, vlen = _entry.unpack_from(data, position)
+            position += _entry.size
+            k = data[position:position + klen].decode('utf-8')
+            position += klen
+            if vlen == _tombstone:
+                entries.append((k, None))
+            else:
+                entries.append((k, data[position:position + vlen]))
+                position += vlen
+        return entries
+
+    def may_contain(self, k):
+        """Returns whether key string `k` may be in the table."""
+        return self.first <= k <= self.last and k in self.bloom
+
+    def get(self, k):
+        """Returns the value of `k` (None: deleted), or _missing."""
+        i = bisect_right(self._firsts, k) - 1
+        if i >= 0:
+            for key, value in self._read_block(i):
+                if key == k:
+                    return value
+        return _missing
+
+    def overlaps(self, start, stop):
+        """Returns whether the table may hold keys in [start, stop)."""
+        return (stop is None or self.first < stop) and \
+            (start is None or self.last >= start)
+
+    def scan(self, start=None, stop=None):
+        """Yields the (key string, value) entries in [start, stop), in order."""
+        first = 0 if start is None else max(bisect_right(self._firsts, start) - 1, 0)
+        for i in range(first, len(self._blocks)):
+            if stop is not None and self._firsts[i] >= stop:
+                return
+            for k, value in self._read_block(i):
+                if start is not None and k < start:
+                    continue
+                if stop is not None and k >= stop:
+                    return
+                yield k, value
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        self.close()
+
+
+class LSMDatastore(Datastore):
+    """Datastore organized as a log-structured merge tree, for write-heavy
+    collections that are read by key ranges.
+
+    Writes are appended to a write-ahead log and applied to the memtable, a
+    sorted in-memory table. When the memtable reaches `memtable_size` bytes
+    it becomes immutable, and is flushed to an SSTable in level 0. Compaction
+    is leveled: when level 0 has `level0_tables` tables they are merged into
+    level 1, and when a level i >= 1 exceeds `level_size` * `level_ratio` **
+    (i - 1) bytes, one of its tables is merged into level i + 1. Tables of
+    levels 1 and up do not overlap, and are split at `table_size` bytes.
+    Deletes are tombstones, dropped when merged into the deepest level.
+
+    A get looks in the memtables, then the level 0 tables (newest first),
+    then the one table of each deeper level that may hold the key; each
+    table's Bloom filter skips most tables without the key. Scans merge the
+    memtables and the overlapping tables, in key order:
+
+        * scan          : (key, value) pairs in [start, stop), with a prefix
+        * query         : the objects in the collection of query.key, like
+                          DictDatastore (the keys whose path is query.key)
+        * query_subtree : all objects under query.key (its descendants)
+        * query_prefix  : the objects whose key string starts with a prefix
+        * query_range   : the objects with keys in [start, stop)
+
+    As in SortedDictDatastore, an order on 'key' is served by the scan, and
+    `query.offset_key` seeks; reverse scans are merged forward, then
+    reversed in memory.
+
+    Flushes and compactions run in a background thread (or in the writing
+    thread, if not `background`). Like FileSystemDatastore, objects are
+    strings or bytes (see `binary`). When the log is synced to disk depends
+    on `sync` ('always', 'os', or an interval in seconds; see
+    PersistentDatastore). Opening a directory replays its logs.
+
+    :param root: directory of the tables and logs.
+    :param binary: bool, read objects back as bytes.
+    :param sync: 'always', 'os', or an interval in seconds.
+    :param memtable_size: bytes after which the memtable is flushed.
+    :param table_size: bytes after which compaction starts a new table.
+    :param block_size: bytes of the blocks read from tables.
+    :param level0_tables: level 0 tables that trigger a compaction.
+    :param level_size: bytes of level 1; each deeper level is `level_ratio`
+                       times larger.
+    :param bloom_error_rate: false positive rate of the tables' filters.
+    :param background: whether to flush and compact in a background thread.
+    """
+    max_immutables = 2
+
+    def __init__(self, root, binary=False, sync=1.0, memtable_size=4 << 20,
+                 table_size=2 << 20, block_size=4096, level0_tables=4,
+                 level_size=10 << 20, level_ratio=10, bloom_error_rate=0.01,
+                 background=True):
+        if sync not in ('always', 'os') and \
+                not (isinstance(sync, (int, float)) and sync > 0):
+            raise ValueError("sync must be 'always', 'os' or seconds. Got {!r}.".format(sync))
+
+        root = os.path.normpath(root)
+        ensure_directory_exists(root)
+
+        self.root_path = root
+        self.binary = bool(binary)
+        self.sync_policy = sync
+        self.memtable_size = memtable_size
+        self.table_size = table_size
+        self.block_size = block_size
+        self.level0_tables = level0_tables
+        self.level_size = level_size
+        self.level_ratio = level_ratio
+        self.bloom_error_rate = bloom_error_rate
+        self.stats = collections.Counter()
+
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._cursors = {}
+        self._dirty = False
+        self._closed = False
+
+        self._recover()
+
+        self._wakeup = threading.Event()
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    # files
+    def _path(self, number, extension):
+        return os.path.join(self.root_path, '{:010d}.{}'.format(number, extension))
+
+    def _number(self):
+        number = self._next
+        self._next += 1
+        return number
+
+    def _set_state(self, memtable, immutables, levels):
+        """Replaces the state read by gets and scans (one attribute, so
+        readers never see a flushed memtable missing from both places).
+        """
+        firsts = tuple([t.first for t in level] for level in levels)
+        self._state = (memtable, immutables, levels, firsts)
+
+    def _recover(self):
+        """Opens the tables in MANIFEST, removes files of interrupted
+        flushes and compactions, and flushes the logs to level 0.
+        """
+        levels, self._next = [[]], 0
+        manifest = os.path.join(self.root_path, 'MANIFEST')
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                data = json.load(f)
+            levels, self._next = data['levels'], data['next']
+
+        listed = set(itertools.chain.from_iterable(levels))
+        logs = []
+        for name in os.listdir(self.root_path):
+            number, _, extension = name.partition('.')
+            if not number.isdigit():
+                continue
+            self._next = max(self._next, int(number) + 1)
+            if extension == 'wal':
+                logs.append(int(number))
+            elif extension != 'sst' or int(number) not in listed:
+                os.remove(os.path.join(self.root_path, name))
+
+        levels = tuple(tuple(SSTable(self._path(n, 'sst'), n) for n in level)
+                       for level in levels)
+        replayed = _Memtable(None)
+        for generation in sorted(logs):
+            for k, value in read_records(self._path(generation, 'wal'),
+                                         serialize.PickleSerializer):
+                replayed.put(k, value)
+                self.stats['replayed'] += 1
+
+        self._set_state(_Memtable(None), (replayed,), levels)
+        self._flush()
+        for generation in logs:
+            os.remove(self._path(generation, 'wal'))
+        self._open_memtable()
+
+    def _open_memtable(self):
+        """Starts a new memtable and log (called with the lock held)."""
+        generation = self._number()
+        self._wal = open(self._path(generation, 'wal'), 'ab', buffering=0)
+        _fsync_directory(self.root_path)
+        memtable, immutables, levels, firsts = self._state
+        self._set_state(_Memtable(generation), immutables, levels)
+
+    def _write_manifest(self, levels):
+        path = os.path.join(self.root_path, 'MANIFEST')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'levels': [[t.number for t in level] for level in levels],
+                       'next': self._next}, f)
+            f.flush()
+            _fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        _fsync_directory(self.root_path)
+
+    def _write_tables(self, entries, split):
+        """Writes sorted entries to new tables of up to table_size bytes (or
+        one table, if not `split`), and returns them.
+        """
+        tables, writer = [], None
+        for k, value in entries:
+            if writer is None:
+                with self._lock:
+                    number = self._number()
+                writer = _TableWriter(self._path(number, 'sst'), self.block_size,
+                                      self.bloom_error_rate)
+            writer.add(k, value)
+            if split and writer.size >= self.table_size:
+                writer.finish()
+                tables.append(SSTable(writer.path, number))
+                writer = None
+        if writer is not None:
+            writer.finish()
+            tables.append(SSTable(writer.path, number))
+        return tables
+
+    # writes
+    def _append(self, entries):
+        """Logs, then applies (key string, value bytes or None) entries."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('LSMDatastore is closed.')
+            write_records(self._wal, entries, serialize.PickleSerializer)
+            if self.sync_policy == 'always':
+                _fsync(self._wal.fileno())
+            else:
+                self._dirty = True
+
+            memtable = self._state[0]
+            for k, value in entries:
+                memtable.put(k, value)
+            full = memtable.size >= self.memtable_size
+            if full:
+                self._rotate()
+                self._open_memtable()
+                backlog = len(self._state[1])
+
+        if full:
+            if self._thread is None:
+                self._maintain()
+            elif backlog > self.max_immutables:
+                # the background thread is behind; flush in this thread.
+                self.stats['stalls'] += 1
+                self._flush()
+            else:
+                self._wakeup.set()
+
+    def _rotate(self):
+        """Makes the memtable immutable and closes its log (called with the
+        lock held).
+        """
+        _fsync(self._wal.fileno())
+        self._wal.close()
+        self._dirty = False
+        memtable, immutables, levels, firsts = self._state
+        self._set_state(_Memtable(None), (memtable,) + immutables, levels)
+
+    def _value(self, value):
+        if isinstance(value, str):
+            return value.encode('utf-8')
+        return bytes(value)
+
+    def _decode(self, value):
+        return value if self.binary else value.decode('utf-8')
+
+    def put(self, key, value):
+        """Stores the object `value` (a string or bytes) named by `key`."""
+        if value is None:
+            return self.delete(key)
+        self._append([(str(key), self._value(value))])
+
+    def delete(self, key):
+        """Removes the object named by `key` (writes a tombstone)."""
+        self._append([(str(key), None)])
+
+    def put_many(self, items):
+        """Stores (key, value) pairs with a single log append (and sync)."""
+        entries = [(str(key), None if value is None else self._value(value))
+                   for key, value in items]
+        if entries:
+            self._append(entries)
+
+    def delete_many(self, keys):
+        """Removes the objects named by `keys` with a single log append."""
+        entries = [(str(key), None) for key in keys]
+        if entries:
+            self._append(entries)
+
+    def sync(self):
+        """Forces logged writes to disk."""
+        with self._lock:
+            if self._dirty and not self._closed:
+                _fsync(self._wal.fileno())
+                self._dirty = False
+
+    # reads
+    def _lookup(self, k):
+        memtable, immutables, levels, firsts = self._state
+        for table in (memtable,) + immutables:
+            value = table.get(k)
+            if value is not _missing:
+                return value
+
+        candidates = list(levels[0])
+        for level, level_firsts in zip(levels[1:], firsts[1:]):
+            i = bisect_right(level_firsts, k) - 1
+            if i >= 0:
+                candidates.append(level[i])
+        for table in candidates:
+            if not table.may_contain(k):
+                self.stats['bloom_skips'] += 1
+                continue
+            self.stats['table_reads'] += 1
+            value = table.get(k)
+            if value is not _missing:
+                return value
+        return None
+
+    def get(self, key):
+        """Return the object named by `key` or None."""
+        value = self._lookup(str(key))
+        return None if value is None else self._decode(value)
+
+    def contains(self, key):
+        """Returns whether the object named by `key` exists."""
+        return self._lookup(str(key)) is not None
+
+    def _sources(self, start, stop):
+        """Returns sorted iterables of the entries in [start, stop), newest
+        first: the memtables, the level 0 tables, then each deeper level.
+        """
+        memtable, immutables, levels, firsts = self._state
+        sources = [table.scan(start, stop) for table in (memtable,) + immutables]
+        sources += [t.scan(start, stop) for t in levels[0] if t.overlaps(start, stop)]
+        for level in levels[1:]:
+            tables = [t for t in level if t.overlaps(start, stop)]
+            sources.append(itertools.chain.from_iterable(
+                t.scan(start, stop) for t in tables))
+        return sources
+
+    def _irange(self, start, stop, prefix, reverse):
+        """Yields the live (key string, value) pairs in [start, stop) whose
+        key string starts with `prefix`, in key order (or reversed).
+        """
+        start = None if start is None else str(start)
+        stop = None if stop is None else str(stop)
+        if prefix is not None:
+            prefix = str(prefix)
+            if start is None or start < prefix:
+                start = prefix
+            end = prefix + '\U0010ffff'
+            if stop is None or stop > end:
+                stop = end
+
+        pairs = ((k, value) for k, value in _merge(self._sources(start, stop))
+                 if value is not None)
+        if prefix is not None:
+            pairs = _takewhile(pairs, lambda pair: pair[0].startswith(prefix))
+        if reverse:
+            pairs = reversed(list(pairs))
+        return pairs
+
+    def scan(self, start=None, stop=None, prefix=None, reverse=False):
+        """Yields (key, value) pairs in key order, for keys in [start, stop)
+        whose key string starts with `prefix`.
+        """
+        for k, value in self._irange(start, stop, prefix, reverse):
+            yield Key(k), self._decode(value)
+
+    def _results(self, query, pairs):
+        return query(self._decode(value) for k, value in pairs)
+
+    def query(self, query):
+        """Returns the objects in the collection of query.key (see Key.path),
+        like DictDatastore, in key order. Scans the subtree of query.key.
+
+        :param query: Query object describing the objects to return.
+        """
+        query, reverse = _direction(query)
+        start, stop = _seek(query, None, None, reverse)
+        partition = str(query.key)
+        bases = ['/'] if partition == '/' else [partition + '/', partition + ':']
+        pairs = itertools.chain.from_iterable(
+            self._irange(start, stop, base, False) for base in bases)
+        pairs = (pair for pair in pairs if _partition(pair[0]) == partition)
+        if reverse:
+            pairs = reversed(list(pairs))
+        return self._results(query, pairs)
+
+    def query_subtree(self, query):
+        """Returns the objects named by descendants of query.key."""
+        k = str(query.key)
+        return self.query_prefix(query, '/' if k == '/' else k + '/')
+
+    def query_prefix(self, query, prefix):
+        """Returns the objects whose key string starts with `prefix`."""
+        query, reverse = _direction(query)
+        start, stop = _seek(query, None, None, reverse)
+        return self._results(query, self._irange(start, stop, prefix, reverse))
+
+    def query_range(self, query, start=None, stop=None):
+        """Returns the objects with keys in [start, stop) (Keys or strings;
+        None is unbounded). query.key is ignored.
+        """
+        query, reverse = _direction(query)
+        start, stop = _seek(query, start, stop, reverse)
+        return self._results(query, self._irange(start, stop, None, reverse))
+
+    def keys(self):
+        """Returns the Keys of all objects, in order."""
+        return [Key(k) for k, value in self._irange(None, None, None, False)]
+
+    def levels(self):
+        """Returns the (table count, bytes) of each level."""
+        return [(len(level), sum(t.size for t in level)) for level in self._state[2]]
+
+    # flushes and compactions
+    def flush(self):
+        """Writes the memtable (and any queued immutable ones) to level 0."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('LSMDatastore is closed.')
+            if self._state[0].items:
+                self._rotate()
+                self._open_memtable()
+        self._flush()
+
+    def _flush(self):
+        """Writes the immutable memtables to level 0 tables, oldest first,
+        and removes their logs.
+        """
+        with self._compact_lock:
+            while self._state[1]:
+                memtable = self._state[1][-1]
+                entries = ((k, memtable.items[k]) for k in memtable.keys)
+                tables = self._write_tables(entries, split=False)
+                with self._lock:
+                    current, immutables, levels, firsts = self._state
+                    levels = (tuple(tables) + levels[0],) + levels[1:]
+                    self._set_state(current, immutables[:-1], levels)
+                self._write_manifest(levels)
+                if memtable.generation is not None:
+                    os.remove(self._path(memtable.generation, 'wal'))
+                self.stats['flushes'] += 1
+
+    def _maintain(self):
+        self._flush()
+        self.compact()
+
+    def compact(self):
+        """Runs compactions until no level is over its limit. Returns the
+        number of compactions run.
+        """
+        count = 0
+        with self._compact_lock:
+            while self._compact_once():
+                count += 1
+        return count
+
+    def _limit(self, level):
+        return self.level_size * self.level_ratio ** (level - 1)
+
+    def _compact_once(self):
+        """Merges level 0, or a table of the first level over its limit,
+        into the next level. Returns whether there was anything to do.
+        """
+        levels = self._state[2]
+        if len(levels[0]) >= self.level0_tables:
+            level, inputs = 0, list(levels[0])
+        else:
+            for level in range(1, len(levels)):
+                if sum(t.size for t in levels[level]) > self._limit(level):
+                    # round robin over the key space of the level
+                    cursor = self._cursors.get(level)
+                    tables = [t for t in levels[level] if cursor is None or t.first > cursor]
+                    inputs = [(tables or levels[level])[0]]
+                    self._cursors[level] = inputs[0].last
+                    break
+            else:
+                return False
+
+        target = level + 1
+        first = min(t.first for t in inputs)
+        last = max(t.last for t in inputs)
+        below = levels[target] if target < len(levels) else ()
+        overlapping = [t for t in below if t.first <= last and t.last >= first]
+        bottom = not any(levels[target + 1:])
+
+        entries = _merge([t.scan() for t in inputs] + [t.scan() for t in overlapping])
+        if bottom:
+            entries = ((k, value) for k, value in entries if value is not None)
+        tables = self._write_tables(entries, split=True)
+
+        replaced = set(t.number for t in inputs + overlapping)
+        with self._lock:
+            memtable, immutables, levels, firsts = self._state
+            levels = list(levels) + [()] * (target + 1 - len(levels))
+            levels[level] = tuple(t for t in levels[level] if t.number not in replaced)
+            levels[target] = tuple(sorted(
+                [t for t in levels[target] if t.number not in replaced] + tables,
+                key=lambda t: t.first))
+            levels = tuple(levels)
+            self._set_state(memtable, immutables, levels)
+        self._write_manifest(levels)
+        for table in inputs + overlapping:
+            os.remove(table.path)
+
+        self.stats['compactions'] += 1
+        self.stats['compacted'] += sum(t.size for t in inputs + overlapping)
+        return True
+
+    # background
+    def _run(self):
+        interval = self.sync_policy if self.sync_policy not in ('always', 'os') else 1.0
+        while not self._closed:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            if self._closed:
+                return
+            try:
+                self.sync()
+                self._maintain()
+            except Exception:
+                self.stats['errors'] += 1
+
+    def close(self):
+        """Stops the background thread, flushes the memtable and closes the
+        tables.
+        """
+        if self._closed:
+            return
+        with self._lock:
+            self._closed = True
+        if self._thread is not None:
+            self._wakeup.set()
+            self._thread.join()
+        with self._lock:
+            self._rotate()
+        self._flush()
+        for level in self._state[2]:
+            for table in level:
+                table.close()
@@ -3,6 +3,7 @@ import os
 import shutil
 import unittest
 
+from datastore.core.key import Key
 from datastore.core import serialize
 from datastore.tests import TestDatastore
 
@@ -26,6 +27,56 @@ class TestFileSystemDatastore(TestDatastore):
         dses = list(map(serialize.shim, fses))
         self.subtest_simple(dses, numelems=49)
 
+    def test_binary(self):
+        stack = serialize.Stack([serialize.json, serialize.ZlibSerializer(0)])
+        fs = FileSystemDatastore(self.tmp, binary=True)
+        ds = serialize.shim(fs, stack)
+        self.subtest_simple([ds], numelems=30)
+
+        key = Key('/binary')
+        fs.put(key, b'\x00\xff')
+        self.assertEqual(fs.get(key), b'\x00\xff')
+
+    def test_streams(self):
+        fs = FileSystemDatastore(self.tmp, binary=True)
+        key = Key('/streamed')
+        self.assertEqual(fs.get_stream(key), None)
+
+        fs.put_stream(key, lambda f: f.write(b'abc'))
+        with fs.get_stream(key) as f:
+            self.assertEqual(f.read(), b'abc')
+
+        value = {'values': list(range(0, 100000)), 'text': u'\u00fcber ' * 1000}
+        serializers = [serialize.json, serialize.PickleSerializer,
+                       serialize.Stack([serialize.json,
+                                        serialize.ZlibSerializer()]),
+                       serialize.Stack([serialize.PickleSerializer,
+                                        serialize.Bz2Serializer()]),
+                       serialize.Stack([serialize.MarshalSerializer,
+                                        serialize.LzmaSerializer(),
+                                        serialize.ZlibSerializer()])]
+        for serializer in serializers:
+            ds = serialize.shim(fs, serializer)
+            self.assertTrue(ds.streams)
+            ds.put(key, value)
+            self.assertEqual(ds.get(key), value)
+
+            # streamed values are the same as non-streamed ones.
+            raw = fs.get(key)
+            if not serialize.is_binary(serializer):
+                raw = raw.decode('utf-8')
+            self.assertEqual(serializer.loads(raw), value)
+            fs.put(key, serializer.dumps(value))
+            self.assertEqual(ds.get(key), value)
+
+            ds.delete(key)
+            self.assertEqual(ds.get(key), None)
+
+        # serializers without dump/load do not stream.
+        ds = serialize.shim(fs, serialize.TaggedSerializer)
+        self.assertFalse(ds.streams)
+        self.subtest_simple([ds], numelems=30)
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,196 @@
+import os
+import shutil
+import time
+import unittest
+
+from datastore.core.key import Key
+from datastore.core.query import Query
+from datastore.core import serialize
+from datastore.tests import TestDatastore
+
+from . import FileSystemDatastore, LogStructuredDatastore
+
+
+class TestLogStructuredDatastore(TestDatastore):
+    tmp = os.path.normpath('/tmp/datastore.test.ls')
+
+    def setUp(self):
+        if os.path.exists(self.tmp):
+            shutil.rmtree(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def open(self, path=None, **kwargs):
+        kwargs.setdefault('background', False)
+        return LogStructuredDatastore(path or self.tmp, **kwargs)
+
+    def test_datastore(self):
+        stores = [self.open(os.path.join(self.tmp, str(i))) for i in range(0, 3)]
+        stores.append(self.open(os.path.join(self.tmp, 'small'), max_segment_size=512))
+        self.subtest_simple(list(map(serialize.shim, stores)), numelems=49)
+        for store in stores:
+            store.close()
+
+    def test_binary(self):
+        ds = self.open(binary=True)
+        ds.put(Key('/binary'), b'\x00\xff')
+        ds.put(Key('/text'), 'caf\xe9')
+        self.assertEqual(ds.get(Key('/binary')), b'\x00\xff')
+        self.assertEqual(ds.get(Key('/text')), 'caf\xe9'.encode('utf-8'))
+        ds.close()
+
+    def test_reopen(self):
+        ds = self.open(max_segment_size=256)
+        for i in range(0, 100):
+            ds.put(Key('/a/item:{}'.format(i)), 'value {}'.format(i))
+        ds.put_many([(Key('/a/item:{}'.format(i)), None) for i in range(0, 10)])
+        ds.delete(Key('/a/item:10'))
+        ds.put(Key('/b'), 'b')
+        ds.close()
+
+        ds = self.open()
+        self.assertEqual(ds.stats['scanned'], 0)  # all from hint files
+        self.assertTrue(ds.stats['hinted'] > 1)
+        self.assertEqual(len(ds), 90)
+        self.assertEqual(ds.get(Key('/a/item:5')), None)
+        self.assertEqual(ds.get(Key('/a/item:50')), 'value 50')
+        self.assertEqual(sorted(ds.query(Query(Key('/a/item')))),
+                         sorted('value {}'.format(i) for i in range(11, 100)))
+        self.assertEqual(list(ds.query(Query(Key('/')))), ['b'])
+        ds.close()
+
+    def test_torn_tail(self):
+        ds = self.open(sync='always')
+        ds.put(Key('/a'), 'a')
+        ds.put(Key('/b'), 'b')
+        segment = ds._active
+        path = ds._path(segment, 'data')
+        ds._closed = True  # crash: no hint file for the active segment
+        os.close(ds._fd)
+
+        with open(path, 'ab') as f:
+            f.write(b'\x01\x02\x03')
+        ds = self.open()
+        self.assertEqual(ds.stats['scanned'], 1)
+        self.assertEqual(ds.get_many([Key('/a'), Key('/b')]), ['a', 'b'])
+        self.assertTrue(ds._active > segment)
+        ds.put(Key('/c'), 'c')
+        ds.close()
+
+        ds = self.open()
+        self.assertEqual(len(ds), 3)
+        ds.close()
+
+    def test_missing_hints(self):
+        ds = self.open(max_segment_size=256)
+        for i in range(0, 50):
+            ds.put(Key('/item:{}'.format(i)), 'value {}'.format(i))
+        ds.close()
+        segments = ds._segments()
+        os.remove(ds._path(segments[1], 'hint'))  # crash before _write_hint
+
+        ds = self.open()
+        self.assertEqual(ds.stats['scanned'], 1)
+        self.assertTrue(os.path.exists(ds._path(segments[1], 'hint')))
+        ds.put_many([(Key('/item:{}'.format(i)), None) for i in range(0, 50)])
+        self.assertTrue(ds.compact(1.0) > 0)
+        self.assertFalse(os.path.exists(ds._path(segments[1], 'data')))
+        ds.close()
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc/self/fd')
+    def test_reader_race(self):
+        class Racing(dict):
+            def get(self, key, default=None):
+                return None  # every caller sees the segment as not open yet
+
+        ds = self.open()
+        ds.put(Key('/a'), 'a')
+        ds._readers = Racing()
+        ds.get(Key('/a'))
+        fds = len(os.listdir('/proc/self/fd'))
+        for i in range(0, 10):
+            self.assertEqual(ds.get(Key('/a')), 'a')
+        self.assertEqual(len(os.listdir('/proc/self/fd')), fds)
+        ds.close()
+
+    def test_compaction(self):
+        ds = self.open(max_segment_size=1024)
+        keys = [Key('/item:{}'.format(i)) for i in range(0, 20)]
+        for generation in range(0, 20):
+            ds.put_many([(key, 'value {} {}'.format(i, generation))
+                         for i, key in enumerate(keys)])
+        ds.delete(keys[0])
+        segments = len(ds._segments())
+
+        reclaimed = ds.compact()
+        self.assertTrue(reclaimed > 0)
+        self.assertTrue(len(ds._segments()) < segments)
+        self.assertEqual(ds.get(keys[0]), None)
+        self.assertEqual(ds.get_many(keys[1:]),
+                         ['value {} 19'.format(i) for i in range(1, 20)])
+        ds.close()
+
+        ds = self.open()
+        self.assertEqual(len(ds), 19)
+        self.assertEqual(ds.get(keys[0]), None)
+        self.assertEqual(ds.get(keys[5]), 'value 5 19')
+        ds.close()
+
+    def test_compaction_keeps_concurrent_writes(self):
+        ds = self.open(max_segment_size=64)
+        ds.put(Key('/a'), 'old')
+        ds.put(Key('/b'), 'b')
+        ds.delete(Key('/b'))
+        for i in range(0, 4):
+            ds.put(Key('/c'), str(i))
+        scan = ds._scan
+
+        def scan_then_write(segment):
+            for record in scan(segment):
+                yield record
+            ds.put(Key('/a'), 'new')  # lands while compaction copies
+            ds.put(Key('/b'), 'back')
+
+        ds._scan = scan_then_write
+        ds.compact(ratio=1.0)
+        ds._scan = scan
+        self.assertEqual(ds.get(Key('/a')), 'new')
+        self.assertEqual(ds.get(Key('/b')), 'back')
+        ds.close()
+
+        ds = self.open()
+        self.assertEqual(ds.get_many([Key('/a'), Key('/b'), Key('/c')]),
+                         ['new', 'back', '3'])
+        ds.close()
+
+    def test_background(self):
+        ds = self.open(max_segment_size=512, sync=0.01, compact_interval=0.02,
+                       background=True)
+        key = Key('/counter')
+        for i in range(0, 500):
+            ds.put(key, str(i))
+            self.assertEqual(ds.get(key), str(i))
+        deadline = time.time() + 5
+        while not ds.stats['compactions'] and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(ds.stats['compactions'] > 0)
+        self.assertEqual(ds.get(key), '499')
+        ds.close()
+        with self.assertRaises(RuntimeError):
+            ds.put(key, 'closed')
+
+    def test_throughput(self):
+        fs = FileSystemDatastore(os.path.join(self.tmp, 'fs'))
+        ds = self.open(os.path.join(self.tmp, 'ls'))
+        items = [(Key('/item:{}'.format(i)), 'x' * 100) for i in range(0, 200)]
+
+        def elapsed(store):
+            start = time.time()
+            for key, value in items:
+                store.put(key, value)
+            return time.time() - start
+
+        self.assertTrue(elapsed(ds) * 5 < elapsed(fs))
+        self.assertEqual(ds.get(items[-1][0]), 'x' * 100)
+        ds.close()
@@ -0,0 +1,155 @@
+import os
+import random
+import shutil
+import threading
+
+from datastore.core.key import Key
+from datastore.core.query import Query
+from datastore.core.memory import SortedDictDatastore
+from datastore.core import serialize
+from datastore.tests import TestDatastore
+
+from . import LSMDatastore
+
+
+class TestLSMDatastore(TestDatastore):
+    tmp = os.path.normpath('/tmp/datastore.test.lsm')
+
+    def setUp(self):
+        if os.path.exists(self.tmp):
+            shutil.rmtree(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def open(self, path=None, **kwargs):
+        kwargs.setdefault('background', False)
+        return LSMDatastore(path or self.tmp, **kwargs)
+
+    def small(self, path=None, **kwargs):
+        # tiny memtables and tables, so flushes and compactions happen often
+        options = dict(memtable_size=512, table_size=1024, block_size=128,
+                       level0_tables=2, level_size=2048, level_ratio=2)
+        options.update(kwargs)
+        return self.open(path, **options)
+
+    def test_datastore(self):
+        stores = [self.open(os.path.join(self.tmp, str(i))) for i in range(0, 2)]
+        stores.append(self.small(os.path.join(self.tmp, 'small')))
+        self.subtest_simple(list(map(serialize.shim, stores)), numelems=49)
+        self.assertTrue(stores[-1].stats['compactions'] > 0)
+        for store in stores:
+            store.close()
+
+    def test_random(self):
+        rand = random.Random(0)
+        ds = self.small()
+        expected = {}
+        for i in range(0, 3000):
+            k = '/items/item:{:04}'.format(rand.randint(0, 400))
+            if rand.random() < 0.2:
+                ds.delete(Key(k))
+                expected.pop(k, None)
+            else:
+                ds.put(Key(k), str(i))
+                expected[k] = str(i)
+
+        self.assertTrue(len(ds.levels()) > 2)
+        for k in ['/items/item:{:04}'.format(i) for i in range(0, 401)]:
+            self.assertEqual(ds.get(Key(k)), expected.get(k), k)
+        self.assertEqual([(str(k), v) for k, v in ds.scan()], sorted(expected.items()))
+        self.assertTrue(ds.stats['bloom_skips'] > 0)
+
+        ds.close()
+        ds = self.small()
+        self.assertEqual([str(k) for k in ds.keys()], sorted(expected))
+        ds.close()
+
+    def test_queries(self):
+        ds = self.small()
+        plain = SortedDictDatastore()
+        keys = ['/a', '/a/b', '/a/b/c', '/a/b:1', '/a/b:2', '/a/c', '/a/c/d',
+                '/a/d:x', '/b', '/b/a', '/ab']
+        for k in keys * 20:  # overwrite, spreading versions across tables
+            ds.put(Key(k), k)
+            plain.put(Key(k), k)
+
+        for k in ['/', '/a', '/a/b', '/a/c', '/b', '/c']:
+            query = Query(Key(k))
+            self.assertEqual(list(ds.query(query)), list(plain.query(query)), k)
+            self.assertEqual(list(ds.query_subtree(query)),
+                             list(plain.query_subtree(query)), k)
+
+        query = Query(Key('/')).add_order('-key')
+        self.assertEqual(list(ds.query_prefix(query, '/a')),
+                         list(plain.query_prefix(query, '/a')))
+        query = Query(Key('/'), limit=2, offset_key=Key('/a/b'))
+        self.assertEqual(list(ds.query_range(query, stop='/b')), ['/a/b/c', '/a/b:1'])
+        self.assertEqual([str(k) for k, v in ds.scan('/a/c', '/b', reverse=True)],
+                         ['/ab', '/a/d:x', '/a/c/d', '/a/c'])
+        ds.close()
+
+    def test_recovery(self):
+        ds = self.open(sync='always')
+        ds.put(Key('/a'), 'a')
+        ds.put_many([(Key('/b'), 'b'), (Key('/c'), b'c')])
+        ds.delete(Key('/a'))
+        ds.flush()
+        ds.put(Key('/d'), 'd')
+        ds._closed = True  # crash: the memtable is only in the log
+        wal = ds._wal.name
+        ds._wal.close()
+        with open(wal, 'ab') as f:
+            f.write(b'\x07\x00')  # torn record
+
+        ds = self.open(binary=True)
+        self.assertEqual(ds.stats['replayed'], 1)
+        self.assertEqual(ds.get_many([Key('/a'), Key('/b'), Key('/c'), Key('/d')]),
+                         [None, b'b', b'c', b'd'])
+        self.assertEqual(ds.levels()[0][0], 2)
+        self.assertFalse(os.path.exists(wal))
+        ds.close()
+
+        with self.assertRaises(RuntimeError):
+            ds.put(Key('/e'), 'e')
+
+    def test_compaction_drops_tombstones(self):
+        ds = self.small()
+        keys = [Key('/item:{:03}'.format(i)) for i in range(0, 100)]
+        ds.put_many([(key, 'x' * 20) for key in keys])
+        ds.delete_many(keys)
+        ds.flush()
+        ds.compact()
+        ds.close()
+
+        ds = self.small(level0_tables=1)
+        ds.compact()
+        self.assertEqual(ds.keys(), [])
+        self.assertEqual(sum(size for count, size in ds.levels()), 0)
+        ds.close()
+
+    def test_background(self):
+        ds = self.small(background=True, sync=0.01)
+        errors = []
+
+        def write(n):
+            try:
+                for i in range(0, 500):
+                    ds.put(Key('/w{}/item:{:03}'.format(n, i)), str(i))
+            except Exception as e:
+                errors.append(e)
+
+        writers = [threading.Thread(target=write, args=(n,)) for n in range(0, 4)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(ds.keys()), 2000)
+        ds.close()
+        self.assertEqual(ds.stats['errors'], 0)
+
+        ds = self.small()
+        self.assertEqual(ds.get(Key('/w3/item:499')), '499')
+        self.assertEqual(len(list(ds.query_subtree(Query(Key('/w1'))))), 500)
+        ds.close()
@@ -176,6 +176,27 @@ class TestDatastore(TestCase):
 
         self.check_length(0)
 
+    def subtest_batch(self):
+        n = self.numelems
+        keys = [self.pkey.child(value) for value in range(0, n)]
+        items = list(zip(keys, range(0, n)))
+
+        for store in self.stores:
+            self.assertEqual(store.contains_many(keys), [False] * n)
+            self.assertEqual(store.get_many(keys), [None] * n)
+
+            store.put_many(iter(items))
+            self.assertEqual(store.contains_many(iter(keys)), [True] * n)
+            self.assertEqual(store.get_many(iter(keys)), list(range(0, n)))
+            for key, value in items[:5]:
+                self.assertEqual(store.get(key), value)
+
+            store.delete_many(iter(keys))
+            self.assertEqual(store.contains_many(keys), [False] * n)
+            self.assertEqual(store.get_many(keys), [None] * n)
+
+        self.check_length(0)
+
     def subtest_simple(self, stores, numelems=100):
         self.stores = stores
         self.numelems = numelems
@@ -185,6 +206,7 @@ class TestDatastore(TestCase):
         self.subtest_queries()
         self.subtest_update()
         self.subtest_remove()
+        self.subtest_batch()
 
 
 class TestNullDatastore(TestCase):
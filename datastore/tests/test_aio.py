@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+from datastore.core.aio import (AsyncAdapter, SyncAdapter,
+                                AsyncShimDatastore, AsyncCacheShimDatastore,
+                                AsyncSerializerShimDatastore,
+                                AsyncTieredDatastore, AsyncShardedDatastore)
+from datastore.core.key import Key
+from datastore.core.query import Query
+from datastore.core.stores import DictDatastore
+
+from . import TestDatastore
+
+
+class SlowDatastore(DictDatastore):
+    """DictDatastore sleeping `delay` seconds on every read."""
+    def __init__(self, delay):
+        super(SlowDatastore, self).__init__()
+        self.delay = delay
+
+    def get(self, key):
+        time.sleep(self.delay)
+        return super(SlowDatastore, self).get(key)
+
+    def get_many(self, keys):
+        time.sleep(self.delay)
+        return super(SlowDatastore, self).get_many(keys)
+
+
+def adapted():
+    return AsyncAdapter(DictDatastore())
+
+
+class TestAsyncDatastore(TestDatastore):
+    def test_adapters(self):
+        stores = [SyncAdapter(adapted()) for i in range(0, 3)]
+        self.subtest_simple(stores)
+        for store in stores:
+            store.close()
+
+    def test_shims(self):
+        stores = [
+            SyncAdapter(AsyncShimDatastore(adapted())),
+            SyncAdapter(AsyncCacheShimDatastore(adapted(), cache=adapted())),
+            SyncAdapter(AsyncSerializerShimDatastore(adapted())),
+        ]
+        self.subtest_simple(stores)
+
+    def test_collections(self):
+        stores = [
+            SyncAdapter(AsyncTieredDatastore([adapted(), adapted()])),
+            SyncAdapter(AsyncShardedDatastore([adapted() for i in range(0, 4)])),
+        ]
+        self.subtest_simple(stores)
+
+    def test_type_checks(self):
+        with self.assertRaises(TypeError):
+            AsyncAdapter(adapted())
+        with self.assertRaises(TypeError):
+            AsyncShimDatastore(DictDatastore())
+        with self.assertRaises(TypeError):
+            AsyncTieredDatastore([DictDatastore()])
+
+    def test_tiered_promotion(self):
+        tiers = [DictDatastore(), DictDatastore()]
+        tiered = AsyncTieredDatastore([AsyncAdapter(t) for t in tiers])
+        tiers[1].put(Key('/a'), 1)
+        self.assertEqual(asyncio.run(tiered.get(Key('/a'))), 1)
+        self.assertEqual(tiers[0].get(Key('/a')), 1)
+
+    def test_sharded_overlaps_io(self):
+        delay = 0.05
+        stores = [SlowDatastore(delay) for i in range(0, 8)]
+        sharded = AsyncShardedDatastore([AsyncAdapter(s) for s in stores],
+                                        shardingfn=lambda key: int(key.name))
+        keys = [Key(str(i)) for i in range(0, 64)]
+        asyncio.run(sharded.put_many([(key, int(key.name)) for key in keys]))
+
+        start = time.perf_counter()
+        values = asyncio.run(sharded.get_many(keys))
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(values, list(range(0, 64)))
+        # eight shards read concurrently, not one after the other.
+        self.assertLess(elapsed, delay * len(stores) / 2)
+
+    def test_sharded_query(self):
+        sharded = AsyncShardedDatastore([adapted() for i in range(0, 3)])
+        parent = Key('/values')
+        for i in range(0, 30):
+            asyncio.run(sharded.put(parent.child(i), {'n': i}))
+
+        query = Query(parent, limit=5, offset=10)
+        query.add_order('+n')
+        results = asyncio.run(sharded.query(query))
+        self.assertEqual([v['n'] for v in results], list(range(10, 15)))
@@ -0,0 +1,125 @@
+from datastore.core.cache import (CacheDatastore, LRUPolicy, LFUPolicy,
+                                  ARCPolicy, TinyLFUPolicy, estimate_size)
+from datastore.core.key import Key
+from datastore.core.stores import DictDatastore, TieredDatastore
+
+from . import TestDatastore
+
+
+def policies():
+    return [LRUPolicy(), LFUPolicy(), ARCPolicy(), TinyLFUPolicy()]
+
+
+class TestCacheDatastore(TestDatastore):
+    def test_simple(self):
+        stores = [CacheDatastore(10000, policy=p) for p in policies()]
+        self.subtest_simple(stores)
+
+    def test_capacity(self):
+        for policy in policies():
+            cache = CacheDatastore(10, policy=policy)
+            for i in range(0, 100):
+                cache.put(Key(str(i)), i)
+                self.assertTrue(len(cache) <= 10)
+            self.assertEqual(len(policy), len(cache))
+
+    def test_lru(self):
+        cache = CacheDatastore(2, policy=LRUPolicy())
+        cache.put(Key('a'), 1)
+        cache.put(Key('b'), 2)
+        cache.get(Key('a'))
+        cache.put(Key('c'), 3)
+        self.assertTrue(cache.contains(Key('a')))
+        self.assertFalse(cache.contains(Key('b')))
+        self.assertEqual(cache.stats['evictions'], 1)
+
+    def test_lfu(self):
+        cache = CacheDatastore(2, policy=LFUPolicy())
+        cache.put(Key('a'), 1)
+        cache.put(Key('b'), 2)
+        for _ in range(0, 3):
+            cache.get(Key('b'))
+        cache.get(Key('a'))
+        cache.put(Key('c'), 3)
+        self.assertFalse(cache.contains(Key('a')))
+        self.assertTrue(cache.contains(Key('b')))
+        cache.put(Key('d'), 4)
+        self.assertFalse(cache.contains(Key('c')))
+        self.assertTrue(cache.contains(Key('b')))
+
+    def test_hot_key_overwrites(self):
+        for policy in [LFUPolicy(), ARCPolicy()]:
+            cache = CacheDatastore(2, policy=policy)
+            cache.put(Key('hot'), 1)
+            for _ in range(0, 5):
+                cache.get(Key('hot'))
+            cache.put(Key('cold'), 2)
+            cache.get(Key('cold'))
+            cache.put(Key('hot'), 3)  # e.g. written through a TieredDatastore
+            cache.put(Key('new'), 4)
+            self.assertEqual(cache.get(Key('hot')), 3)
+            self.assertFalse(cache.contains(Key('cold')))
+            self.assertEqual(len(policy), len(cache))
+
+    def test_arc_resists_scans(self):
+        cache = CacheDatastore(100, policy=ARCPolicy())
+        hot = [Key('hot:{}'.format(i)) for i in range(0, 50)]
+        for key in hot:
+            cache.put(key, 1)
+            cache.get(key)
+
+        for i in range(0, 1000):
+            cache.put(Key('scan:{}'.format(i)), 1)
+        self.assertTrue(all(cache.contains(key) for key in hot))
+
+    def test_tinylfu_admission(self):
+        cache = CacheDatastore(10, policy=TinyLFUPolicy(width=256))
+        popular = [Key(str(i)) for i in range(0, 10)]
+        for key in popular:
+            cache.put(key, 1)
+            for _ in range(0, 5):
+                cache.get(key)
+
+        for i in range(100, 200):
+            cache.get(Key(str(i)))
+            cache.put(Key(str(i)), 1)
+        self.assertTrue(all(cache.contains(key) for key in popular))
+        self.assertEqual(cache.stats['rejections'], 100)
+
+    def test_sizes(self):
+        cache = CacheDatastore(100, sizefn=len)
+        cache.put(Key('a'), 'x' * 60)
+        cache.put(Key('b'), 'x' * 30)
+        self.assertEqual(cache.size, 90)
+        cache.put(Key('c'), 'x' * 20)
+        self.assertFalse(cache.contains(Key('a')))
+        self.assertEqual(cache.size, 50)
+
+        cache.put(Key('d'), 'x' * 200)
+        self.assertFalse(cache.contains(Key('d')))
+        cache.put(Key('b'), 'x' * 10)
+        self.assertEqual(cache.size, 30)
+        cache.delete(Key('b'))
+        self.assertEqual(cache.size, 20)
+
+        self.assertTrue(estimate_size({'a': [1, 2, 3]}) > estimate_size({}))
+
+    def test_stats(self):
+        cache = CacheDatastore(10)
+        cache.put(Key('a'), 1)
+        cache.get(Key('a'))
+        cache.get(Key('b'))
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 1)
+        self.assertEqual(cache.hit_rate, 0.5)
+
+    def test_tiered(self):
+        cache = CacheDatastore(5)
+        backing = DictDatastore()
+        tiered = TieredDatastore([cache, backing])
+        for i in range(0, 20):
+            tiered.put(Key(str(i)), i)
+        self.assertEqual(len(cache), 5)
+        self.assertEqual(len(backing), 20)
+        self.assertEqual(tiered.get(Key('0')), 0)
+        self.assertTrue(cache.contains(Key('0')))
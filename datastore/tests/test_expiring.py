@@ -0,0 +1,170 @@
+import os
+import shutil
+import threading
+import time
+
+from datastore.core import serialize
+from datastore.core.expiring import ExpiringDatastore
+from datastore.core.key import Key
+from datastore.core.query import Query
+from datastore.core.stores import DictDatastore
+from datastore.filesystem import FileSystemDatastore
+
+from . import TestDatastore
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestExpiringDatastore(TestDatastore):
+    tmp = os.path.normpath('/tmp/datastore.test.expiring')
+
+    def tearDown(self):
+        if os.path.exists(self.tmp):
+            shutil.rmtree(self.tmp)
+
+    def test_simple(self):
+        stores = [ExpiringDatastore(DictDatastore()),
+                  ExpiringDatastore(DictDatastore(), ttl=3600)]
+        self.subtest_simple(stores)
+
+    def subtest_expiry(self, child):
+        clock = Clock()
+        ds = ExpiringDatastore(child, ttl=10, clock=clock)
+        parent = Key('/sessions')
+        for i in range(0, 10):
+            ds.put(parent.child(i), {'n': i})
+        ds.ttl = None
+        ds.put(parent.child('forever'), {'n': -1})
+        ds.put(parent.child('long'), {'n': 100}, ttl=100)
+
+        clock.now += 5
+        self.assertEqual(ds.get(parent.child(3)), {'n': 3})
+        self.assertEqual(len(list(ds.query(Query(parent)))), 12)
+
+        clock.now += 10
+        self.assertEqual(ds.get(parent.child(3)), None)
+        self.assertFalse(ds.contains(parent.child(4)))
+        self.assertTrue(ds.contains(parent.child('forever')))
+        self.assertEqual(ds.get_many([parent.child(5), parent.child('long')]),
+                         [None, {'n': 100}])
+        values = sorted(v['n'] for v in ds.query(Query(parent)))
+        self.assertEqual(values, [-1, 100])
+
+        # reclaimed in bounded batches
+        ds.batch = 4
+        self.assertEqual(ds.reap(), 4)
+        self.assertEqual(ds.reap(), 3)  # the other three were deleted on read
+        self.assertEqual(ds.reap(), 0)
+        for i in range(0, 10):
+            self.assertEqual(child.get(parent.child(i)), None)
+        self.assertTrue(child.get(parent.child('long')) is not None)
+
+    def test_expiry(self):
+        self.subtest_expiry(DictDatastore())
+
+    def test_filesystem(self):
+        self.subtest_expiry(serialize.shim(FileSystemDatastore(self.tmp)))
+
+    def test_renewal(self):
+        clock = Clock()
+        child = DictDatastore()
+        ds = ExpiringDatastore(child, ttl=10, clock=clock)
+        key = Key('/limit:bruce')
+        ds.put(key, 1)
+        clock.now += 8
+        ds.put(key, 2)
+        clock.now += 8
+        self.assertEqual(ds.reap(), 0)
+        self.assertEqual(ds.get(key), 2)
+        ds.delete(key)
+        self.assertEqual(ds.pending(), 0)
+
+    def test_put_after_expired_read(self):
+        clock = Clock()
+        ds = ExpiringDatastore(DictDatastore(), ttl=10, clock=clock)
+        key = Key('/a')
+        ds.put(key, 1)
+        clock.now += 20
+        expired = ds.child_datastore.get(key)  # a reader finds it expired...
+        ds.put(key, 2)                         # ...a writer renews it...
+        self.assertEqual(ds._unwrap(key, expired, clock()), None)
+        self.assertEqual(ds.get(key), 2)       # ...and it is not deleted
+        self.assertEqual(ds.reap(), 0)
+        self.assertEqual(ds.pending(), 1)
+
+    def test_put_during_expired_delete(self):
+        class SlowDatastore(DictDatastore):
+            putting = threading.Event()
+            reread = threading.Event()
+            written = threading.Event()
+            hooked = False
+
+            def put(self, key, value):
+                if self.hooked:
+                    self.putting.set()
+                    self.reread.wait(5)
+                super(SlowDatastore, self).put(key, value)
+                if self.hooked:
+                    self.written.set()
+
+            def get_many(self, keys):
+                values = super(SlowDatastore, self).get_many(keys)
+                if self.hooked:
+                    self.reread.set()
+                    self.written.wait(1)
+                return values
+
+        clock = Clock()
+        child = SlowDatastore()
+        ds = ExpiringDatastore(child, ttl=10, clock=clock)
+        key = Key('/a')
+        ds.put(key, 1)
+        clock.now += 20
+
+        # a writer renews the object while a reader, having found it expired,
+        # re-reads it (still expired) before the renewal reaches the child.
+        child.hooked = True
+        writer = threading.Thread(target=ds.put, args=(key, 2))
+        writer.start()
+        child.putting.wait(5)
+        self.assertEqual(ds.get(key), None)
+        writer.join()
+        self.assertEqual(ds.get(key), 2)
+        self.assertEqual(ds.pending(), 1)
+
+    def test_rebuild(self):
+        clock = Clock()
+        child = DictDatastore()
+        ds = ExpiringDatastore(child, ttl=10, clock=clock)
+        ds.put_many([(Key(str(i)), i) for i in range(0, 5)])
+        ds.ttl = None
+        ds.put(Key('/forever'), -1)
+
+        ds = ExpiringDatastore(child, ttl=10, clock=clock)  # restarted
+        clock.now += 20
+        self.assertEqual(ds.reap(), 0)
+        self.assertEqual(ds.rebuild(), 5)
+        self.assertEqual(ds.pending(), 5)
+        self.assertEqual(ds.reap(), 5)
+        self.assertEqual(len(child), 1)
+
+    def test_background(self):
+        child = DictDatastore()
+        ds = ExpiringDatastore(child, ttl=0.01)
+        keys = [Key(str(i)) for i in range(0, 50)]
+        ds.put_many([(key, i) for i, key in enumerate(keys)])
+        ds.start(interval=0.01)
+        try:
+            deadline = time.time() + 5
+            while len(child) and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            ds.stop()
+        self.assertEqual(len(child), 0)
+        self.assertEqual(ds.reaped, 50)
@@ -0,0 +1,167 @@
+import collections
+import os
+import shutil
+
+from datastore.core import serialize
+from datastore.core.key import Key
+from datastore.core.membership import (BloomFilter, ScalableBloomFilter,
+                                       CuckooFilter, BloomFilterDatastore)
+from datastore.core.stores import DictDatastore
+from datastore.filesystem import FileSystemDatastore
+
+from . import TestDatastore
+
+
+class CountingDatastore(DictDatastore):
+    reads = 0
+
+    def get(self, key):
+        self.reads += 1
+        return super(CountingDatastore, self).get(key)
+
+    def contains(self, key):
+        self.reads += 1
+        return super(CountingDatastore, self).contains(key)
+
+
+class TestFilters(TestDatastore):
+    def subtest_filter(self, filter, count=2000, error_rate=0.05):
+        items = ['/item:{}'.format(i) for i in range(0, count)]
+        for item in items:
+            filter.add(item)
+        self.assertTrue(all(item in filter for item in items))
+
+        absent = ['/absent:{}'.format(i) for i in range(0, count)]
+        false_positives = sum(1 for item in absent if item in filter)
+        self.assertLess(false_positives, count * error_rate)
+
+    def test_bloom(self):
+        self.subtest_filter(BloomFilter(2000, 0.01))
+
+    def test_scalable_bloom(self):
+        filter = ScalableBloomFilter(100, 0.01)
+        self.subtest_filter(filter)
+        self.assertTrue(len(filter.filters) > 1)
+
+    def test_cuckoo(self):
+        filter = CuckooFilter(2000)
+        self.subtest_filter(filter)
+        self.assertTrue(filter.remove('/item:0'))
+        self.assertFalse('/item:0' in filter)
+        self.assertEqual(len(filter), 1999)
+
+        small = CuckooFilter(8, bucket_size=2, max_kicks=10)
+        added = []
+        with self.assertRaises(ValueError):
+            for i in range(0, 100):
+                small.add(str(i))
+                added.append(str(i))
+        self.assertEqual(len(small), len(added))
+        self.assertTrue(all(item in small for item in added))
+
+
+class TestBloomFilterDatastore(TestDatastore):
+    tmp = os.path.normpath('/tmp/datastore.test.membership')
+
+    def tearDown(self):
+        if os.path.exists(self.tmp):
+            shutil.rmtree(self.tmp)
+
+    def test_simple(self):
+        stores = [BloomFilterDatastore(DictDatastore()),
+                  BloomFilterDatastore(DictDatastore(),
+                                       filterfn=lambda: CuckooFilter(1000))]
+        self.subtest_simple(stores)
+
+    def test_short_circuit(self):
+        child = CountingDatastore()
+        ds = BloomFilterDatastore(child, filterfn=lambda: CuckooFilter(1000))
+        keys = [Key('/a:{}'.format(i)) for i in range(0, 100)]
+        ds.put_many([(key, i) for i, key in enumerate(keys)])
+
+        for i in range(0, 100):
+            self.assertEqual(ds.get(Key('/b:{}'.format(i))), None)
+            self.assertFalse(ds.contains(Key('/b:{}'.format(i))))
+        self.assertLess(child.reads, 10)
+        self.assertEqual(ds.get(keys[3]), 3)
+
+        ds.delete(keys[3])
+        reads = child.reads
+        self.assertEqual(ds.get(keys[3]), None)
+        self.assertEqual(child.reads, reads)
+
+    def test_overwrites_and_full_filter(self):
+        ds = BloomFilterDatastore(DictDatastore(),
+                                  filterfn=lambda: CuckooFilter(8, bucket_size=2))
+        for i in range(0, 20):
+            ds.put(Key('/a'), i)
+        self.assertEqual(len(ds.filter), 1)
+        ds.delete_many([Key('/a'), Key('/a')])
+        self.assertEqual(len(ds.filter), 0)
+        self.assertFalse(ds.contains(Key('/a')))
+
+        with self.assertRaises(ValueError):
+            ds.put_many([(Key('/b:{}'.format(i)), i) for i in range(0, 100)])
+        self.assertEqual(len(ds.filter), 0)  # the batch was not written
+        self.assertEqual(len(ds.child_datastore), 0)
+
+    def test_custom_full_filter(self):
+        class SetFilter(object):
+            """Exact filter holding at most 3 items."""
+            def __init__(self):
+                self.items = collections.Counter()
+
+            def add(self, item):
+                if len(self.items) >= 3:
+                    raise ValueError('full')
+                self.items[item] += 1
+
+            def remove(self, item):
+                self.items[item] -= 1
+                if not self.items[item]:
+                    del self.items[item]
+
+            def __contains__(self, item):
+                return item in self.items
+
+        ds = BloomFilterDatastore(DictDatastore(), filterfn=SetFilter)
+        ds.put_many([(Key('/a:{}'.format(i)), i) for i in range(0, 2)])
+        with self.assertRaises(ValueError):
+            ds.put_many([(Key('/b:0'), 0), (Key('/b:1'), 1)])
+        self.assertEqual(len(ds.filter.items), 2)  # the batch was not written
+        self.assertEqual(len(ds.child_datastore), 2)
+        ds.put(Key('/a:2'), 2)
+        with self.assertRaises(ValueError):
+            ds.rebuild([Key('/c:{}'.format(i)) for i in range(0, 4)])
+        self.assertEqual(ds.get(Key('/a:2')), 2)
+
+    def test_rebuild_and_persist(self):
+        child = CountingDatastore()
+        keys = [Key('/a:{}'.format(i)) for i in range(0, 100)]
+        child.put_many([(key, i) for i, key in enumerate(keys)])
+
+        ds = BloomFilterDatastore(child)
+        self.assertEqual(ds.get(keys[0]), None)  # written around the shim
+        ds.rebuild()
+        self.assertEqual(ds.get_many(keys[:3]), [0, 1, 2])
+
+        path = os.path.join(self.tmp, 'filter')
+        os.makedirs(self.tmp)
+        ds.save(path)
+        other = BloomFilterDatastore(child)
+        other.load(path)
+        self.assertEqual(other.contains_many(keys[:3] + [Key('/b')]),
+                         [True, True, True, False])
+
+    def test_filesystem(self):
+        fs = FileSystemDatastore(self.tmp)
+        shim = serialize.shim(fs)
+        shim.put(Key('/a:b'), 'ab')
+        shim.put(Key('/c/d'), 'cd')
+        self.assertEqual(sorted(map(str, shim.keys())), ['/a/b', '/c/d'])
+
+        ds = BloomFilterDatastore(shim, keyfn=fs.relative_path)
+        ds.rebuild()
+        self.assertTrue(ds.contains(Key('/a:b')))
+        self.assertFalse(ds.contains(Key('/a:c')))
+        self.assertEqual(ds.stats['avoided'], 1)
@@ -0,0 +1,240 @@
+import random
+import threading
+import time
+
+from datastore.core.key import Key
+from datastore.core.query import Query
+from datastore.core.memory import (SortedKeyList, SortedDictDatastore,
+                                   ConcurrentDictDatastore)
+from datastore.core.stores import DictDatastore
+
+from . import TestDatastore
+
+
+class TestSortedKeyList(TestDatastore):
+    def test_random(self):
+        rand = random.Random(0)
+        keys = SortedKeyList(load=4)
+        expected = set()
+        for i in range(0, 2000):
+            value = str(rand.randint(0, 500))
+            if value in expected:
+                keys.remove(value)
+                expected.remove(value)
+            else:
+                keys.add(value)
+                expected.add(value)
+
+        ordered = sorted(expected)
+        self.assertEqual(list(keys), ordered)
+        self.assertEqual(len(keys), len(ordered))
+        self.assertEqual(list(keys.irange('2', '3')),
+                         [v for v in ordered if '2' <= v < '3'])
+        self.assertEqual(list(keys.irange('2', '3', reverse=True)),
+                         [v for v in reversed(ordered) if '2' <= v < '3'])
+        self.assertEqual(list(keys.irange(reverse=True)), ordered[::-1])
+        self.assertEqual(keys.ceiling('25'), min(v for v in ordered if v >= '25'))
+        self.assertEqual(keys.ceiling('a'), None)
+
+    def test_modified_during_iteration(self):
+        keys = SortedKeyList(load=2)
+        for i in range(0, 20):
+            keys.add('{:02}'.format(i))
+        seen = []
+        for value in keys:
+            seen.append(value)
+            if value == '05':
+                for i in range(6, 12):
+                    keys.remove('{:02}'.format(i))
+        expected = list(range(0, 6)) + list(range(12, 20))
+        self.assertEqual(seen, ['{:02}'.format(i) for i in expected])
+
+
+class TestSortedDictDatastore(TestDatastore):
+    def populated(self):
+        ds = SortedDictDatastore(load=4)
+        keys = ['/a', '/a/b', '/a/b/c', '/a/b:1', '/a/b:2', '/a/c', '/a/c/d',
+                '/a/d:x', '/b', '/b/a', '/ab']
+        rand = random.Random(1)
+        rand.shuffle(keys)
+        for k in keys:
+            ds.put(Key(k), {'key': k})
+        return ds, sorted(keys)
+
+    def results(self, cursor):
+        return [obj['key'] for obj in cursor]
+
+    def test_simple(self):
+        self.subtest_simple([SortedDictDatastore(), SortedDictDatastore(load=8)])
+
+    def test_collections(self):
+        ds, keys = self.populated()
+        plain = DictDatastore()
+        for k in keys:
+            plain.put(Key(k), {'key': k})
+
+        for k in ['/', '/a', '/a/b', '/a/c', '/a/d', '/b', '/c']:
+            expected = sorted(self.results(plain.query(Query(Key(k)))))
+            self.assertEqual(self.results(ds.query(Query(Key(k)))), expected, k)
+
+    def test_subtree_and_prefix(self):
+        ds, keys = self.populated()
+        self.assertEqual(self.results(ds.query_subtree(Query(Key('/a')))),
+                         [k for k in keys if k.startswith('/a/')])
+        self.assertEqual(self.results(ds.query_subtree(Query(Key('/')))), keys)
+        self.assertEqual(self.results(ds.query_prefix(Query(Key('/')), '/a')),
+                         [k for k in keys if k.startswith('/a')])
+        self.assertEqual([str(k) for k, v in ds.scan(prefix='/a/b')],
+                         ['/a/b', '/a/b/c', '/a/b:1', '/a/b:2'])
+        self.assertEqual([str(k) for k, v in ds.scan(prefix='/a/b', reverse=True)],
+                         ['/a/b:2', '/a/b:1', '/a/b/c', '/a/b'])
+
+    def test_range(self):
+        ds, keys = self.populated()
+        query = Query(Key('/'))
+        self.assertEqual(self.results(ds.query_range(query, '/a/b', Key('/a/d'))),
+                         [k for k in keys if '/a/b' <= k < '/a/d'])
+        self.assertEqual(self.results(ds.query_range(query, stop='/a/b')),
+                         ['/a'])
+
+        query = Query(Key('/'), limit=2).add_filter('key', '!=', '/a/b/c')
+        self.assertEqual(self.results(ds.query_range(query, '/a/b')),
+                         ['/a/b', '/a/b:1'])
+
+    def test_key_order_and_offset_key(self):
+        ds, keys = self.populated()
+        subtree = [k for k in keys if k.startswith('/a/')]
+
+        query = Query(Key('/a')).add_order('-key')
+        self.assertEqual(self.results(ds.query_subtree(query)), subtree[::-1])
+        self.assertEqual(query.orders[0].field, 'key')  # query is unchanged
+
+        # paging with offset_key seeks past the previous page
+        pages, offset_key = [], None
+        while True:
+            page = self.results(ds.query_subtree(
+                Query(Key('/a'), limit=3, offset_key=offset_key)))
+            if not page:
+                break
+            pages.append(page)
+            offset_key = Key(page[-1])
+        self.assertEqual(sum(pages, []), subtree)
+        self.assertEqual(len(pages), 3)
+
+        query = Query(Key('/a'), offset_key=Key('/a/b:1')).add_order('-key')
+        self.assertEqual(self.results(ds.query(query)), ['/a/b'])
+        self.assertEqual(self.results(ds.query(Query(Key('/a'), offset_key=Key('/a/b')))),
+                         ['/a/c'])
+
+        # other orders still sort
+        query = Query(Key('/a/b')).add_order('-key').add_order('+key')
+        self.assertEqual(self.results(ds.query(query)), ['/a/b/c', '/a/b:1', '/a/b:2'])
+
+    def test_snapshot(self):
+        ds, keys = self.populated()
+        with ds.snapshot() as snapshot:
+            ds.delete(Key('/a/b:1'))
+            ds.put(Key('/a/b:0'), {'key': '/a/b:0'})
+            self.assertEqual(self.results(snapshot.query(Query(Key('/a/b')))),
+                             ['/a/b/c', '/a/b:1', '/a/b:2'])
+            self.assertEqual([str(k) for k in snapshot.keys()], keys)
+            self.assertEqual(self.results(ds.query(Query(Key('/a/b')))),
+                             ['/a/b/c', '/a/b:0', '/a/b:2'])
+
+    def test_delete(self):
+        ds, keys = self.populated()
+        for k in keys[::2]:
+            ds.delete(Key(k))
+        ds.delete(Key('/missing'))
+        self.assertEqual([str(k) for k in ds.keys()], keys[1::2])
+        self.assertEqual(len(ds), len(keys[1::2]))
+        self.assertTrue(ds.memory_usage() > 0)
+
+
+class TestConcurrentDictDatastore(TestDatastore):
+    def test_simple(self):
+        self.subtest_simple([ConcurrentDictDatastore(),
+                             ConcurrentDictDatastore(segments=1)])
+        with self.assertRaises(ValueError):
+            ConcurrentDictDatastore(segments=3)
+
+    def test_atomic_updates(self):
+        ds = ConcurrentDictDatastore(segments=4)
+        keys = [Key('/counter:{}'.format(i)) for i in range(0, 8)]
+
+        def increment():
+            for i in range(0, 500):
+                for key in keys:
+                    ds.update(key, lambda value: (value or 0) + 1)
+
+        workers = [threading.Thread(target=increment) for i in range(0, 8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(ds.get_many(keys), [4000] * 8)
+
+        self.assertEqual(ds.put_if_absent(keys[0], 0), 4000)
+        self.assertEqual(ds.put_if_absent(Key('/new'), 1), None)
+        self.assertEqual(ds.get(Key('/new')), 1)
+        ds.update(Key('/new'), lambda value: None)
+        self.assertFalse(ds.contains(Key('/new')))
+
+    def test_query_during_writes(self):
+        ds = ConcurrentDictDatastore()
+        stop = threading.Event()
+
+        def write():
+            i = 0
+            while not stop.is_set():
+                ds.put(Key('/items/item:{}'.format(i % 100)), i)
+                ds.delete(Key('/items/item:{}'.format((i + 50) % 100)))
+                i += 1
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            for i in range(0, 50):
+                values = list(ds.query(Query(Key('/items/item'))))
+                self.assertTrue(all(value is not None for value in values))
+                self.assertTrue(len(ds.keys()) <= 100)
+        finally:
+            stop.set()
+            writer.join()
+
+    def test_snapshot(self):
+        ds = ConcurrentDictDatastore(segments=4)
+        keys = [Key('/items/item:{}'.format(i)) for i in range(0, 100)]
+        ds.put_many([(key, 0) for key in keys])
+        stop = threading.Event()
+
+        def write():
+            generation = 0
+            while not stop.is_set():
+                generation += 1
+                ds.put_many([(key, generation) for key in keys])
+                ds.delete(keys[generation % 100])
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            for i in range(0, 20):
+                with ds.snapshot() as snapshot:
+                    values = snapshot.get_many(keys)
+                    query = sorted(snapshot.query(Query(Key('/items/item'))))
+                    time.sleep(0.002)  # the writer keeps changing objects
+                    self.assertEqual(snapshot.get_many(keys), values)
+                    self.assertEqual(sorted(v for v in values if v is not None), query)
+                    self.assertEqual(len(snapshot), len(query))
+        finally:
+            stop.set()
+            writer.join()
+
+        with self.assertRaises(TypeError):
+            snapshot.delete(keys[0])
+
+    def test_benchmark(self):
+        from datastore.core import benchmark
+        results = benchmark.benchmark_concurrency((1, 2), operations=1000)
+        self.assertEqual([threads for threads, s, l in results], [1, 2])
+        self.assertTrue(all(s > 0 and l > 0 for threads, s, l in results))
@@ -0,0 +1,146 @@
+import os
+import shutil
+import threading
+import time
+
+from datastore.core.key import Key
+from datastore.core.query import Query
+from datastore.core.persistent import PersistentDatastore
+from datastore.core.stores import DictDatastore
+from datastore.core.memory import SortedDictDatastore
+
+from . import TestDatastore
+
+
+class TestPersistentDatastore(TestDatastore):
+    tmp = os.path.normpath('/tmp/datastore.test.persistent')
+
+    def setUp(self):
+        if os.path.exists(self.tmp):
+            shutil.rmtree(self.tmp)
+
+    def tearDown(self):
+        if os.path.exists(self.tmp):
+            shutil.rmtree(self.tmp)
+
+    def open(self, **kwargs):
+        kwargs.setdefault('background', False)
+        return PersistentDatastore(DictDatastore(), self.tmp, **kwargs)
+
+    def files(self):
+        return sorted(os.listdir(self.tmp))
+
+    def test_simple(self):
+        ds = self.open(sync='os')
+        self.subtest_simple([ds])
+        ds.close()
+        with self.assertRaises(RuntimeError):
+            ds.put(Key('/a'), 1)
+        with self.assertRaises(ValueError):
+            self.open(sync='never')
+
+    def test_reopen(self):
+        ds = self.open(sync='always')
+        for i in range(0, 10):
+            ds.put(Key('/a/b:{}'.format(i)), {'n': i})
+        ds.delete(Key('/a/b:3'))
+        ds.put_many([(Key('/a/b:4'), None), (Key('/a/b:10'), {'n': 10})])
+        ds.delete_many([Key('/a/b:5')])
+        self.assertEqual(ds.stats['syncs'], 13)
+        ds.close()
+
+        ds = self.open()
+        self.assertEqual(ds.stats['replayed'], 14)
+        self.assertEqual(sorted(v['n'] for v in ds.query(Query(Key('/a/b')))),
+                         [0, 1, 2, 6, 7, 8, 9, 10])
+        ds.close()
+
+    def test_checkpoint(self):
+        ds = self.open()
+        ds.put_many([(Key('/a:{}'.format(i)), i) for i in range(0, 100)])
+        ds.checkpoint()
+        ds.put(Key('/a:0'), 'after')
+        ds.delete(Key('/a:1'))
+        self.assertEqual(self.files(), ['log.1', 'snapshot.1'])
+        ds.close()
+
+        ds = self.open()
+        self.assertEqual(ds.stats['loaded'], 100)
+        self.assertEqual(ds.stats['replayed'], 2)
+        self.assertEqual(ds.get(Key('/a:0')), 'after')
+        self.assertEqual(ds.get(Key('/a:1')), None)
+        self.assertEqual(len(ds.child_datastore), 99)
+        ds.checkpoint()
+        self.assertEqual(self.files(), ['log.3', 'snapshot.3'])
+        ds.close()
+
+    def test_stale_snapshot_tmp(self):
+        ds = self.open()
+        ds.put(Key('/a'), 1)
+        ds.close()
+        with open(os.path.join(self.tmp, 'snapshot.1.tmp'), 'wb') as f:
+            f.write(b'\x20\x00\x00')  # a crash mid-snapshot
+
+        ds = self.open()
+        self.assertEqual(ds.get(Key('/a')), 1)
+        self.assertFalse('snapshot.1.tmp' in self.files())
+        ds.close()
+
+    def test_torn_tail(self):
+        ds = self.open(sync='os')
+        ds.put(Key('/a'), 1)
+        ds.put(Key('/b'), 2)
+        ds.close()
+        with open(os.path.join(self.tmp, 'log.0'), 'ab') as f:
+            f.write(b'\x20\x00\x00\x00\x00\x00')  # a crash mid-record
+
+        ds = self.open()
+        self.assertEqual(ds.get_many([Key('/a'), Key('/b')]), [1, 2])
+        ds.put(Key('/c'), 3)
+        ds.close()
+
+        ds = self.open()
+        self.assertEqual(ds.get_many([Key('/a'), Key('/b'), Key('/c')]), [1, 2, 3])
+        ds.close()
+
+    def test_background(self):
+        ds = self.open(sync=0.01, snapshot_records=50, background=True)
+        ds.put_many([(Key('/a:{}'.format(i)), i) for i in range(0, 60)])
+        for i in range(0, 200):
+            if ds.stats['snapshots']:
+                break
+            time.sleep(0.01)
+        self.assertEqual(ds.stats['snapshots'], 1)
+        self.assertTrue(ds.stats['syncs'] >= 1)
+        ds.close()
+
+        ds = self.open()
+        self.assertEqual(ds.stats['loaded'], 60)
+        ds.close()
+
+    def test_checkpoint_during_writes(self):
+        ds = PersistentDatastore(SortedDictDatastore(), self.tmp, sync='os',
+                                 background=False)
+        stop = threading.Event()
+
+        def write():
+            i = 0
+            while not stop.is_set():
+                ds.put(Key('/a:{}'.format(i % 500)), i)
+                i += 1
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            for i in range(0, 3):
+                ds.checkpoint()
+        finally:
+            stop.set()
+            writer.join()
+        expected = dict((str(k), ds.get(k)) for k in ds.child_datastore.keys())
+        ds.close()
+
+        ds = PersistentDatastore(SortedDictDatastore(), self.tmp, background=False)
+        self.assertEqual(dict((str(k), ds.get(k)) for k in ds.child_datastore.keys()),
+                         expected)
+        ds.close()
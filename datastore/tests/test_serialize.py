@@ -3,17 +3,26 @@ import unittest
 import json
 
 from datastore.core.key import Key
+from datastore.core.query import Query
 from datastore.core.stores import DictDatastore
 from datastore.core.serialize import (default_serializer, Serializer,
                                       NonSerializer, prettyjson, Stack,
-                                      MapSerializer, serialized_gen,
-                                      deserialized_gen, monkey_patch_bson,
+                                      MapSerializer, PickleSerializer,
+                                      MarshalSerializer, TaggedSerializer,
+                                      ZlibSerializer, Bz2Serializer,
+                                      LzmaSerializer, train_dictionary,
+                                      serialized_gen, deserialized_gen,
+                                      loads_many, dumps_many,
+                                      monkey_patch_bson, DeserializedCache,
+                                      LazyValue, StructSerializer, Record,
                                       SerializerShimDatastore)
+from datastore.core import benchmark
 
 from . import TestDatastore
 
 import pickle
 import bson
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 monkey_patch_bson(bson)
 
@@ -96,12 +105,261 @@ class TestSerialize(TestDatastore):
         self.subtest_serializer_shim(MapSerializer)
         self.subtest_serializer_shim(bson)
         self.subtest_serializer_shim(default_serializer)  # module default
+        self.subtest_serializer_shim(PickleSerializer)
+        self.subtest_serializer_shim(MarshalSerializer)
+        self.subtest_serializer_shim(TaggedSerializer)
 
         self.subtest_serializer_shim(Stack([MapSerializer]))
         self.subtest_serializer_shim(Stack([MapSerializer, bson]))
         self.subtest_serializer_shim(Stack([json, MapSerializer, bson]))
         self.subtest_serializer_shim(Stack([json, MapSerializer, bson,
                                             pickle]))
+        self.subtest_serializer_shim(Stack([json, ZlibSerializer(threshold=0)]))
+        self.subtest_serializer_shim(Stack([PickleSerializer, Bz2Serializer()]))
+        self.subtest_serializer_shim(Stack([TaggedSerializer, LzmaSerializer()]))
+
+    def test_binary_serializers(self):
+        values = [None, True, False, 0, -1, 1 << 70, -(1 << 70), 0.5, -1e300,
+                  '', 'text', u'\u00fcnic\u00f6de', b'\x00raw', [], [1, 'a'],
+                  {}, {'a': {'b': [1, 2.5, None]}, 'c': True}]
+        for serializer in [PickleSerializer, MarshalSerializer,
+                           TaggedSerializer]:
+            for value in values:
+                serialized = serializer.dumps(value)
+                self.assertTrue(isinstance(serialized, bytes))
+                self.assertEqual(serializer.loads(serialized), value)
+
+        # tuples come back as lists, and unknown types are rejected.
+        self.assertEqual(TaggedSerializer.loads(TaggedSerializer.dumps((1,))), [1])
+        self.assertRaises(TypeError, TaggedSerializer.dumps, object())
+        self.assertRaises(ValueError, TaggedSerializer.loads, b'?')
+
+        # tagged is more compact than json on plain records.
+        record = benchmark.representative_records(1)[0]
+        self.assertTrue(len(TaggedSerializer.dumps(record)) <
+                        len(json.dumps(record)))
+
+    def test_compression(self):
+        records = benchmark.representative_records(200)
+        large = json.dumps(records)
+        samples = [json.dumps(r) for r in records]
+
+        for compressor in [ZlibSerializer(), Bz2Serializer(), LzmaSerializer()]:
+            # tiny values are stored raw behind a one byte header.
+            self.assertEqual(compressor.dumps(b'tiny'), b'\x00tiny')
+            self.assertEqual(compressor.loads(b'\x00tiny'), b'tiny')
+            self.assertEqual(compressor.loads(compressor.dumps('tiny')), 'tiny')
+
+            # large repetitive values shrink, and text stays text.
+            compressed = compressor.dumps(large)
+            self.assertTrue(len(compressed) < len(large) / 3)
+            self.assertEqual(compressor.loads(compressed), large)
+            raw = large.encode('utf-8')
+            self.assertEqual(compressor.loads(compressor.dumps(raw)), raw)
+
+        # a trained dictionary helps small, similar values.
+        zdict = train_dictionary(samples[:100], size=4096)
+        self.assertTrue(0 < len(zdict) <= 4096)
+        plain = ZlibSerializer(threshold=0)
+        trained = ZlibSerializer(threshold=0, zdict=zdict)
+        plain_size = sum(len(plain.dumps(s)) for s in samples[100:])
+        trained_size = sum(len(trained.dumps(s)) for s in samples[100:])
+        self.assertTrue(trained_size < plain_size)
+        for sample in samples[100:]:
+            self.assertEqual(trained.loads(trained.dumps(sample)), sample)
+
+    def test_batch(self):
+        values_raw = [{'value': i} for i in range(0, 1000)]
+        serializers = [json, prettyjson, pickle, PickleSerializer,
+                       Stack([json, ZlibSerializer(threshold=0)])]
+
+        for serializer in serializers:
+            serialized = dumps_many(serializer, values_raw)
+            self.assertEqual(serialized, [serializer.dumps(v) for v in values_raw])
+            self.assertEqual(loads_many(serializer, serialized), values_raw)
+
+        # json values holding more than one document are rejected.
+        self.assertRaises(ValueError, loads_many, json, ['1, 2', '3'])
+
+        # pages and executors keep the order of results.
+        serialized = dumps_many(json, values_raw)
+        with ThreadPoolExecutor(2) as threads:
+            for pagesize, executor in [(7, None), (None, threads), (64, threads)]:
+                self.assertEqual(list(deserialized_gen(json, serialized,
+                    pagesize, executor)), values_raw)
+                self.assertEqual(list(serialized_gen(json, values_raw,
+                    pagesize, executor)), serialized)
+
+        stack = Stack([json, ZlibSerializer(threshold=0)])
+        with ProcessPoolExecutor(2) as processes:
+            serialized = list(serialized_gen(stack, values_raw, 100, processes))
+            self.assertEqual(list(deserialized_gen(stack, serialized, 100,
+                processes)), values_raw)
+
+    def test_parallel_query(self):
+        child = DictDatastore()
+        with ProcessPoolExecutor(2) as processes:
+            shim = SerializerShimDatastore(child, pagesize=10,
+                                           executor=processes)
+            self.subtest_simple([shim], numelems=99)
+
+            key = Key('/parallel')
+            for i in range(0, 100):
+                shim.put(key.child(i), {'value': i})
+            results = list(shim.query(Query(key)))
+            self.assertEqual(sorted(r['value'] for r in results), list(range(100)))
+
+    def test_deserialized_cache(self):
+        calls = []
+
+        def loads(value):
+            calls.append(value)
+            return json.loads(value)
+
+        serializer = Stack([json])
+        serializer.loads = loads
+        cache = DeserializedCache(size=2)
+        shim = SerializerShimDatastore(DictDatastore(), serializer=serializer,
+                                       cache=cache)
+        self.subtest_simple([shim], numelems=30)
+
+        del calls[:]
+        cache.clear()
+        cache.stats.clear()
+        a, b, c = Key('/a'), Key('/b'), Key('/c')
+        shim.put(a, {'a': [1]})
+        self.assertEqual(shim.get(a), {'a': [1]})
+        self.assertEqual(shim.get(a), {'a': [1]})
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.hit_rate, 0.5)
+
+        # copies are handed out, so callers cannot corrupt the cache.
+        shim.get(a)['a'].append(2)
+        self.assertEqual(shim.get(a), {'a': [1]})
+
+        # puts through the shim and the child both invalidate.
+        shim.put(a, {'a': 2})
+        self.assertEqual(shim.get(a), {'a': 2})
+        shim.child_datastore.put(a, json.dumps({'a': 3}))
+        self.assertEqual(shim.get(a), {'a': 3})
+        shim.delete(a)
+        self.assertEqual(shim.get(a), None)
+        self.assertEqual(len(cache), 0)
+
+        # bounded size.
+        for key in [a, b, c]:
+            shim.put(key, {'v': str(key)})
+            shim.get(key)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats['evictions'], 1)
+
+        frozen = DeserializedCache(mode='freeze')
+        value = frozen.loads(a, json.dumps({'a': [1]}), json.loads)
+        self.assertEqual(value['a'], (1,))
+        with self.assertRaises(TypeError):
+            value['b'] = 1
+        self.assertTrue(frozen.loads(a, json.dumps({'a': [1]}), json.loads)
+                        is value)
+        self.assertRaises(ValueError, DeserializedCache, mode='bogus')
+
+    def test_filtered_query(self):
+        key = Key('/records')
+        records = benchmark.representative_records(100)
+        serializers = [json, TaggedSerializer,
+                       Stack([TaggedSerializer, ZlibSerializer(0)])]
+
+        expected = sorted(r['count'] for r in records if r['count'] < 1 << 18)
+        for serializer in serializers:
+            for lazy in [False, True]:
+                shim = SerializerShimDatastore(DictDatastore(), serializer,
+                                               lazy=lazy)
+                for i, record in enumerate(records):
+                    shim.put(key.child(i), record)
+
+                query = Query(key).add_filter('count', '<', 1 << 18)
+                query.add_order('+count')
+                results = list(shim.query(query))
+                self.assertEqual([r['count'] for r in results], expected)
+
+                query = Query(key, limit=3).add_filter('active', '=', True)
+                self.assertEqual(len(list(shim.query(query))), 3)
+
+        # rejected values are never fully decoded with field support.
+        shim = SerializerShimDatastore(DictDatastore(), TaggedSerializer,
+                                       lazy=True)
+        for i, record in enumerate(records):
+            shim.put(key.child(i), record)
+        query = Query(key).add_filter('count', '<', 1 << 18)
+        cursor = shim.child_datastore.query(Query(key))
+        proxies = [LazyValue(TaggedSerializer, v) for v in cursor]
+        passed = list(query(proxies))
+        self.assertEqual(len(passed), len(expected))
+        self.assertFalse(any(p.loaded for p in proxies))
+        self.assertEqual(passed[0].value, passed[0])
+        self.assertTrue(passed[0].loaded)
+
+        # proxies without field support decode once, on first use.
+        proxy = LazyValue(json, json.dumps({'a': 1}))
+        self.assertFalse(proxy.loaded)
+        self.assertTrue('a' in proxy)
+        self.assertTrue(proxy.loaded)
+        self.assertEqual(proxy.get('b', 2), 2)
+        self.assertEqual(list(proxy.keys()), ['a'])
+
+    def test_struct(self):
+        records, schema = benchmark.metric_records(50)
+        serializer = StructSerializer(schema, name='Metric')
+
+        for record in records:
+            packed = serializer.dumps(record)
+            self.assertTrue(isinstance(packed, bytes))
+            self.assertTrue(len(packed) < len(json.dumps(record)))
+            loaded = serializer.loads(packed)
+            self.assertTrue(isinstance(loaded, Record))
+            self.assertEqual(loaded, record)
+            self.assertEqual(loaded.host, record['host'])
+            self.assertEqual(loaded['value'], record['value'])
+            self.assertEqual(serializer.dumps(loaded), packed)
+            self.assertEqual(serializer.loads_field(packed, 'metric'),
+                             record['metric'])
+            self.assertRaises(KeyError, serializer.loads_field, packed, 'bogus')
+
+        self.assertEqual(type(loaded).__name__, 'Metric')
+        self.assertFalse(hasattr(loaded, '__dict__'))
+
+        # tuples, sequences and bytes fields.
+        serializer = StructSerializer([('a', 'H'), ('b', 'bytes'), ('c', '?')],
+                                      tuples=True)
+        self.assertEqual(serializer.loads(serializer.dumps((7, b'\x00', True))),
+                         (7, b'\x00', True))
+        self.assertRaises(ValueError, serializer.dumps, (1, b''))
+        self.assertRaises(ValueError, StructSerializer, [('a', 'bogus')])
+
+        # stacks with compression, and shims (with lazy field decoding).
+        serializer = Stack([StructSerializer(schema), ZlibSerializer(0)])
+        shim = SerializerShimDatastore(DictDatastore(), serializer,
+                                       lazy=True, check=False)
+        key = Key('/metrics')
+        for i, record in enumerate(records):
+            shim.put(key.child(i), record)
+        self.assertEqual(shim.get(key.child(3)), records[3])
+        query = Query(key).add_filter('metric', '=', 'cpu')
+        results = list(shim.query(query))
+        self.assertEqual(len(results),
+                         len([r for r in records if r['metric'] == 'cpu']))
+        self.assertRaises(KeyError, SerializerShimDatastore,
+                          DictDatastore(), StructSerializer(schema))
+
+    def test_benchmark(self):
+        records = benchmark.representative_records(20)
+        results = benchmark.benchmark_serializers(records=records, repeat=1)
+        names = [name for name, result in results]
+        self.assertEqual(names, [n for n, s in benchmark.default_serializers()])
+        for name, result in results:
+            self.assertTrue(result['loads_per_sec'] > 0)
+            self.assertTrue(result['bytes_per_record'] > 0)
+        self.assertTrue(benchmark.fastest(results) in names)
+        self.assertTrue('tagged' in benchmark.format_results(results))
 
     def test_has_interface_check(self):
         self.assertTrue(hasattr(Serializer, 'implements_serializer_interface'))
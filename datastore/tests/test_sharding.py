@@ -0,0 +1,206 @@
+import threading
+import unittest
+
+from datastore.core.key import Key
+from datastore.core.query import Query
+from datastore.core.sharding import (Modulo, ConsistentHashRing, JumpHash,
+                                     Rendezvous, ShardRouter)
+from datastore.core.stores import DictDatastore, ShardedDatastore
+
+from . import TestDatastore
+
+
+def placements():
+    return [Modulo(), ConsistentHashRing(), JumpHash(), Rendezvous()]
+
+
+class TestPlacements(unittest.TestCase):
+    keys = [Key('/item:{}'.format(i)) for i in range(0, 9000)]
+
+    def routes(self, router):
+        return [router.shard(key) for key in self.keys]
+
+    def test_balance(self):
+        for placement in placements():
+            router = ShardRouter(placement=placement)
+            for i in range(0, 8):
+                router.insert(i)
+            counts = [0] * 8
+            for shard in self.routes(router):
+                counts[shard] += 1
+            self.assertTrue(min(counts) > len(self.keys) / 8 * 0.7,
+                            (placement, counts))
+
+    def test_growth_moves_one_ninth(self):
+        for placement in placements()[1:]:
+            router = ShardRouter(placement=placement)
+            for i in range(0, 8):
+                router.insert(i)
+            before = self.routes(router)
+            router.insert(8)
+            after = self.routes(router)
+
+            moved = [a for b, a in zip(before, after) if a != b]
+            self.assertTrue(all(shard == 8 for shard in moved), placement)
+            self.assertAlmostEqual(len(moved) / float(len(self.keys)), 1 / 9.0,
+                                   delta=0.04, msg=placement)
+
+        # modulo moves almost everything
+        router = ShardRouter()
+        for i in range(0, 8):
+            router.insert(i)
+        before = self.routes(router)
+        router.insert(8)
+        moved = sum(1 for b, a in zip(before, self.routes(router)) if a != b)
+        self.assertTrue(moved > len(self.keys) * 0.8)
+
+    def test_removal_by_name(self):
+        for placement in [ConsistentHashRing(), Rendezvous()]:
+            router = ShardRouter(placement=placement)
+            for i in range(0, 5):
+                router.insert(i, name='node{}'.format(i))
+            before = [router.names[s] for s in self.routes(router)]
+            router.remove(2)
+            after = [router.names[s] for s in self.routes(router)]
+            for b, a in zip(before, after):
+                if b != 'node2':
+                    self.assertEqual(a, b)
+
+    def test_weights(self):
+        for placement in [ConsistentHashRing(), Rendezvous()]:
+            router = ShardRouter(placement=placement)
+            router.insert(0, weight=1)
+            router.insert(1, weight=3)
+            heavy = sum(self.routes(router))
+            self.assertAlmostEqual(heavy / float(len(self.keys)), 0.75,
+                                   delta=0.05, msg=placement)
+
+        with self.assertRaises(ValueError):
+            router.insert(2, name=router.names[0])
+
+
+class TestShardedPlacement(TestDatastore):
+    def test_simple(self):
+        stores = [ShardedDatastore([DictDatastore() for i in range(0, 4)],
+                                   placement=placement)
+                  for placement in placements()]
+        self.subtest_simple(stores)
+
+    def test_reconfigure(self):
+        shards = [DictDatastore() for i in range(0, 3)]
+        ds = ShardedDatastore(shards, placement=ConsistentHashRing())
+        key = Key('/a')
+        ds.put(key, 1)
+        owner = ds.shard(key)
+        self.assertEqual(ds.names, ['shard:0', 'shard:1', 'shard:2'])
+
+        ds.removeDatastore(shards[owner])
+        self.assertEqual(len(ds.names), 2)
+        self.assertEqual(ds.get(key), None)  # the route was recomputed
+        ds.appendDatastore(shards[owner], name='returning')
+        self.assertEqual(ds.names[-1], 'returning')
+
+
+class TestRebalancer(TestDatastore):
+    keys = [Key('/item:{}'.format(i)) for i in range(0, 900)]
+
+    def populated(self, count=8, placement=None):
+        shards = [DictDatastore() for i in range(0, count)]
+        ds = ShardedDatastore(shards, placement=placement or ConsistentHashRing())
+        ds.put_many([(key, {'n': i}) for i, key in enumerate(self.keys)])
+        return shards, ds
+
+    def assertPlaced(self, ds):
+        for key in self.keys:
+            for index, store in enumerate(ds._stores):
+                self.assertEqual(store.contains(key), index == ds.shard(key))
+
+    def test_grow(self):
+        shards, ds = self.populated()
+        rebalancer = ds.reshard(shards + [DictDatastore()], batch_size=10)
+        self.assertTrue(ds.resharding)
+        self.assertEqual(ds.names[-1], 'shard:8')
+
+        # reads fall back to previous shards until objects are moved
+        self.assertEqual(ds.get_many(self.keys), [{'n': i} for i in range(0, 900)])
+        self.assertTrue(all(ds.contains_many(self.keys)))
+        self.assertEqual(len(list(ds.query(Query(Key('/item'))))), 900)
+        ds.put(self.keys[0], {'n': -1})
+        ds.delete(self.keys[1])
+
+        rebalancer.run()
+        self.assertFalse(ds.resharding)
+        self.assertAlmostEqual(rebalancer.stats['moved'] / 900.0, 1 / 9.0, delta=0.04)
+        self.assertEqual(rebalancer.stats['scanned'], 899)  # one was deleted
+        self.assertEqual(ds.get(self.keys[0]), {'n': -1})
+        self.assertEqual(ds.get(self.keys[1]), None)
+        self.keys = self.keys[:1] + self.keys[2:]
+        self.assertPlaced(ds)
+
+    def test_reads_during_rebalance(self):
+        class MovingDatastore(DictDatastore):
+            """Runs `hook` (once) after answering a read."""
+            hook = None
+
+            def _answer(self, result):
+                hook, MovingDatastore.hook = MovingDatastore.hook, None
+                if hook is not None:
+                    hook()
+                return result
+
+            def get(self, key):
+                return self._answer(super(MovingDatastore, self).get(key))
+
+            def contains(self, key):
+                return self._answer(super(MovingDatastore, self).contains(key))
+
+            def get_many(self, keys):
+                return self._answer(super(MovingDatastore, self).get_many(keys))
+
+            def contains_many(self, keys):
+                return self._answer(super(MovingDatastore, self).contains_many(keys))
+
+        reads = [lambda ds, key: ds.get(key),
+                 lambda ds, key: ds.contains(key),
+                 lambda ds, key: ds.get_many([key])[0],
+                 lambda ds, key: ds.contains_many([key])[0]]
+        for read in reads:
+            shards = [DictDatastore() for i in range(0, 4)]
+            ds = ShardedDatastore(shards, placement=Modulo())
+            ds.put_many([(key, {'n': i}) for i, key in enumerate(self.keys)])
+            new = MovingDatastore()
+            rebalancer = ds.reshard(shards + [new])
+            key = next(key for key in self.keys if ds.shardDatastore(key) is new)
+
+            # the object moves after the reader misses it on its new shard,
+            # and before it looks on the previous one.
+            def move():
+                mover = threading.Thread(target=rebalancer.run)
+                mover.start()
+                mover.join()
+            MovingDatastore.hook = move
+            self.assertTrue(read(ds, key))
+            self.assertFalse(ds.resharding)
+
+    def test_placement_change(self):
+        shards, ds = self.populated(4, placement=Modulo())
+        ds.reshard(placement=JumpHash(), workers=2, rate=100000).run()
+        self.assertTrue(isinstance(ds.placement, JumpHash))
+        self.assertEqual(len(ds.get_many(self.keys)), 900)
+        self.assertPlaced(ds)
+        with self.assertRaises(RuntimeError):
+            ds.reshard()
+            ds.reshard()
+
+    def test_checkpoint(self):
+        shards, ds = self.populated(4)
+        checkpoint = DictDatastore()
+        rebalancer = ds.reshard(shards[:3], checkpoint=checkpoint)
+        checkpoint.put(rebalancer.checkpoint_key, {'done': ['shard:0', 'shard:1']})
+        remaining = len(shards[2]) + len(shards[3])
+
+        rebalancer.run()
+        self.assertEqual(checkpoint.get(rebalancer.checkpoint_key), None)
+        self.assertEqual(rebalancer.stats['scanned'], remaining)
+        self.assertEqual(len(shards[3]), 0)
+        self.assertEqual(ds.get_many(self.keys), [{'n': i} for i in range(0, 900)])
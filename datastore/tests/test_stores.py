@@ -1,4 +1,5 @@
 import logging
+import time
 
 from datastore.core.stores import DictDatastore
 from datastore.core.key import Key
@@ -16,6 +17,106 @@ class TestDictionaryDatastore(TestDatastore):
 
         self.subtest_simple(stores)
 
+    def test_partitions(self):
+        ds = DictDatastore()
+        ds.put(Key('/a/b:1'), 1)
+        ds.put(Key('/a/b:2'), 2)
+        ds.put(Key('/a/c'), 3)
+        self.assertEqual(sorted(ds._partitions), ['/a', '/a/b'])
+        self.assertEqual(list(ds.query(Query(Key('/a/b')))), [1, 2])
+        self.assertEqual(list(ds.query(Query(Key('/a')))), [3])
+
+        # reads of missing keys allocate nothing
+        usage = ds.memory_usage()
+        for i in range(0, 100):
+            self.assertEqual(ds.get(Key('/x/y:{}'.format(i))), None)
+            self.assertFalse(ds.contains(Key('/x:{}'.format(i))))
+        self.assertEqual(ds.get_many([Key('/x/z')]), [None])
+        self.assertEqual(ds.memory_usage(), usage)
+
+        ds.delete(Key('/a/c'))
+        ds.delete(Key('/a/c'))
+        self.assertEqual(sorted(ds._partitions), ['/a/b'])
+        self.assertEqual(sorted(ds.keys()), [Key('/a/b:1'), Key('/a/b:2')])
+        self.assertTrue(ds.memory_usage() < usage)
+
+    def test_snapshot(self):
+        import gc
+        ds = DictDatastore()
+        for i in range(0, 5):
+            ds.put(Key('/a/b:{}'.format(i)), i)
+
+        snapshot = ds.snapshot()
+        ds.put(Key('/a/b:0'), 'changed')
+        ds.put(Key('/a/b:0'), 'changed again')
+        ds.delete(Key('/a/b:1'))
+        ds.put(Key('/a/b:5'), 5)
+        ds.put_many([(Key('/a/b:2'), 'changed'), (Key('/a/b:6'), 6)])
+
+        self.assertEqual(snapshot.get(Key('/a/b:0')), 0)
+        self.assertEqual(snapshot.get_many([Key('/a/b:1'), Key('/a/b:2')]), [1, 2])
+        self.assertTrue(snapshot.contains(Key('/a/b:1')))
+        self.assertFalse(snapshot.contains(Key('/a/b:5')))
+        self.assertEqual(sorted(snapshot.query(Query(Key('/a/b')))), [0, 1, 2, 3, 4])
+        self.assertEqual(len(snapshot), 5)
+        self.assertEqual(len(snapshot._before), 5)  # only changed keys
+        with self.assertRaises(TypeError):
+            snapshot.put(Key('/a/b:0'), 1)
+
+        self.assertEqual(ds.get(Key('/a/b:0')), 'changed again')
+        self.assertEqual(len(ds), 6)
+
+        with ds.snapshot() as other:
+            ds.delete(Key('/a/b:5'))
+            self.assertEqual(other.get(Key('/a/b:5')), 5)
+            self.assertEqual(snapshot.get(Key('/a/b:5')), None)
+        self.assertEqual(len(ds._snapshots), 1)
+
+        del snapshot
+        gc.collect()
+        self.assertEqual(ds._snapshots, ())
+
+    def test_benchmark(self):
+        from datastore.core import benchmark
+        results = benchmark.benchmark_datastore(DictDatastore(), 1000, chunk=300)
+        for name in ['put', 'get', 'get_miss', 'contains']:
+            self.assertTrue(results[name + '_per_sec'] > 0)
+        self.assertTrue(results['bytes_per_entry'] > 0)
+
+
+class TestShimDatastore(TestDatastore):
+    def test_batch(self):
+        import json
+        from datastore.core.stores import ShimDatastore
+
+        class JSONDatastore(ShimDatastore):
+            def get(self, key):
+                value = self.child_datastore.get(key)
+                return None if value is None else json.loads(value)
+
+            def put(self, key, value):
+                self.child_datastore.put(key, json.dumps(value))
+
+        class CountingDatastore(DictDatastore):
+            batches = 0
+
+            def get_many(self, keys):
+                self.batches += 1
+                return super(CountingDatastore, self).get_many(keys)
+
+        child = CountingDatastore()
+        ds = JSONDatastore(child)
+        ds.put_many([(Key('/a'), [1]), (Key('/b'), {'b': 2})])
+        self.assertEqual(child.get(Key('/a')), '[1]')
+        self.assertEqual(ds.get_many([Key('/a'), Key('/b'), Key('/c')]),
+                         [[1], {'b': 2}, None])
+        self.assertEqual(child.batches, 0)  # the overridden get was used
+
+        # shims without per key work still pass batches to the child
+        plain = ShimDatastore(child)
+        self.assertEqual(plain.get_many([Key('/a')]), ['[1]'])
+        self.assertEqual(child.batches, 1)
+
 
 class TestCacheShimDatastore(TestDatastore):
     def test_simple(self):
@@ -35,7 +136,213 @@ class TestCacheShimDatastore(TestDatastore):
         # make sure the cache works in tandem
         s3 = CacheShimDatastore(DictDatastore(), cache=DictDatastore())
 
-        self.subtest_simple([s1, s2, s3])
+        # make sure negative caching follows writes
+        s4 = CacheShimDatastore(DictDatastore(), cache=DictDatastore(),
+                                negative_size=100)
+
+        self.subtest_simple([s1, s2, s3, s4])
+
+    def test_read_through(self):
+        from datastore.core.stores import CacheShimDatastore
+
+        child = DictDatastore()
+        cache = DictDatastore()
+        shim = CacheShimDatastore(child, cache=cache)
+        keys = [Key(str(i)) for i in range(0, 4)]
+        child.put_many([(key, i) for i, key in enumerate(keys)])
+
+        self.assertEqual(shim.get(keys[0]), 0)
+        self.assertEqual(cache.get(keys[0]), 0)
+        self.assertEqual(shim.get(keys[0]), 0)
+        self.assertEqual(shim.get_many(keys), [0, 1, 2, 3])
+        self.assertEqual(len(cache), 4)
+        self.assertEqual(shim.stats['fills'], 4)
+        self.assertEqual(shim.stats['hits'], 2)
+        self.assertEqual(shim.avoided, 2)
+
+    def test_contains_read_through(self):
+        from datastore.core.stores import CacheShimDatastore
+
+        class CountingDatastore(DictDatastore):
+            reads = 0
+
+            def get(self, key):
+                self.reads += 1
+                return super(CountingDatastore, self).get(key)
+
+            def contains(self, key):
+                self.reads += 1
+                return super(CountingDatastore, self).contains(key)
+
+        child = CountingDatastore()
+        shim = CacheShimDatastore(child, cache=DictDatastore())
+        keys = [Key(str(i)) for i in range(0, 4)]
+        child.put_many([(key, i) for i, key in enumerate(keys)])
+
+        for _ in range(0, 3):
+            self.assertTrue(shim.contains(keys[0]))
+        self.assertEqual(child.reads, 1)
+        self.assertIs(shim.contains(Key('absent')), False)
+        self.assertEqual(shim.contains_many(keys), [True] * 4)
+        self.assertEqual(shim.contains_many(keys), [True] * 4)
+        self.assertEqual(shim.get(keys[3]), 3)
+        self.assertEqual(child.reads, 2)
+        self.assertEqual(shim.stats['fills'], 4)
+
+    def test_negative(self):
+        from datastore.core.stores import CacheShimDatastore
+
+        class CountingDatastore(DictDatastore):
+            reads = 0
+
+            def get(self, key):
+                self.reads += 1
+                return super(CountingDatastore, self).get(key)
+
+            def contains(self, key):
+                self.reads += 1
+                return super(CountingDatastore, self).contains(key)
+
+        child = CountingDatastore()
+        shim = CacheShimDatastore(child, cache=DictDatastore(),
+                                  negative_size=2, negative_ttl=60)
+        a, b, c = Key('a'), Key('b'), Key('c')
+
+        self.assertEqual(shim.get(a), None)
+        self.assertEqual(shim.get(a), None)
+        self.assertFalse(shim.contains(a))
+        self.assertEqual(child.reads, 1)
+        self.assertEqual(shim.stats['negative_hits'], 2)
+
+        shim.put(a, 1)
+        self.assertEqual(shim.get(a), 1)
+        shim.delete(a)
+        self.assertFalse(shim.contains(a))
+        self.assertEqual(child.reads, 1)
+
+        # bounded: remembering b and c displaces a
+        shim.get(b)
+        shim.get(c)
+        self.assertFalse(shim.contains(a))
+        self.assertEqual(child.reads, 4)
+
+        shim.negative_ttl = 0
+        shim.get(b)
+        shim.get(b)
+        self.assertEqual(child.reads, 6)
+
+
+class TestWriteBackDatastore(TestDatastore):
+    def test_simple(self):
+        from datastore.core.stores import WriteBackDatastore
+
+        s1 = WriteBackDatastore(DictDatastore(), cache=DictDatastore(),
+                                background=False)
+        s2 = WriteBackDatastore(DictDatastore(), cache=DictDatastore(),
+                                flush_size=10, flush_interval=0.01)
+        self.subtest_simple([s1, s2])
+        s1.close()
+        s2.close()
+
+    def test_coalescing(self):
+        from datastore.core.stores import WriteBackDatastore
+
+        class CountingDatastore(DictDatastore):
+            batches = 0
+
+            def put_many(self, items):
+                self.batches += 1
+                super(CountingDatastore, self).put_many(items)
+
+        child = CountingDatastore()
+        ds = WriteBackDatastore(child, cache=DictDatastore(), background=False,
+                                flush_size=100)
+        keys = [Key(str(i)) for i in range(0, 10)]
+        for n in range(0, 5):
+            for key in keys:
+                ds.put(key, n)
+        ds.delete(keys[0])
+
+        self.assertEqual(len(child), 0)
+        self.assertEqual(ds.pending(), 10)
+        self.assertEqual(ds.stats['coalesced'], 41)
+        self.assertEqual(ds.get(keys[1]), 4)
+        self.assertFalse(ds.contains(keys[0]))
+
+        ds.flush()
+        self.assertEqual(child.batches, 1)
+        self.assertEqual(len(child), 9)
+        self.assertEqual(ds.pending(), 0)
+        self.assertEqual(child.get(keys[1]), 4)
+
+    def test_thresholds(self):
+        from datastore.core.stores import WriteBackDatastore
+
+        child = DictDatastore()
+        ds = WriteBackDatastore(child, cache=DictDatastore(), background=False,
+                                flush_size=10, max_dirty=100)
+        for i in range(0, 25):
+            ds.put(Key(str(i)), i)
+        self.assertEqual(len(child), 20)
+        self.assertEqual(ds.pending(), 5)
+
+        ds = WriteBackDatastore(child, cache=DictDatastore(),
+                                flush_size=1000, flush_interval=0.01)
+        ds.put(Key('timed'), 1)
+        deadline = time.time() + 5
+        while not child.contains(Key('timed')) and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(child.contains(Key('timed')))
+        ds.close()
+        with self.assertRaises(RuntimeError):
+            ds.put(Key('closed'), 1)
+
+    def test_concurrent_writes(self):
+        import threading
+        from datastore.core.stores import WriteBackDatastore
+
+        class SlowCache(DictDatastore):
+            stored = threading.Event()
+
+            def put(self, key, value):
+                super(SlowCache, self).put(key, value)
+                if value == 'a':
+                    self.stored.set()
+                    time.sleep(0.1)
+
+        child = DictDatastore()
+        cache = SlowCache()
+        ds = WriteBackDatastore(child, cache=cache, background=False)
+        key = Key('a')
+        writer = threading.Thread(target=ds.put, args=(key, 'a'))
+        writer.start()
+        cache.stored.wait(5)
+        ds.put(key, 'b')  # lands between the cache write and the queueing of 'a'
+        writer.join()
+        ds.flush()
+        self.assertEqual(cache.get(key), child.get(key))
+
+    def test_errors(self):
+        from datastore.core.stores import WriteBackDatastore
+
+        class FailingDatastore(DictDatastore):
+            fail = True
+
+            def put_many(self, items):
+                if self.fail:
+                    raise IOError('disk full')
+                super(FailingDatastore, self).put_many(items)
+
+        child = FailingDatastore()
+        ds = WriteBackDatastore(child, cache=DictDatastore(), background=False)
+        ds.put(Key('a'), 1)
+        with self.assertRaises(IOError):
+            ds.flush()
+        self.assertEqual(ds.pending(), 1)
+
+        child.fail = False
+        ds.close()
+        self.assertEqual(child.get(Key('a')), 1)
 
 
 class TestLoggingDatastore(TestDatastore):
@@ -804,6 +1111,153 @@ class TestDatastoreCollection(TestDatastore):
 
         self.subtest_simple([ts])
 
+    def test_tiered_batch(self):
+        from datastore.core.stores import TieredDatastore
+
+        s1 = DictDatastore()
+        s2 = DictDatastore()
+        s3 = DictDatastore()
+        ts = TieredDatastore([s1, s2, s3])
+
+        keys = [Key(str(i)) for i in range(0, 3)]
+        s1.put(keys[0], '0')
+        s2.put(keys[1], '1')
+        s3.put(keys[2], '2')
+
+        self.assertEqual(ts.contains_many(keys + [Key('4')]),
+                         [True, True, True, False])
+        self.assertEqual(ts.get_many(keys + [Key('4')]), ['0', '1', '2', None])
+        self.assertEqual(s1.get_many(keys), ['0', '1', '2'])
+        self.assertEqual(s2.get_many(keys), [None, '1', '2'])
+        self.assertEqual(s3.get_many(keys), [None, None, '2'])
+
+    def test_tiered_promotion(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from datastore.core.stores import (TieredDatastore, always_promote,
+                                           never_promote, HitCountPromotion,
+                                           ProbabilisticPromotion)
+
+        def tiers(promotion, executor=None):
+            stores = [DictDatastore(), DictDatastore(), DictDatastore()]
+            stores[2].put(Key('a'), 'a')
+            stores[2].put(Key('b'), 'b')
+            return stores, TieredDatastore(stores, promotion, executor)
+
+        stores, ts = tiers(never_promote)
+        self.assertEqual(ts.get(Key('a')), 'a')
+        self.assertEqual(ts.get_many([Key('b')]), ['b'])
+        self.assertEqual(len(stores[0]) + len(stores[1]), 0)
+
+        stores, ts = tiers(HitCountPromotion(3))
+        for i in range(0, 2):
+            self.assertEqual(ts.get(Key('a')), 'a')
+            self.assertFalse(stores[0].contains(Key('a')))
+        ts.get_many([Key('a'), Key('b')])
+        self.assertTrue(stores[0].contains(Key('a')))
+        self.assertTrue(stores[1].contains(Key('a')))
+        self.assertFalse(stores[0].contains(Key('b')))
+
+        stores, ts = tiers(ProbabilisticPromotion(0.5, random=iter([0.9, 0.1]).__next__))
+        ts.get(Key('a'))
+        self.assertFalse(stores[0].contains(Key('a')))
+        ts.get(Key('a'))
+        self.assertTrue(stores[0].contains(Key('a')))
+        self.assertEqual(ts.stats['promotions'], 1)
+
+        executor = ThreadPoolExecutor(1)
+        stores, ts = tiers(always_promote, executor)
+        self.assertEqual(ts.get(Key('a')), 'a')
+        self.assertEqual(ts.get_many([Key('b')]), ['b'])
+        executor.shutdown(wait=True)
+        self.assertEqual(stores[0].get(Key('a')), 'a')
+        self.assertEqual(stores[1].get(Key('b')), 'b')
+
+    def test_tiered_background_race(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from datastore.core.stores import TieredDatastore
+
+        class GatedExecutor(ThreadPoolExecutor):
+            gate = threading.Event()
+
+            def submit(self, fn, *args):
+                def gated():
+                    self.gate.wait()
+                    return fn(*args)
+                return super(GatedExecutor, self).submit(gated)
+
+        executor = GatedExecutor(1)
+        stores = [DictDatastore(), DictDatastore()]
+        stores[1].put(Key('a'), 'old')
+        ts = TieredDatastore(stores, executor=executor)
+        self.assertEqual(ts.get(Key('a')), 'old')
+        ts.delete(Key('a'))
+        executor.gate.set()
+        executor.shutdown(wait=True)
+
+        # the stale promotion was cancelled by the delete
+        self.assertEqual(ts.get(Key('a')), None)
+        self.assertEqual(len(stores[0]), 0)
+
+    def test_tiered_concurrent_writes(self):
+        import threading
+        from datastore.core.stores import TieredDatastore
+
+        class RacingDatastore(DictDatastore):
+            """Slow tier, where a write lands while a read is served."""
+            race = None
+
+            def get(self, key):
+                value = super(RacingDatastore, self).get(key)
+                if self.race is not None:
+                    race, self.race = self.race, None
+                    race()
+                return value
+
+            def put(self, key, value):
+                time.sleep(0.1)
+                super(RacingDatastore, self).put(key, value)
+
+        stores = [DictDatastore(), RacingDatastore()]
+        ts = TieredDatastore(stores)
+        DictDatastore.put(stores[1], Key('/a'), 'old')
+        stores[1].race = lambda: ts.put(Key('/a'), 'new')
+        ts.get(Key('/a'))  # read 'old', then 'new' was written
+        self.assertEqual(stores[0].get(Key('/a')), 'new')
+        self.assertEqual(ts.get(Key('/a')), 'new')
+
+        # writers of different keys do not wait for each other
+        start = time.monotonic()
+        writers = [threading.Thread(target=ts.put, args=(Key('/k:{}'.format(i)), i))
+                   for i in range(0, 4)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        self.assertTrue(time.monotonic() - start < 0.3)
+
+    def test_sharded_batch(self):
+        from datastore.core.stores import ShardedDatastore
+
+        class CountingDatastore(DictDatastore):
+            calls = 0
+
+            def get_many(self, keys):
+                CountingDatastore.calls += 1
+                return super(CountingDatastore, self).get_many(keys)
+
+        stores = [CountingDatastore() for i in range(0, 4)]
+        sharded = ShardedDatastore(stores, shardingfn=lambda key: int(key.name))
+        items = [(Key(str(i)), i) for i in range(0, 100)]
+        sharded.put_many(items)
+        for i, store in enumerate(stores):
+            self.assertEqual(len(store), 25)
+            self.assertTrue(store.contains(Key(str(i))))
+
+        self.assertEqual(sharded.get_many([k for k, v in items]),
+                         list(range(0, 100)))
+        self.assertEqual(CountingDatastore.calls, 4)
+
     def test_sharded(self, numelems=1000):
         # the numerous casts of int are incredibly painful
         # otherwise you end up passing a float, so that is an issue to work on
@@ -925,6 +1379,151 @@ class TestDatastoreCollection(TestDatastore):
 
         self.subtest_simple([sharded])
 
+    def replicated(self, delays, **kwargs):
+        from datastore.core.stores import ReplicatedDatastore, ShimDatastore
+
+        class SlowDatastore(ShimDatastore):
+            """Injects latency (and optionally failures) into a replica."""
+            def __init__(self, datastore, delay):
+                super(SlowDatastore, self).__init__(datastore)
+                self.delay = delay
+                self.fail = False
+                self.calls = 0
+
+            def _call(self, method, *args):
+                self.calls += 1
+                time.sleep(self.delay)
+                if self.fail:
+                    raise IOError('replica down')
+                return getattr(self.child_datastore, method)(*args)
+
+            def get(self, key):
+                return self._call('get', key)
+
+            def contains(self, key):
+                return self._call('contains', key)
+
+            def put(self, key, value):
+                return self._call('put', key, value)
+
+            def delete(self, key):
+                return self._call('delete', key)
+
+        replicas = [SlowDatastore(DictDatastore(), delay) for delay in delays]
+        return replicas, ReplicatedDatastore(replicas, **kwargs)
+
+    def test_replicated(self):
+        from datastore.core import serialize
+        from datastore.core.stores import ReplicatedDatastore
+        from datastore.filesystem import FileSystemDatastore
+
+        replicas, rs = self.replicated([0, 0, 0])
+        self.subtest_simple([rs])
+        self.assertEqual(rs.write_quorum, 2)
+        rs.close()
+
+        tmp = '/tmp/datastore.test.replicated'
+        fs = FileSystemDatastore(tmp)
+        try:
+            rs = ReplicatedDatastore([DictDatastore(), serialize.shim(fs)])
+            rs.put(Key('/a'), 'a')
+            rs.close()
+            self.assertEqual(serialize.shim(fs).get(Key('/a')), 'a')
+        finally:
+            import shutil
+            shutil.rmtree(tmp)
+
+    def test_replicated_quorum(self):
+        replicas, rs = self.replicated([0, 0, 0], write_quorum=2)
+        replicas[0].fail = True
+        rs.put(Key('/a'), 'a')
+        self.assertEqual(rs.get(Key('/a')), 'a')
+
+        replicas[1].fail = True
+        with self.assertRaises(RuntimeError):
+            rs.put(Key('/b'), 'b')
+        self.assertEqual(rs.stats['failed_writes'], 1)
+
+        # a miss on one replica is not trusted while another may have it
+        replicas[0].fail = replicas[1].fail = False
+        replicas[0].child_datastore.put(Key('/c'), 'c')
+        replicas[2].child_datastore.put(Key('/c'), 'c')
+        replicas[1].delay, replicas[2].delay = 0, 0.01
+        for i in range(0, 5):
+            self.assertEqual(rs.get(Key('/c')), 'c')
+            self.assertTrue(rs.contains(Key('/c')))
+        rs.close()
+
+    def test_replicated_latency(self):
+        replicas, rs = self.replicated([0.02, 0.001, 0.01], hedge=False)
+        rs.put(Key('/a'), 'a')
+        for i in range(0, 10):
+            rs.get(Key('/a'))
+        self.assertTrue(replicas[1].calls > 8)
+        self.assertTrue(replicas[0].calls < 3)
+        self.assertEqual(rs.replicas()[0], replicas[1])
+        rs.close()
+
+    def test_replicated_hedging(self):
+        replicas, rs = self.replicated([0.001, 0.001], write_quorum=1)
+        rs.put(Key('/a'), 'a')
+        for i in range(0, 20):
+            rs.get(Key('/a'))
+        hedged = rs.stats['hedged']  # ~5% of reads hedge at the 95th percentile
+
+        # the fastest replica stalls; a hedged read answers instead
+        fastest = rs.replicas()[0]
+        fastest.delay = 0.5
+        start = time.monotonic()
+        self.assertEqual(rs.get(Key('/a')), 'a')
+        self.assertTrue(time.monotonic() - start < 0.25)
+        self.assertEqual(rs.stats['hedged'], hedged + 1)
+        rs.close()
+
+    def test_replicated_read_repair(self):
+        replicas, rs = self.replicated([0, 0, 0], read_repair=True)
+        replicas[0].child_datastore.put(Key('/a'), 'a')
+        replicas[1].child_datastore.put(Key('/a'), 'a')
+        self.assertEqual(rs.get(Key('/a')), 'a')
+        rs.close()
+        self.assertEqual(replicas[2].child_datastore.get(Key('/a')), 'a')
+        self.assertEqual(rs.stats['repairs'], 1)
+
+    def test_replicated_false(self):
+        replicas, rs = self.replicated([0, 0.01, 0.05], write_quorum=2,
+                                       read_repair=True)
+        rs.put(Key('/a'), False)
+        self.assertIs(rs.get(Key('/a')), False)
+        self.assertTrue(rs.contains(Key('/a')))
+
+        # a stored False is a value, not one of the two misses of a quorum.
+        replicas[1].child_datastore.delete(Key('/a'))
+        self.assertIs(rs.get(Key('/a')), False)
+        rs.close()
+        self.assertIs(replicas[1].child_datastore.get(Key('/a')), False)
+
+    def test_replicated_write_order(self):
+        replicas, rs = self.replicated([0, 0, 0], write_quorum=2)
+        key = Key('/a')
+        for i in range(0, 10):
+            # earlier writes are slower to reach the last replica
+            replicas[2].delay = 0.005 * (10 - i)
+            rs.put(key, i)  # returns before the last replica has it
+        rs.delete(Key('/b'))
+        rs.close()
+        self.assertEqual([r.child_datastore.get(key) for r in replicas], [9, 9, 9])
+
+    def test_replicated_repair_after_write(self):
+        replicas, rs = self.replicated([0, 0, 0], read_repair=True)
+        key = Key('/a')
+        rs.put(key, 'a')
+        sequence = rs._sequence  # a read starts, and finds 'a'
+        rs.delete(key)
+        rs._repair(key, 'a', replicas, sequence)  # must not resurrect it
+        rs.close()
+        self.assertEqual([r.child_datastore.get(key) for r in replicas],
+                         [None, None, None])
+        self.assertEqual(rs.stats['repairs'], 0)
 
 if __name__ == '__main__':
     unittest.main()
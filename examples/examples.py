@@ -5,13 +5,13 @@ Hello Tiered Access
     >>> import datastore.core
     >>>
     >>> from datastore.impl.mongo import MongoDatastore
-    >>> from datastore.impl.lrucache import LRUCache
+    >>> from datastore.core.cache import CacheDatastore
     >>> from datastore.impl.filesystem import FileSystemDatastore
     >>>
     >>> conn = pymongo.Connection()
     >>> mongo = MongoDatastore(conn.test_db)
     >>>
-    >>> cache = LRUCache(1000)
+    >>> cache = CacheDatastore(1000)
     >>> fs = FileSystemDatastore('/tmp/.test_db')
     >>>
     >>> ds = datastore.TieredDatastore([cache, mongo, fs])